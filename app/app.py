@@ -1,55 +1,119 @@
 import asyncio
 import logging
+from datetime import timedelta
+from functools import partial
 from types import AsyncGeneratorType
 from typing import AsyncIterable
 
 from aiohttp import PAYLOAD_REGISTRY
 from aiohttp.web_app import Application
 
-from app.handlers.prices import PricesView
+from app.handlers.price_history import PriceHistoryView
+from app.handlers.prices import BatchPricesView, PricesView
 from app.payloads import AsyncGenJSONListPayload
 from app.price_updater import SkypickerProvider
-from app.price_updater.periodical_price_update import PeriodicalPriceUpdateScheduler
+from app.price_updater.confirmation_cache import PgConfirmationCache
+from app.price_updater.staggered_price_update import StaggeredPriceUpdateScheduler
+from app.price_updater.worker import PriceUpdateWorker
+from app.route_demand import setup_route_demand
+from app.snapshot import setup_prices_snapshot
 from app.utils.client_session import setup_client_session
+from app.utils.leader import LeaderElection
 from app.utils.pg import setup_pg
 
 
 log = logging.getLogger()
 
-TOP_FLIGHT_DIRECTIONS = (
-    ('ALA', 'TSE'),
-    ('TSE', 'ALA'),
-    ('ALA', 'MOW'),
-    ('MOW', 'ALA'),
-    ('ALA', 'CIT'),
-    ('CIT', 'ALA'),
-    ('TSE', 'MOW'),
-    ('MOW', 'TSE'),
-    ('TSE', 'LED'),
-    ('LED', 'TSE'),
-)
-
-NUMBER_OF_DAYS = 30
-
-
-async def update_prices_every_day(app):
-    skypicker_provider = SkypickerProvider(app['client_session'])
-    price_update_scheduler = PeriodicalPriceUpdateScheduler(
+# Horizon of jobs enqueued without one, directions and horizons
+# of prices updates are loaded from the routes table
+NUMBER_OF_DAYS = 180
+
+# Days of flights requested from the provider at once,
+# windows of a direction are refreshed one by one
+WINDOW_DAYS = 30
+
+# Windows of routes refreshed per hour at most, spread evenly over the hour
+REFRESH_TASKS_PER_HOUR = 60
+
+# Seconds between prices updates, each refreshing the most overdue windows
+REFRESH_TICK_INTERVAL = 5 * 60
+
+# Only changes of current prices are saved by prices updates,
+# staggered prices updates are always incremental
+INCREMENTAL_PRICE_UPDATES = True
+
+# Directions of prices updates are processed by workers of all processes
+DISTRIBUTED_PRICE_UPDATES = True
+
+# Directions processed at once by the worker of each process
+WORKER_CONCURRENCY = 4
+
+# Seconds one prices update may spend on confirming flights
+CONFIRMATION_BUDGET = 30 * 60
+
+# Seconds one direction may spend on confirming flights in the distributed mode
+JOB_CONFIRMATION_BUDGET = 5 * 60
+
+# Confirmation results are reused within this time, e.g. by retried updates
+CONFIRMATION_CACHE_TTL = timedelta(hours=6)
+
+
+async def start_price_updates(app):
+    skypicker_provider = SkypickerProvider(app['client_session'], stream_responses=True)
+    confirmation_cache = PgConfirmationCache(app['pg'], ttl=CONFIRMATION_CACHE_TTL)
+    price_update_scheduler = StaggeredPriceUpdateScheduler(
         pg=app['pg'],
         provider=skypicker_provider,
-        directions=TOP_FLIGHT_DIRECTIONS,
-        number_of_days=NUMBER_OF_DAYS
+        number_of_days=NUMBER_OF_DAYS,
+        window_days=WINDOW_DAYS,
+        tasks_per_hour=REFRESH_TASKS_PER_HOUR,
+        tick_interval=REFRESH_TICK_INTERVAL,
+        distributed=DISTRIBUTED_PRICE_UPDATES,
+        confirmation_budget=CONFIRMATION_BUDGET,
+        confirmation_cache=confirmation_cache,
+        on_update_completed=app['prices_snapshot'].refresh
     )
-    asyncio.create_task(price_update_scheduler.run())
+    # Only one of the processes sharing the database updates prices,
+    # the rest only serve them
+    leader_election = LeaderElection(app['pg'], name='price_update_scheduler')
+    app['price_updates'] = asyncio.create_task(
+        leader_election.run(on_elected=price_update_scheduler.run, on_deposed=price_update_scheduler.stop)
+    )
+    app['price_update_workers'] = []
+    if DISTRIBUTED_PRICE_UPDATES:
+        # Every process processes directions of the updates, whichever is the leader
+        worker = PriceUpdateWorker(
+            pg=app['pg'],
+            provider=skypicker_provider,
+            number_of_days=NUMBER_OF_DAYS,
+            concurrency=WORKER_CONCURRENCY,
+            window_days=WINDOW_DAYS,
+            incremental=INCREMENTAL_PRICE_UPDATES,
+            confirmation_budget=JOB_CONFIRMATION_BUDGET,
+            confirmation_cache=confirmation_cache,
+        )
+        app['price_update_workers'].append(asyncio.create_task(worker.run()))
+
+
+async def stop_price_updates(app):
+    tasks = [app['price_updates'], *app['price_update_workers']]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
 
 def create_app():
     app = Application()
     app.cleanup_ctx.append(setup_pg)
     app.cleanup_ctx.append(setup_client_session)
-    app.on_startup.append(update_prices_every_day)
+    app.cleanup_ctx.append(setup_route_demand)
+    app.cleanup_ctx.append(partial(setup_prices_snapshot, incremental=INCREMENTAL_PRICE_UPDATES))
+    app.on_startup.append(start_price_updates)
+    app.on_shutdown.append(stop_price_updates)
 
     app.router.add_route('*', '/prices', PricesView)
+    app.router.add_route('*', '/prices/batch', BatchPricesView)
+    app.router.add_route('*', '/prices/history', PriceHistoryView)
 
     PAYLOAD_REGISTRY.register(AsyncGenJSONListPayload,
                               (AsyncGeneratorType, AsyncIterable))
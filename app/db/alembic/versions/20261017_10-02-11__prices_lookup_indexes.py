@@ -0,0 +1,28 @@
+"""Prices lookup indexes
+
+Revision ID: 3f9a1c2d8e47
+Revises: 7c4d7be6b78a
+Create Date: 2026-10-17 10:02:11.318220
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2d8e47'
+down_revision = '7c4d7be6b78a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix__price_updates__status_created_at', 'price_updates',
+                    ['status', 'created_at'], unique=False)
+    op.create_index('ix__flights__update_id_direction_departure_date', 'flights',
+                    ['update_id', 'city_code_from', 'city_code_to', 'departure_date'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix__flights__update_id_direction_departure_date', table_name='flights')
+    op.drop_index('ix__price_updates__status_created_at', table_name='price_updates')
@@ -0,0 +1,32 @@
+"""Flight confirmations
+
+Revision ID: 8b2e5d0f6a13
+Revises: 3f9a1c2d8e47
+Create Date: 2026-10-17 11:24:37.502914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e5d0f6a13'
+down_revision = '3f9a1c2d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('flight_confirmations',
+    sa.Column('booking_token_hash', sa.String(length=64), nullable=False),
+    sa.Column('confirmed', sa.Boolean(), nullable=False),
+    sa.Column('checked_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('booking_token_hash', name=op.f('pk__flight_confirmations'))
+    )
+    op.create_index('ix__flight_confirmations__checked_at', 'flight_confirmations',
+                    ['checked_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix__flight_confirmations__checked_at', table_name='flight_confirmations')
+    op.drop_table('flight_confirmations')
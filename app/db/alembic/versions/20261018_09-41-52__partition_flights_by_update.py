@@ -0,0 +1,91 @@
+"""Partition flights by update
+
+Revision ID: d41e7a9c0b25
+Revises: 8b2e5d0f6a13
+Create Date: 2026-10-18 09:41:52.174306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41e7a9c0b25'
+down_revision = '8b2e5d0f6a13'
+branch_labels = None
+depends_on = None
+
+
+FLIGHTS_COLUMNS = 'id, update_id, city_code_from, city_code_to, departure_date, price, booking_token'
+
+
+def rename_flights_table(new_name):
+    op.rename_table('flights', new_name)
+    op.execute(f'ALTER TABLE {new_name} RENAME CONSTRAINT pk__flights TO pk__{new_name}')
+    op.execute(f'ALTER TABLE {new_name} RENAME CONSTRAINT fk__flights__update_id__price_updates '
+               f'TO fk__{new_name}__update_id__price_updates')
+    op.execute(f'ALTER SEQUENCE flights_id_seq RENAME TO {new_name}_id_seq')
+
+
+def upgrade():
+    op.drop_index('ix__flights__update_id_direction_departure_date', table_name='flights')
+    rename_flights_table('flights_unpartitioned')
+
+    op.create_table('flights',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('update_id', sa.Integer(), nullable=False),
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('departure_date', sa.Date(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('booking_token', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['update_id'], ['price_updates.id'], name=op.f('fk__flights__update_id__price_updates')),
+    sa.PrimaryKeyConstraint('id', 'update_id', name=op.f('pk__flights')),
+    postgresql_partition_by='LIST (update_id)'
+    )
+    op.create_index('ix__flights__direction_departure_date', 'flights',
+                    ['city_code_from', 'city_code_to', 'departure_date'], unique=False)
+
+    # Flights without an update can't be reached through the API, they are dropped
+    op.execute('''
+        DO $$
+        DECLARE
+            partition_update_id integer;
+        BEGIN
+            FOR partition_update_id IN
+                SELECT DISTINCT update_id FROM flights_unpartitioned WHERE update_id IS NOT NULL
+            LOOP
+                EXECUTE 'CREATE TABLE flights_' || partition_update_id
+                        || ' PARTITION OF flights FOR VALUES IN (' || partition_update_id || ')';
+            END LOOP;
+        END
+        $$
+    ''')
+    op.execute(f'INSERT INTO flights ({FLIGHTS_COLUMNS}) '
+               f'SELECT {FLIGHTS_COLUMNS} FROM flights_unpartitioned WHERE update_id IS NOT NULL')
+    op.execute("SELECT setval('flights_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM flights), false)")
+    op.drop_table('flights_unpartitioned')
+
+
+def downgrade():
+    rename_flights_table('flights_partitioned')
+
+    op.create_table('flights',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('update_id', sa.Integer(), nullable=True),
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('departure_date', sa.Date(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('booking_token', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['update_id'], ['price_updates.id'], name=op.f('fk__flights__update_id__price_updates')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__flights'))
+    )
+    op.execute(f'INSERT INTO flights ({FLIGHTS_COLUMNS}) '
+               f'SELECT {FLIGHTS_COLUMNS} FROM flights_partitioned')
+    op.execute("SELECT setval('flights_id_seq', (SELECT coalesce(max(id), 0) + 1 FROM flights), false)")
+    # Partitions are dropped together with the partitioned table
+    op.drop_table('flights_partitioned')
+    op.create_index('ix__flights__update_id_direction_departure_date', 'flights',
+                    ['update_id', 'city_code_from', 'city_code_to', 'departure_date'],
+                    unique=False)
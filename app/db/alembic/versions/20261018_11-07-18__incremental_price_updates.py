@@ -0,0 +1,63 @@
+"""Incremental price updates
+
+Revision ID: 5c0f83b1e9d6
+Revises: d41e7a9c0b25
+Create Date: 2026-10-18 11:07:18.640271
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0f83b1e9d6'
+down_revision = 'd41e7a9c0b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('current_prices',
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('departure_date', sa.Date(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('booking_token', sa.String(), nullable=False),
+    sa.Column('update_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['update_id'], ['price_updates.id'],
+                            name=op.f('fk__current_prices__update_id__price_updates')),
+    sa.PrimaryKeyConstraint('city_code_from', 'city_code_to', 'departure_date', name=op.f('pk__current_prices'))
+    )
+    op.create_table('price_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('update_id', sa.Integer(), nullable=False),
+    sa.Column('change_type', sa.Enum('inserted', 'changed', 'removed', name='change_type'), nullable=False),
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('departure_date', sa.Date(), nullable=False),
+    sa.Column('price', sa.Numeric(precision=10, scale=2), nullable=True),
+    sa.Column('booking_token', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['update_id'], ['price_updates.id'],
+                            name=op.f('fk__price_changes__update_id__price_updates')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__price_changes'))
+    )
+    op.create_index('ix__price_changes__update_id', 'price_changes', ['update_id'], unique=False)
+
+    # Incremental updates start from the latest completed snapshot
+    op.execute('''
+        INSERT INTO current_prices (city_code_from, city_code_to, departure_date, price, booking_token, update_id)
+        SELECT DISTINCT ON (city_code_from, city_code_to, departure_date)
+               city_code_from, city_code_to, departure_date, price, booking_token, update_id
+        FROM flights
+        WHERE update_id = (
+            SELECT id FROM price_updates WHERE status = 'completed' ORDER BY created_at DESC LIMIT 1
+        )
+        ORDER BY city_code_from, city_code_to, departure_date, price
+    ''')
+
+
+def downgrade():
+    op.drop_index('ix__price_changes__update_id', table_name='price_changes')
+    op.drop_table('price_changes')
+    op.drop_table('current_prices')
+    sa.Enum(name='change_type').drop(op.get_bind(), checkfirst=False)
@@ -0,0 +1,67 @@
+"""Price history
+
+Revision ID: a7e2c49d1f80
+Revises: 5c0f83b1e9d6
+Create Date: 2026-10-18 13:22:05.913847
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e2c49d1f80'
+down_revision = '5c0f83b1e9d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('price_history',
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('departure_date', sa.Date(), nullable=False),
+    sa.Column('observed_on', sa.Date(), nullable=False),
+    sa.Column('price_cents', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('city_code_from', 'city_code_to', 'departure_date', 'observed_on',
+                            name=op.f('pk__price_history'))
+    )
+    op.create_table('price_history_rollups',
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('observed_on', sa.Date(), nullable=False),
+    sa.Column('min_price_cents', sa.Integer(), nullable=False),
+    sa.Column('max_price_cents', sa.Integer(), nullable=False),
+    sa.Column('sum_price_cents', sa.BigInteger(), nullable=False),
+    sa.Column('prices_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('city_code_from', 'city_code_to', 'observed_on',
+                            name=op.f('pk__price_history_rollups'))
+    )
+
+    # Snapshots which are still kept become the history,
+    # the latest completed update of a day wins
+    op.execute('''
+        INSERT INTO price_history (city_code_from, city_code_to, departure_date, observed_on, price_cents)
+        SELECT DISTINCT ON (flights.city_code_from, flights.city_code_to, flights.departure_date,
+                            price_updates.created_at::date)
+               flights.city_code_from, flights.city_code_to, flights.departure_date,
+               price_updates.created_at::date, round(flights.price * 100)::integer
+        FROM flights
+        JOIN price_updates ON price_updates.id = flights.update_id
+        WHERE price_updates.status = 'completed'
+        ORDER BY flights.city_code_from, flights.city_code_to, flights.departure_date,
+                 price_updates.created_at::date, price_updates.created_at DESC, flights.price
+    ''')
+    op.execute('''
+        INSERT INTO price_history_rollups (city_code_from, city_code_to, observed_on, min_price_cents,
+                                           max_price_cents, sum_price_cents, prices_count)
+        SELECT city_code_from, city_code_to, observed_on, min(price_cents),
+               max(price_cents), sum(price_cents), count(*)
+        FROM price_history
+        GROUP BY city_code_from, city_code_to, observed_on
+    ''')
+
+
+def downgrade():
+    op.drop_table('price_history_rollups')
+    op.drop_table('price_history')
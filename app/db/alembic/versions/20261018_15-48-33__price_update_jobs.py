@@ -0,0 +1,47 @@
+"""Price update jobs
+
+Revision ID: 2b6d90e4c3a1
+Revises: a7e2c49d1f80
+Create Date: 2026-10-18 15:48:33.207519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '2b6d90e4c3a1'
+down_revision = 'a7e2c49d1f80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('price_update_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('update_id', sa.Integer(), nullable=False),
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('status', postgresql.ENUM('pending', 'in_process', 'completed', 'failed',
+                                        name='stauts', create_type=False), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('claim_token', sa.String(length=32), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('flights_saved', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['update_id'], ['price_updates.id'],
+                            name=op.f('fk__price_update_jobs__update_id__price_updates')),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk__price_update_jobs')),
+    sa.UniqueConstraint('update_id', 'city_code_from', 'city_code_to',
+                        name=op.f('uq__price_update_jobs__update_id_city_code_from_city_code_to'))
+    )
+    op.create_index('ix__price_update_jobs__status_id', 'price_update_jobs',
+                    ['status', 'id'], unique=False)
+    op.create_index('ix__price_update_jobs__update_id_status', 'price_update_jobs',
+                    ['update_id', 'status'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix__price_update_jobs__update_id_status', table_name='price_update_jobs')
+    op.drop_index('ix__price_update_jobs__status_id', table_name='price_update_jobs')
+    op.drop_table('price_update_jobs')
@@ -0,0 +1,52 @@
+"""Routes
+
+Revision ID: 9e3f1b7a5c62
+Revises: 2b6d90e4c3a1
+Create Date: 2026-10-18 17:05:44.613028
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3f1b7a5c62'
+down_revision = '2b6d90e4c3a1'
+branch_labels = None
+depends_on = None
+
+# Directions which were hardcoded in the app
+TOP_FLIGHT_DIRECTIONS = (
+    ('ALA', 'TSE'),
+    ('TSE', 'ALA'),
+    ('ALA', 'MOW'),
+    ('MOW', 'ALA'),
+    ('ALA', 'CIT'),
+    ('CIT', 'ALA'),
+    ('TSE', 'MOW'),
+    ('MOW', 'TSE'),
+    ('TSE', 'LED'),
+    ('LED', 'TSE'),
+)
+
+
+def upgrade():
+    routes_table = op.create_table('routes',
+    sa.Column('city_code_from', sa.String(length=3), nullable=False),
+    sa.Column('city_code_to', sa.String(length=3), nullable=False),
+    sa.Column('number_of_days', sa.Integer(), server_default=sa.text('180'), nullable=False),
+    sa.Column('refresh_interval', sa.Interval(), server_default=sa.text("'1 day'"), nullable=False),
+    sa.Column('enabled', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('city_code_from', 'city_code_to', name=op.f('pk__routes'))
+    )
+    op.bulk_insert(routes_table, [
+        {'city_code_from': city_code_from, 'city_code_to': city_code_to}
+        for city_code_from, city_code_to in TOP_FLIGHT_DIRECTIONS
+    ])
+    op.add_column('price_update_jobs', sa.Column('number_of_days', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('price_update_jobs', 'number_of_days')
+    op.drop_table('routes')
@@ -0,0 +1,28 @@
+"""Route demand and job date spans
+
+Revision ID: 4d8c2a6e0f17
+Revises: 9e3f1b7a5c62
+Create Date: 2026-10-18 19:12:36.480173
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8c2a6e0f17'
+down_revision = '9e3f1b7a5c62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('routes', sa.Column('demand', sa.Float(), server_default=sa.text('0'), nullable=False))
+    op.add_column('price_update_jobs', sa.Column('date_from', sa.Date(), nullable=True))
+    op.add_column('price_update_jobs', sa.Column('date_to', sa.Date(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('price_update_jobs', 'date_to')
+    op.drop_column('price_update_jobs', 'date_from')
+    op.drop_column('routes', 'demand')
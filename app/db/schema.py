@@ -2,8 +2,8 @@ import datetime
 from enum import Enum, unique
 
 from sqlalchemy import (
-    Column, Date, Enum as PgEnum, ForeignKey, Integer,
-    MetaData, String, Table, Numeric, DateTime)
+    BigInteger, Boolean, Column, Date, Enum as PgEnum, ForeignKey, Index, Integer, Interval,
+    MetaData, String, Table, Numeric, DateTime, Float, UniqueConstraint, text)
 
 
 convention = {
@@ -28,22 +28,145 @@ class Status(Enum):
     failed = 'failed'
 
 
+@unique
+class ChangeType(Enum):
+    inserted = 'inserted'
+    changed = 'changed'
+    removed = 'removed'
+
+
 price_updates_table = Table(
     'price_updates',
     metadata,
     Column('id', Integer, primary_key=True),
     Column('status', PgEnum(Status, name='stauts'), nullable=False, default=Status.pending.value),
-    Column('created_at', DateTime, nullable=False, default=datetime.datetime.utcnow)
+    Column('created_at', DateTime, nullable=False, default=datetime.datetime.utcnow),
+    # Lookup of the latest completed update
+    Index('ix__price_updates__status_created_at', 'status', 'created_at'),
 )
 
+# Flights of each update are kept in a separate partition named flights_<update_id>,
+# so that old snapshots are removed by dropping their partitions
 flights_table = Table(
     'flights',
     metadata,
-    Column('id', Integer, primary_key=True),
-    Column('update_id', Integer, ForeignKey('price_updates.id')),
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('update_id', Integer, ForeignKey('price_updates.id'), primary_key=True),
     Column('city_code_from', String(3), nullable=False),
     Column('city_code_to', String(3), nullable=False),
     Column('departure_date', Date, nullable=False),
     Column('price', Numeric(precision=10, scale=2), nullable=False),
     Column('booking_token', String, nullable=False),
+    # Flights of a partition by direction, ordered by date
+    Index('ix__flights__direction_departure_date',
+          'city_code_from', 'city_code_to', 'departure_date'),
+    postgresql_partition_by='LIST (update_id)',
+)
+
+flight_confirmations_table = Table(
+    'flight_confirmations',
+    metadata,
+    Column('booking_token_hash', String(64), primary_key=True),
+    Column('confirmed', Boolean, nullable=False),
+    Column('checked_at', DateTime, nullable=False, default=datetime.datetime.utcnow),
+    # Eviction of expired confirmations
+    Index('ix__flight_confirmations__checked_at', 'checked_at'),
+)
+
+# Cheapest price of each direction and date, maintained in place
+# by incremental price updates
+current_prices_table = Table(
+    'current_prices',
+    metadata,
+    Column('city_code_from', String(3), primary_key=True),
+    Column('city_code_to', String(3), primary_key=True),
+    Column('departure_date', Date, primary_key=True),
+    Column('price', Numeric(precision=10, scale=2), nullable=False),
+    Column('booking_token', String, nullable=False),
+    # Update which set the price
+    Column('update_id', Integer, ForeignKey('price_updates.id'), nullable=False),
+)
+
+# Changes of current prices made by each incremental price update,
+# price and booking token are empty for removed prices
+price_changes_table = Table(
+    'price_changes',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('update_id', Integer, ForeignKey('price_updates.id'), nullable=False),
+    Column('change_type', PgEnum(ChangeType, name='change_type'), nullable=False),
+    Column('city_code_from', String(3), nullable=False),
+    Column('city_code_to', String(3), nullable=False),
+    Column('departure_date', Date, nullable=False),
+    Column('price', Numeric(precision=10, scale=2)),
+    Column('booking_token', String),
+    # Changes of an update
+    Index('ix__price_changes__update_id', 'update_id'),
+)
+
+# Cheapest price of each direction and departure date observed on each day
+price_history_table = Table(
+    'price_history',
+    metadata,
+    Column('city_code_from', String(3), primary_key=True),
+    Column('city_code_to', String(3), primary_key=True),
+    Column('departure_date', Date, primary_key=True),
+    Column('observed_on', Date, primary_key=True),
+    Column('price_cents', Integer, nullable=False),
+)
+
+# Aggregates of prices of all departure dates of a direction observed on each day
+price_history_rollups_table = Table(
+    'price_history_rollups',
+    metadata,
+    Column('city_code_from', String(3), primary_key=True),
+    Column('city_code_to', String(3), primary_key=True),
+    Column('observed_on', Date, primary_key=True),
+    Column('min_price_cents', Integer, nullable=False),
+    Column('max_price_cents', Integer, nullable=False),
+    Column('sum_price_cents', BigInteger, nullable=False),
+    Column('prices_count', Integer, nullable=False),
+)
+
+# Directions of price updates processed by workers, one job per direction
+price_update_jobs_table = Table(
+    'price_update_jobs',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('update_id', Integer, ForeignKey('price_updates.id'), nullable=False),
+    Column('city_code_from', String(3), nullable=False),
+    Column('city_code_to', String(3), nullable=False),
+    Column('status', PgEnum(Status, name='stauts'), nullable=False, default=Status.pending.value),
+    Column('attempts', Integer, nullable=False, default=0),
+    # Identifies the latest claim of the job, a worker whose claim expired
+    # and was taken over can't complete the job
+    Column('claim_token', String(32)),
+    Column('claimed_at', DateTime),
+    Column('flights_saved', Integer, nullable=False, default=0),
+    # Horizon of the route of the job, the worker's default if empty
+    Column('number_of_days', Integer),
+    # Departure dates of a job which refreshes a part of its route
+    Column('date_from', Date),
+    Column('date_to', Date),
+    UniqueConstraint('update_id', 'city_code_from', 'city_code_to'),
+    # Claiming of pending jobs and progress of an update
+    Index('ix__price_update_jobs__status_id', 'status', 'id'),
+    Index('ix__price_update_jobs__update_id_status', 'update_id', 'status'),
+)
+
+# Directions monitored by price updates, each with its own horizon
+# and refresh interval, changes are picked up by the next update
+routes_table = Table(
+    'routes',
+    metadata,
+    Column('city_code_from', String(3), primary_key=True),
+    Column('city_code_to', String(3), primary_key=True),
+    # Flights departing within this many days are monitored
+    Column('number_of_days', Integer, nullable=False, server_default=text('180')),
+    Column('refresh_interval', Interval, nullable=False, server_default=text("'1 day'")),
+    Column('enabled', Boolean, nullable=False, server_default=text('true')),
+    # Decaying count of requests of prices of the route
+    Column('demand', Float, nullable=False, server_default=text('0')),
+    # When the latest completed update which processed the route was started
+    Column('refreshed_at', DateTime),
 )
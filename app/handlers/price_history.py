@@ -0,0 +1,119 @@
+from datetime import date
+from typing import Dict, Iterable, Mapping, Optional
+
+from aiohttp.web_exceptions import HTTPBadRequest
+from aiohttp.web_response import json_response
+from aiohttp.web_urldispatcher import View
+
+from app.db.schema import price_history_rollups_table, price_history_table
+from app.payloads import dumps
+
+# Longest range of observation days of one request
+MAX_HISTORY_DAYS = 366
+
+
+def cents_to_price(cents: Optional[float]) -> Optional[float]:
+    return None if cents is None else round(cents / 100, 2)
+
+
+def aggregate_rollups(rollups: Iterable[Mapping]) -> Dict[str, Optional[float]]:
+    """
+    Merge daily rollups of a direction into aggregates of the whole range.
+    """
+    min_cents = max_cents = None
+    sum_cents = count = 0
+    for rollup in rollups:
+        if min_cents is None or rollup['min_price_cents'] < min_cents:
+            min_cents = rollup['min_price_cents']
+        if max_cents is None or rollup['max_price_cents'] > max_cents:
+            max_cents = rollup['max_price_cents']
+        sum_cents += rollup['sum_price_cents']
+        count += rollup['prices_count']
+    return {
+        'min_price': cents_to_price(min_cents),
+        'avg_price': cents_to_price(sum_cents / count if count else None),
+        'max_price': cents_to_price(max_cents),
+        'prices_count': count,
+    }
+
+
+class PriceHistoryView(View):
+    """
+    Trend of prices of a direction observed within a range of days:
+    daily min/avg/max of prices of all departure dates, or a trajectory
+    of the price of one departure date if it's given.
+    """
+
+    async def get(self):
+        city_from = self.request.query.get('city_from')
+        city_to = self.request.query.get('city_to')
+        if not city_from or not city_to:
+            raise HTTPBadRequest(text='city_from and city_to are required')
+        date_from = self._get_date('date_from', required=True)
+        date_to = self._get_date('date_to', required=True)
+        departure_date = self._get_date('departure_date')
+        if date_from > date_to:
+            raise HTTPBadRequest(text='date_from must not be after date_to')
+        if (date_to - date_from).days >= MAX_HISTORY_DAYS:
+            raise HTTPBadRequest(text=f'Range must be shorter than {MAX_HISTORY_DAYS} days')
+
+        if departure_date is None:
+            rollups = await self.request.app['pg'].fetch(
+                self._get_rollups_query(city_from, city_to, date_from, date_to)
+            )
+            data = [{
+                'observed_on': rollup['observed_on'],
+                'min_price': cents_to_price(rollup['min_price_cents']),
+                'avg_price': cents_to_price(rollup['sum_price_cents'] / rollup['prices_count']),
+                'max_price': cents_to_price(rollup['max_price_cents']),
+                'prices_count': rollup['prices_count'],
+            } for rollup in rollups]
+            aggregates = aggregate_rollups(rollups)
+        else:
+            prices = await self.request.app['pg'].fetch(
+                self._get_trajectory_query(city_from, city_to, departure_date, date_from, date_to)
+            )
+            data = [{
+                'observed_on': price['observed_on'],
+                'price': cents_to_price(price['price_cents']),
+            } for price in prices]
+            # Each price is a rollup of itself
+            aggregates = aggregate_rollups({
+                'min_price_cents': price['price_cents'],
+                'max_price_cents': price['price_cents'],
+                'sum_price_cents': price['price_cents'],
+                'prices_count': 1,
+            } for price in prices)
+
+        return json_response({'data': data, 'aggregates': aggregates}, dumps=dumps)
+
+    def _get_date(self, name: str, required: bool = False) -> Optional[date]:
+        value = self.request.query.get(name)
+        if not value:
+            if required:
+                raise HTTPBadRequest(text=f'{name} is required')
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise HTTPBadRequest(text=f'{name} must be a date in YYYY-MM-DD format')
+
+    @classmethod
+    def _get_rollups_query(cls, city_from: str, city_to: str, date_from: date, date_to: date):
+        rollups = price_history_rollups_table
+        return rollups.select() \
+            .where(rollups.c.city_code_from == city_from) \
+            .where(rollups.c.city_code_to == city_to) \
+            .where(rollups.c.observed_on.between(date_from, date_to)) \
+            .order_by(rollups.c.observed_on)
+
+    @classmethod
+    def _get_trajectory_query(cls, city_from: str, city_to: str, departure_date: date,
+                              date_from: date, date_to: date):
+        history = price_history_table
+        return history.select() \
+            .where(history.c.city_code_from == city_from) \
+            .where(history.c.city_code_to == city_to) \
+            .where(history.c.departure_date == departure_date) \
+            .where(history.c.observed_on.between(date_from, date_to)) \
+            .order_by(history.c.observed_on)
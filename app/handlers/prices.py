@@ -1,11 +1,107 @@
+import base64
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
 from http import HTTPStatus
+from typing import AsyncIterator, Any, List, NamedTuple, Optional
 
-from aiohttp.web_response import Response
+from aiohttp import hdrs
+from aiohttp.web_app import Application
+from aiohttp.web_exceptions import HTTPBadRequest
+from aiohttp.web_response import Response, json_response
 from aiohttp.web_urldispatcher import View
-from sqlalchemy import desc
 
-from app.db.schema import price_updates_table, Status, flights_table
-from app.utils.pg import SelectQuery
+from app.payloads import dumps
+from app.snapshot import PageKey, PricesSnapshot
+
+# Flights of a page if limit isn't given, and at most
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# Routes of one batch request at most
+MAX_BATCH_ROUTES = 100
+
+# Any of these switches the response to pages of flights ordered
+# by direction and departure date, with a cursor of the next page
+PAGE_PARAMS = ('date_from', 'date_to', 'max_price', 'limit', 'cursor')
+
+
+def encode_cursor(key: PageKey) -> str:
+    city_code_from, city_code_to, departure_date = key
+    value = json.dumps([city_code_from, city_code_to, departure_date.isoformat()])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> PageKey:
+    """
+    :raise ValueError: if the cursor wasn't made by encode_cursor
+    """
+    try:
+        city_code_from, city_code_to, departure_date = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(city_code_from), str(city_code_to), date.fromisoformat(departure_date)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+class BatchRoute(NamedTuple):
+    city_from: str
+    city_to: str
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+
+
+def parse_batch_routes(document: Any) -> List[BatchRoute]:
+    """
+    :param document: {"routes": [{"city_from": ..., "city_to": ...,
+                     "date_from": ..., "date_to": ...}, ...]},
+                     dates are optional
+    :raise ValueError: if the document is malformed
+    """
+    routes = document.get('routes') if isinstance(document, dict) else None
+    if not isinstance(routes, list) or not routes:
+        raise ValueError('routes must be a non-empty list')
+    if len(routes) > MAX_BATCH_ROUTES:
+        raise ValueError(f'routes must contain {MAX_BATCH_ROUTES} routes at most')
+
+    result = []
+    for route in routes:
+        if not isinstance(route, dict):
+            raise ValueError('each route must be an object')
+        city_from, city_to = route.get('city_from'), route.get('city_to')
+        if not isinstance(city_from, str) or not isinstance(city_to, str) or not city_from or not city_to:
+            raise ValueError('city_from and city_to of each route are required')
+        try:
+            dates = [date.fromisoformat(route[name]) if route.get(name) else None for name in ('date_from', 'date_to')]
+        except (TypeError, ValueError):
+            raise ValueError('date_from and date_to must be dates in YYYY-MM-DD format')
+        if dates[0] and dates[1] and dates[0] > dates[1]:
+            raise ValueError('date_from must not be after date_to')
+        result.append(BatchRoute(city_from, city_to, *dates))
+    return result
+
+
+async def iter_route_prices(snapshot: PricesSnapshot, routes: List[BatchRoute]) -> AsyncIterator[dict]:
+    """
+    Flights of each route grouped by route, in the order of routes.
+    """
+    for route in routes:
+        yield {
+            'city_from': route.city_from,
+            'city_to': route.city_to,
+            'date_from': route.date_from,
+            'date_to': route.date_to,
+            'data': snapshot.get_direction_flights(*route),
+        }
+
+
+def count_route_demand(app: Application, city_from: str, city_to: str):
+    """
+    Only directions of the current snapshot are counted,
+    so that requests of arbitrary cities don't grow the counter.
+    """
+    snapshot = app['prices_snapshot'].snapshot
+    if snapshot is not None and snapshot.has_direction(city_from, city_to):
+        app['route_demand'].count(city_from, city_to)
 
 
 class PricesView(View):
@@ -14,27 +110,110 @@ class PricesView(View):
         city_from = self.request.query.get('city_from', None)
         city_to = self.request.query.get('city_to', None)
 
-        last_update = await self._get_last_update()
-        if not last_update:
+        if city_from and city_to:
+            count_route_demand(self.request.app, city_from, city_to)
+
+        if any(name in self.request.query for name in PAGE_PARAMS):
+            return await self._get_page(city_from, city_to)
+
+        body = await self.request.app['prices_snapshot'].get_body(city_from, city_to)
+        if body is None:
+            return Response(status=HTTPStatus.ACCEPTED)
+
+        headers = {
+            hdrs.ETAG: body.etag,
+            hdrs.VARY: hdrs.ACCEPT_ENCODING,
+            hdrs.CACHE_CONTROL: 'no-cache',
+        }
+        if body.matches(self.request.headers.get(hdrs.IF_NONE_MATCH)):
+            return Response(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+        coding = body.negotiate(self.request.headers.get(hdrs.ACCEPT_ENCODING))
+        if coding != 'identity':
+            headers[hdrs.CONTENT_ENCODING] = coding
+        return Response(body=body.codings[coding], headers=headers,
+                        content_type='application/json')
+
+    async def _get_page(self, city_from: Optional[str], city_to: Optional[str]):
+        """
+        Page of flights served from the snapshot, the cursor of the next
+        page is valid for the next snapshots as well.
+        """
+        date_from = self._get_date('date_from')
+        date_to = self._get_date('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise HTTPBadRequest(text='date_from must not be after date_to')
+        max_price = self._get_max_price()
+        limit = self._get_limit()
+        cursor = self.request.query.get('cursor')
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPBadRequest(text='cursor is invalid')
+
+        snapshot = self.request.app['prices_snapshot'].snapshot
+        if snapshot is None:
+            return Response(status=HTTPStatus.ACCEPTED)
+
+        flights, next_key = snapshot.get_page(city_from, city_to, date_from, date_to, max_price, after, limit)
+        return json_response(
+            {'data': flights, 'next_cursor': encode_cursor(next_key) if next_key else None},
+            headers={hdrs.ETAG: snapshot.etag, hdrs.CACHE_CONTROL: 'no-cache'},
+            dumps=dumps,
+        )
+
+    def _get_date(self, name: str) -> Optional[date]:
+        value = self.request.query.get(name)
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise HTTPBadRequest(text=f'{name} must be a date in YYYY-MM-DD format')
+
+    def _get_max_price(self) -> Optional[Decimal]:
+        value = self.request.query.get('max_price')
+        if not value:
+            return None
+        try:
+            max_price = Decimal(value)
+        except InvalidOperation:
+            raise HTTPBadRequest(text='max_price must be a number')
+        if not max_price.is_finite():
+            raise HTTPBadRequest(text='max_price must be a number')
+        return max_price
+
+    def _get_limit(self) -> int:
+        value = self.request.query.get('limit')
+        if not value:
+            return DEFAULT_PAGE_LIMIT
+        try:
+            limit = int(value)
+        except ValueError:
+            raise HTTPBadRequest(text='limit must be an integer')
+        if not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise HTTPBadRequest(text=f'limit must be from 1 to {MAX_PAGE_LIMIT}')
+        return limit
+
+
+class BatchPricesView(View):
+    """
+    Flights of many routes at once, e.g. of a dashboard, all of them
+    from the same snapshot. Groups of routes are streamed one by one.
+    """
+
+    async def post(self):
+        try:
+            routes = parse_batch_routes(await self.request.json())
+        except ValueError as e:
+            raise HTTPBadRequest(text=str(e))
+
+        for route in routes:
+            count_route_demand(self.request.app, route.city_from, route.city_to)
+
+        snapshot = self.request.app['prices_snapshot'].snapshot
+        if snapshot is None:
             return Response(status=HTTPStatus.ACCEPTED)
 
-        body = SelectQuery(self._get_flights_query(city_from, city_to, last_update['id']),
-                           self.request.app['pg'].transaction())
-
-        return Response(body=body)
-
-    async def _get_last_update(self):
-        last_update_query = price_updates_table.select() \
-            .where(price_updates_table.c.status == Status.completed.value) \
-            .order_by(desc(price_updates_table.c.created_at))
-        return await self.request.app['pg'].fetchrow(last_update_query)
-
-    @classmethod
-    def _get_flights_query(cls, city_from, city_to, update_id):
-        query = flights_table.select()\
-            .where(flights_table.c.update_id == update_id)
-        if city_from:
-            query = query.where(flights_table.c.city_code_from == city_from)
-        if city_to:
-            query = query.where(flights_table.c.city_code_to == city_to)
-        return query
+        return Response(body=iter_route_prices(snapshot, routes),
+                        headers={hdrs.ETAG: snapshot.etag})
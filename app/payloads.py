@@ -1,8 +1,11 @@
+import gzip
 import json
 from datetime import date
 from decimal import Decimal
 from functools import singledispatch, partial
+from typing import Iterable, Dict, Optional
 
+import brotli
 from aiohttp import Payload
 from asyncpg.protocol.protocol import Record
 
@@ -58,3 +61,76 @@ class AsyncGenJSONListPayload(Payload):
             await writer.write(dumps(row).encode(self._encoding))
 
         await writer.write(b']}')
+
+
+class EncodedJSON:
+    """
+    JSON document which is serialized and compressed once and then served
+    as is for every request.
+    """
+    __slots__ = ('etag', 'codings')
+
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5
+
+    def __init__(self, body: bytes, etag: str):
+        self.etag = etag
+        self.codings: Dict[str, bytes] = {
+            'identity': body,
+            'gzip': gzip.compress(body, compresslevel=self.GZIP_LEVEL),
+            'br': brotli.compress(body, quality=self.BROTLI_QUALITY),
+        }
+
+    @property
+    def size(self) -> int:
+        """
+        :return: bytes taken by the document in all content codings
+        """
+        return sum(len(body) for body in self.codings.values())
+
+    @classmethod
+    def from_rows(cls, rows: Iterable, etag: str,
+                  root_object: str = 'data', encoding: str = 'utf-8') -> 'EncodedJSON':
+        """
+        Serializes rows the same way AsyncGenJSONListPayload does.
+        """
+        body = b','.join(dumps(row).encode(encoding) for row in rows)
+        return cls(b'{"%s":[%s]}' % (root_object.encode(encoding), body), etag)
+
+    def negotiate(self, accept_encoding: Optional[str]) -> str:
+        """
+        Choose content coding acceptable by a client, preferring the smallest.
+        :return: name of the content coding, 'identity' if nothing else fits
+        """
+        accepted = set()
+        refused = set()
+        for item in (accept_encoding or '').split(','):
+            coding, _, params = item.strip().partition(';')
+            params = params.replace(' ', '')
+            if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+                refused.add(coding.lower())
+                continue
+            accepted.add(coding.lower())
+
+        for coding in ('br', 'gzip'):
+            # Explicitly refused codings aren't matched by the wildcard
+            if coding in accepted or ('*' in accepted and coding not in refused):
+                return coding
+        return 'identity'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        Weak comparison of the ETag with If-None-Match header value.
+        """
+        if not if_none_match:
+            return False
+        etag = self.etag[2:] if self.etag.startswith('W/') else self.etag
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate == '*':
+                return True
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate == etag:
+                return True
+        return False
@@ -1,9 +1,11 @@
 from .flight import Flight
+from .flight_batch import FlightBatch
 from .price_monitor import PriceMonitor
 from .providers import AsyncAirlineTicketProvider, SkypickerProvider
 
 __all__ = [
     'Flight',
+    'FlightBatch',
     'PriceMonitor',
     'AsyncAirlineTicketProvider',
     'SkypickerProvider',
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Tuple
+
+from asyncpgsa import PG
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.schema import flight_confirmations_table
+
+log = logging.getLogger(__name__)
+
+
+def hash_booking_token(booking_token: str) -> str:
+    # Booking tokens are too long to be used as a key as is
+    return hashlib.sha256(booking_token.encode()).hexdigest()
+
+
+class ConfirmationCache:
+    """
+    In-memory cache of flight confirmation results keyed by booking token.
+    Both positive and negative results expire after `ttl`.
+    """
+
+    def __init__(self, ttl: timedelta):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[bool, datetime]] = {}
+
+    async def get_many(self, booking_tokens: Iterable[str]) -> Dict[str, bool]:
+        """
+        :return: confirmation results of the booking tokens which are
+                 in the cache and not expired
+        """
+        fresh_since = datetime.utcnow() - self.ttl
+        result = {}
+        for booking_token in booking_tokens:
+            entry = self._entries.get(hash_booking_token(booking_token))
+            if entry is not None and entry[1] >= fresh_since:
+                result[booking_token] = entry[0]
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    async def put_many(self, results: Iterable[Tuple[str, bool]]):
+        checked_at = datetime.utcnow()
+        for booking_token, confirmed in results:
+            self._entries[hash_booking_token(booking_token)] = (confirmed, checked_at)
+
+    async def evict_expired(self):
+        fresh_since = datetime.utcnow() - self.ttl
+        self._entries = {
+            token_hash: entry for token_hash, entry in self._entries.items() if entry[1] >= fresh_since
+        }
+
+    def __str__(self):
+        requests = self.hits + self.misses
+        hit_ratio = self.hits / requests * 100 if requests else 0
+        return f'Confirmation cache: {self.hits} hits, {self.misses} misses ({hit_ratio:.1f}% hit ratio)'
+
+
+class PgConfirmationCache(ConfirmationCache):
+    """
+    Confirmation cache stored in Postgres, so it survives restarts.
+    Entries read from the database are kept in memory as well.
+    Database errors are logged and the cache keeps working from memory.
+    """
+
+    def __init__(self, pg: PG, ttl: timedelta):
+        super().__init__(ttl)
+        self._pg = pg
+
+    async def get_many(self, booking_tokens: Iterable[str]) -> Dict[str, bool]:
+        booking_tokens = list(booking_tokens)
+        missing_hashes = [
+            hash_booking_token(booking_token) for booking_token in booking_tokens
+            if hash_booking_token(booking_token) not in self._entries
+        ]
+        if missing_hashes:
+            query = flight_confirmations_table.select() \
+                .where(flight_confirmations_table.c.booking_token_hash.in_(missing_hashes)) \
+                .where(flight_confirmations_table.c.checked_at >= datetime.utcnow() - self.ttl)
+            try:
+                rows = await self._pg.fetch(query)
+            except Exception:
+                log.exception('Failed to read confirmations')
+                rows = []
+            for row in rows:
+                self._entries[row['booking_token_hash']] = (row['confirmed'], row['checked_at'])
+        return await super().get_many(booking_tokens)
+
+    async def put_many(self, results: Iterable[Tuple[str, bool]]):
+        results = list(results)
+        if not results:
+            return
+        await super().put_many(results)
+
+        values = {}
+        for booking_token, _ in results:
+            token_hash = hash_booking_token(booking_token)
+            confirmed, checked_at = self._entries[token_hash]
+            values[token_hash] = {
+                'booking_token_hash': token_hash,
+                'confirmed': confirmed,
+                'checked_at': checked_at,
+            }
+        query = insert(flight_confirmations_table).values(list(values.values()))
+        query = query.on_conflict_do_update(
+            index_elements=[flight_confirmations_table.c.booking_token_hash],
+            set_={
+                'confirmed': query.excluded.confirmed,
+                'checked_at': query.excluded.checked_at,
+            }
+        )
+        try:
+            await self._pg.execute(query)
+        except Exception:
+            log.exception('Failed to save confirmations')
+
+    async def evict_expired(self):
+        await super().evict_expired()
+        query = flight_confirmations_table.delete() \
+            .where(flight_confirmations_table.c.checked_at < datetime.utcnow() - self.ttl)
+        try:
+            await self._pg.execute(query)
+        except Exception:
+            log.exception('Failed to evict expired confirmations')
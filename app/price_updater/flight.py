@@ -1,7 +1,9 @@
 import logging
 from datetime import date
 from decimal import Decimal
-from typing import Dict, Any, List
+from itertools import islice
+from operator import attrgetter
+from typing import Iterable, List, Tuple
 
 from app.db.schema import flights_table
 
@@ -24,23 +26,85 @@ class Flight:
         self.price = price
         self.booking_token = booking_token
 
+    def __eq__(self, other):
+        if not isinstance(other, Flight):
+            return NotImplemented
+        return _get_flight_values(self) == _get_flight_values(other)
+
+    def __hash__(self):
+        return hash(_get_flight_values(self))
+
     def __repr__(self):
         return f'<Flight: {self.city_code_from} → {self.city_code_to} @ {self.departure_date} €{self.price}>'
 
 
-async def bulk_insert_flights(flights: List[Flight], price_update_id: int, db_conn):
-    if len(flights) == 0:
-        return 0
-    query = flights_table.insert()
-    values = []
-    for flight in flights:
-        values.append(get_flight_values_to_insert(flight, price_update_id))
-    result = await db_conn.execute(query.values(values))
-    # return number of inserted rows
-    return int(result.split(' ')[-1])
+COPY_CHUNK_SIZE = 10000
+
+# Columns of a record made by get_flight_record_to_insert
+FLIGHT_RECORD_COLUMNS = ('update_id', *Flight.__slots__)
+
+_get_flight_values = attrgetter(*Flight.__slots__)
+
+
+async def bulk_insert_flights(flights: Iterable[Flight], price_update_id: int, db_conn,
+                              chunk_size: int = COPY_CHUNK_SIZE) -> int:
+    """
+    Loads flights into the flights table with binary COPY. Flights are
+    consumed lazily and sent chunk by chunk, so any iterable (e.g. a
+    generator) can be loaded at constant memory.
+    :return: number of inserted rows
+    """
+    records = (get_flight_record_to_insert(flight, price_update_id) for flight in flights)
+    inserted = 0
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return inserted
+        result = await db_conn.copy_records_to_table(
+            flights_table.name,
+            records=chunk,
+            columns=FLIGHT_RECORD_COLUMNS
+        )
+        # result is a command tag like 'COPY 100'
+        inserted += int(result.split(' ')[-1])
+
+
+def get_flights_partition_name(price_update_id: int) -> str:
+    return f'{flights_table.name}_{int(price_update_id)}'
+
+
+async def create_flights_partition(price_update_id: int, db_conn):
+    """
+    Creates a partition of the flights table for flights of a given update,
+    flights of an update can't be inserted before it's created.
+    """
+    await db_conn.execute(
+        f'CREATE TABLE IF NOT EXISTS {get_flights_partition_name(price_update_id)} '
+        f'PARTITION OF {flights_table.name} FOR VALUES IN ({int(price_update_id)})'
+    )
+
+
+async def get_partitioned_update_ids(db_conn) -> List[int]:
+    """
+    :return: ids of updates which have partitions of the flights table
+    """
+    rows = await db_conn.fetch(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname = $1',
+        flights_table.name
+    )
+    prefix = f'{flights_table.name}_'
+    return sorted(
+        int(row['relname'][len(prefix):]) for row in rows
+        if row['relname'].startswith(prefix) and row['relname'][len(prefix):].isdigit()
+    )
+
+
+async def drop_flights_partition(price_update_id: int, db_conn):
+    await db_conn.execute(f'DROP TABLE IF EXISTS {get_flights_partition_name(price_update_id)}')
 
 
-def get_flight_values_to_insert(flight: Flight, price_update_id: int) -> Dict[str, Any]:
-    values = {slot: getattr(flight, slot) for slot in flight.__slots__}
-    values['update_id'] = price_update_id
-    return values
+def get_flight_record_to_insert(flight: Flight, price_update_id: int) -> Tuple:
+    return (price_update_id, *_get_flight_values(flight))
@@ -0,0 +1,184 @@
+import heapq
+from collections.abc import Sequence as SequenceABC
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .flight import Flight
+
+UNIX_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+def timestamps_to_days(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Skypicker encodes local departure time as a UNIX timestamp,
+    so a departure date is a UTC date of the timestamp.
+    :return: array of date ordinals
+    """
+    return timestamps // SECONDS_IN_DAY + UNIX_EPOCH_ORDINAL
+
+
+def prices_to_cents(prices: np.ndarray) -> np.ndarray:
+    return np.rint(prices * 100).astype(np.int64)
+
+
+class FlightBatch(SequenceABC):
+    """
+    Column-oriented list of flights: departure dates are kept as date
+    ordinals, prices as integer cents and city codes as indexes of interned
+    codes, so that flights can be filtered and compared with NumPy without
+    creating Flight, date and Decimal objects. Flight objects are created
+    only on access.
+    """
+    __slots__ = ('_city_codes', '_cities_from', '_cities_to', '_days', '_cents', '_booking_tokens')
+
+    def __init__(self,
+                 city_codes: Sequence[str],
+                 cities_from: np.ndarray,
+                 cities_to: np.ndarray,
+                 days: np.ndarray,
+                 cents: np.ndarray,
+                 booking_tokens: List[str]):
+        self._city_codes = city_codes
+        self._cities_from = cities_from
+        self._cities_to = cities_to
+        self._days = days
+        self._cents = cents
+        self._booking_tokens = booking_tokens
+
+    @classmethod
+    def from_columns(cls,
+                     cities_from: Sequence[str],
+                     cities_to: Sequence[str],
+                     days: np.ndarray,
+                     cents: np.ndarray,
+                     booking_tokens: List[str]) -> 'FlightBatch':
+        indexes: Dict[str, int] = {}
+        intern = indexes.setdefault
+        cities_from = np.fromiter((intern(code, len(indexes)) for code in cities_from),
+                                  dtype=np.uint16, count=len(cities_from))
+        cities_to = np.fromiter((intern(code, len(indexes)) for code in cities_to),
+                                dtype=np.uint16, count=len(cities_to))
+        return cls(
+            city_codes=list(indexes),
+            cities_from=cities_from,
+            cities_to=cities_to,
+            days=np.asarray(days, dtype=np.int64),
+            cents=np.asarray(cents, dtype=np.int64),
+            booking_tokens=booking_tokens
+        )
+
+    @classmethod
+    def from_flights(cls, flights: Iterable[Flight]) -> 'FlightBatch':
+        flights = list(flights)
+        return cls.from_columns(
+            cities_from=[flight.city_code_from for flight in flights],
+            cities_to=[flight.city_code_to for flight in flights],
+            days=np.fromiter((flight.departure_date.toordinal() for flight in flights),
+                             dtype=np.int64, count=len(flights)),
+            cents=np.fromiter((int(round(flight.price * 100)) for flight in flights),
+                              dtype=np.int64, count=len(flights)),
+            booking_tokens=[flight.booking_token for flight in flights]
+        )
+
+    def __len__(self):
+        return len(self._booking_tokens)
+
+    def __getitem__(self, index: int) -> Flight:
+        if isinstance(index, slice):
+            raise TypeError('FlightBatch does not support slicing')
+        return Flight(
+            city_code_from=self._city_codes[self._cities_from[index]],
+            city_code_to=self._city_codes[self._cities_to[index]],
+            departure_date=date.fromordinal(int(self._days[index])),
+            price=Decimal(int(self._cents[index])).scaleb(-2),
+            booking_token=self._booking_tokens[index]
+        )
+
+    def get_cheapest_for_each_date(self,
+                                   date_from: date,
+                                   date_to: date,
+                                   number: int) -> Dict[date, List[Tuple[int, int, Flight]]]:
+        """
+        Select up to `number` cheapest flights for each date within given dates.
+        Flights are sorted by date, price and position at once, then the first
+        `number` flights of each date are taken.
+        :return: Dict with a min-heap of (price in cents, position, Flight)
+                 for each date, ties are resolved in favor of the flight
+                 which came first
+        """
+        positions = np.flatnonzero(
+            (self._days >= date_from.toordinal()) & (self._days <= date_to.toordinal())
+        )
+        if not positions.size:
+            return {}
+
+        days = self._days[positions]
+        positions = positions[np.lexsort((positions, self._cents[positions], days))]
+        days = self._days[positions]
+
+        # Rank of each flight within its date
+        group_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, positions.size])
+        ranks = np.arange(positions.size) - np.repeat(group_starts, group_sizes)
+        winners = positions[ranks < number]
+
+        result = {}
+        for position in winners.tolist():
+            # Winners are sorted, so each list is a valid min-heap
+            flight = self[position]
+            result.setdefault(flight.departure_date, []).append(
+                (int(self._cents[position]), position, flight)
+            )
+        return result
+
+
+class CheapestFlightsSelector:
+    """
+    Keeps up to `number` cheapest flights for each date within given dates
+    out of flights added one by one, so that memory is proportional to the
+    number of dates rather than to the number of flights.
+    """
+
+    def __init__(self, date_from: date, date_to: date, number: int):
+        self._day_from = date_from.toordinal()
+        self._day_to = date_to.toordinal()
+        self._number = number
+        self._position = 0
+        # Max-heaps of (-cents, -position, flight values) of the cheapest flights seen so far
+        self._heaps: Dict[int, List[Tuple[int, int, Tuple[str, str, str]]]] = {}
+
+    def add(self, city_code_from: str, city_code_to: str, timestamp: int, price: float, booking_token: str):
+        position = self._position
+        self._position += 1
+        day = timestamp // SECONDS_IN_DAY + UNIX_EPOCH_ORDINAL
+        if day < self._day_from or day > self._day_to:
+            return
+        item = (-int(round(price * 100)), -position, (city_code_from, city_code_to, booking_token))
+        heap = self._heaps.setdefault(day, [])
+        if len(heap) < self._number:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def get_cheapest_for_each_date(self) -> Dict[date, List[Tuple[int, int, Flight]]]:
+        """
+        :return: the same as FlightBatch.get_cheapest_for_each_date
+        """
+        result = {}
+        for day, heap in self._heaps.items():
+            departure_date = date.fromordinal(day)
+            result[departure_date] = [
+                (-cents, -position, Flight(
+                    city_code_from=city_code_from,
+                    city_code_to=city_code_to,
+                    departure_date=departure_date,
+                    price=Decimal(-cents).scaleb(-2),
+                    booking_token=booking_token
+                ))
+                for cents, position, (city_code_from, city_code_to, booking_token) in sorted(heap, reverse=True)
+            ]
+        return result
@@ -0,0 +1,243 @@
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from sqlalchemy import and_, desc, func, or_, select
+
+from app.db.schema import price_update_jobs_table, price_updates_table, Status
+from app.price_updater.routes import Route
+
+# A claimed job which isn't completed within this time
+# is considered abandoned and may be claimed again
+JOB_LEASE = timedelta(minutes=30)
+
+# Job is failed after this many claims
+MAX_JOB_ATTEMPTS = 3
+
+jobs = price_update_jobs_table
+
+
+# Columns of a record made by enqueue_jobs
+JOB_RECORD_COLUMNS = (
+    'update_id', 'city_code_from', 'city_code_to', 'number_of_days', 'date_from', 'date_to',
+    'status', 'attempts', 'flights_saved'
+)
+
+
+async def enqueue_jobs(price_update_id: int, routes: Iterable[Route], db_conn,
+                       date_spans: Optional[Mapping[Tuple[str, str], Tuple[date, date]]] = None,
+                       status: Status = Status.pending) -> int:
+    """
+    Creates a job for each route of a price update with COPY,
+    so that any number of routes is enqueued at once.
+    :param date_spans: departure dates of routes which aren't refreshed whole
+    :param status: jobs processed by the scheduler itself are created
+                   in_process without a claim, workers never claim them,
+                   they only checkpoint progress of the update
+    :return: number of enqueued jobs
+    """
+    date_spans = date_spans or {}
+    records = []
+    for route in routes:
+        date_from, date_to = date_spans.get((route.city_code_from, route.city_code_to), (None, None))
+        records.append((
+            price_update_id, route.city_code_from, route.city_code_to, route.number_of_days, date_from, date_to,
+            status.value, 0, 0
+        ))
+    await db_conn.copy_records_to_table(jobs.name, records=records, columns=JOB_RECORD_COLUMNS)
+    return len(records)
+
+
+async def claim_job(db_conn, lease: timedelta = JOB_LEASE, max_attempts: int = MAX_JOB_ATTEMPTS):
+    """
+    Claims the oldest pending job, or an abandoned one. Jobs locked by
+    concurrent claims are skipped, so workers never wait for each other.
+    :return: claimed job with a new claim token, None if there are no jobs
+    """
+    now = datetime.utcnow()
+    claimable_job = select([jobs.c.id]) \
+        .where(or_(
+            jobs.c.status == Status.pending.value,
+            and_(jobs.c.status == Status.in_process.value, jobs.c.claimed_at < now - lease),
+        )) \
+        .where(jobs.c.attempts < max_attempts) \
+        .order_by(jobs.c.id) \
+        .limit(1) \
+        .with_for_update(skip_locked=True)
+    query = jobs.update() \
+        .where(jobs.c.id == claimable_job.as_scalar()) \
+        .values(
+            status=Status.in_process.value,
+            attempts=jobs.c.attempts + 1,
+            claim_token=uuid.uuid4().hex,
+            claimed_at=now,
+        ) \
+        .returning(*jobs.c)
+    return await db_conn.fetchrow(query)
+
+
+async def complete_job(db_conn, job, flights_saved: int) -> bool:
+    """
+    Should be run in the transaction which saves flights of the job.
+    :return: False if the claim of the job was taken over by another
+             worker, flights of the job must not be saved then
+    """
+    query = jobs.update() \
+        .where(jobs.c.id == job['id']) \
+        .where(jobs.c.claim_token == job['claim_token']) \
+        .where(jobs.c.status == Status.in_process.value) \
+        .values(status=Status.completed.value, flights_saved=flights_saved) \
+        .returning(jobs.c.id)
+    return await db_conn.fetchval(query) is not None
+
+
+async def release_job(db_conn, job, max_attempts: int = MAX_JOB_ATTEMPTS):
+    """
+    Returns a job which failed to be processed to the queue,
+    or fails it if it has no attempts left.
+    """
+    status = Status.failed.value if job['attempts'] >= max_attempts else Status.pending.value
+    query = jobs.update() \
+        .where(jobs.c.id == job['id']) \
+        .where(jobs.c.claim_token == job['claim_token']) \
+        .values(status=status)
+    await db_conn.execute(query)
+
+
+async def get_jobs_progress(price_update_id: int, db_conn,
+                            lease: timedelta = JOB_LEASE,
+                            max_attempts: int = MAX_JOB_ATTEMPTS) -> Tuple[int, int]:
+    """
+    Fails abandoned jobs of a price update which have no attempts left.
+    :return: number of unfinished jobs and number of flights
+             saved by completed jobs of the price update
+    """
+    fail_abandoned = jobs.update() \
+        .where(jobs.c.update_id == price_update_id) \
+        .where(jobs.c.status == Status.in_process.value) \
+        .where(jobs.c.claimed_at < datetime.utcnow() - lease) \
+        .where(jobs.c.attempts >= max_attempts) \
+        .values(status=Status.failed.value)
+    await db_conn.execute(fail_abandoned)
+
+    unfinished = jobs.c.status.in_([Status.pending.value, Status.in_process.value])
+    query = select([
+        func.count().filter(unfinished),
+        func.coalesce(func.sum(jobs.c.flights_saved), 0),
+    ]).where(jobs.c.update_id == price_update_id)
+    row = await db_conn.fetchrow(query)
+    return row[0], row[1]
+
+
+async def count_missing_jobs(price_update_id: int, db_conn) -> int:
+    """
+    :return: number of jobs of a price update which didn't save flights:
+             unfinished, failed or completed without flights
+    """
+    query = select([func.count()]) \
+        .where(jobs.c.update_id == price_update_id) \
+        .where(or_(jobs.c.status != Status.completed.value, jobs.c.flights_saved == 0))
+    return await db_conn.fetchval(query)
+
+
+async def get_saved_directions(price_update_id: int, db_conn) -> Set[Tuple[str, str]]:
+    """
+    :return: directions of completed jobs of a price update which saved flights
+    """
+    query = select([jobs.c.city_code_from, jobs.c.city_code_to]) \
+        .where(jobs.c.update_id == price_update_id) \
+        .where(jobs.c.status == Status.completed.value) \
+        .where(jobs.c.flights_saved > 0)
+    return {(row['city_code_from'], row['city_code_to']) for row in await db_conn.fetch(query)}
+
+
+async def get_refreshed_spans(since: datetime, db_conn) \
+        -> Dict[Tuple[str, str], List[Tuple[Optional[date], Optional[date], datetime]]]:
+    """
+    Departure dates refreshed by completed price updates started since
+    a given time, a job without dates refreshed its whole route.
+    :return: (date_from, date_to, start of the update) of jobs of each
+             direction which saved flights, the latest first
+    """
+    updates = price_updates_table
+    query = select([
+        jobs.c.city_code_from, jobs.c.city_code_to, jobs.c.date_from, jobs.c.date_to, updates.c.created_at
+    ]) \
+        .select_from(jobs.join(updates, jobs.c.update_id == updates.c.id)) \
+        .where(updates.c.status == Status.completed.value) \
+        .where(updates.c.created_at >= since) \
+        .where(jobs.c.status == Status.completed.value) \
+        .where(jobs.c.flights_saved > 0) \
+        .order_by(desc(updates.c.created_at))
+    spans = {}
+    for row in await db_conn.fetch(query):
+        spans.setdefault((row['city_code_from'], row['city_code_to']), []).append(
+            (row['date_from'], row['date_to'], row['created_at'])
+        )
+    return spans
+
+
+async def checkpoint_directions(price_update_id: int, flights_saved: Mapping[Tuple[str, str], int], db_conn):
+    """
+    Completes jobs of directions processed by the scheduler itself,
+    should be run in the transaction which saves their flights.
+    """
+    await db_conn.execute(
+        'UPDATE price_update_jobs SET status = $2, flights_saved = saved.flights_saved '
+        'FROM unnest($3::varchar[], $4::varchar[], $5::integer[]) '
+        'AS saved(city_code_from, city_code_to, flights_saved) '
+        'WHERE price_update_jobs.update_id = $1 '
+        'AND price_update_jobs.city_code_from = saved.city_code_from '
+        'AND price_update_jobs.city_code_to = saved.city_code_to',
+        price_update_id,
+        Status.completed.value,
+        [city_code_from for city_code_from, _ in flights_saved],
+        [city_code_to for _, city_code_to in flights_saved],
+        list(flights_saved.values()),
+    )
+
+
+async def get_unfinished_routes(price_update_id: int, db_conn) \
+        -> Tuple[List[Route], Dict[Tuple[str, str], Tuple[date, date]]]:
+    """
+    :return: routes of jobs of a price update which didn't save flights,
+             and departure dates of the ones which aren't refreshed whole
+    """
+    query = jobs.select() \
+        .where(jobs.c.update_id == price_update_id) \
+        .where(or_(jobs.c.status != Status.completed.value, jobs.c.flights_saved == 0)) \
+        .order_by(jobs.c.id)
+    routes = []
+    date_spans = {}
+    for job in await db_conn.fetch(query):
+        routes.append(Route(job['city_code_from'], job['city_code_to'], job['number_of_days']))
+        if job['date_from'] is not None:
+            date_spans[job['city_code_from'], job['city_code_to']] = (job['date_from'], job['date_to'])
+    return routes, date_spans
+
+
+async def requeue_unfinished_jobs(price_update_id: int, db_conn):
+    """
+    Returns jobs of a resumed price update which failed, were completed
+    without flights or were left unclaimed by the scheduler to the queue
+    with all attempts.
+    """
+    query = jobs.update() \
+        .where(jobs.c.update_id == price_update_id) \
+        .where(or_(
+            jobs.c.status == Status.failed.value,
+            and_(jobs.c.status == Status.completed.value, jobs.c.flights_saved == 0),
+            and_(jobs.c.status == Status.in_process.value, jobs.c.claimed_at.is_(None)),
+        )) \
+        .values(status=Status.pending.value, attempts=0)
+    await db_conn.execute(query)
+
+
+async def drop_outdated_jobs(retention: timedelta, db_conn):
+    """
+    Deletes jobs of price updates older than `retention`, which are
+    neither resumed nor read for refreshed departure dates anymore.
+    """
+    outdated_updates = select([price_updates_table.c.id]) \
+        .where(price_updates_table.c.created_at < datetime.utcnow() - retention)
+    await db_conn.execute(jobs.delete().where(jobs.c.update_id.in_(outdated_updates)))
@@ -1,67 +1,270 @@
 import asyncio
 import datetime
 import logging
-from typing import Tuple, List, Collection
+from collections import Counter
+from typing import Tuple, List, Collection, Callable, Awaitable, Optional, Mapping, Set
 
 from asyncpgsa import PG
 from sqlalchemy import desc
 
 from app.db.schema import price_updates_table, Status
 from app.price_updater import PriceMonitor, AsyncAirlineTicketProvider, Flight
-from app.price_updater.flight import bulk_insert_flights
+from app.price_updater.confirmation_cache import ConfirmationCache
+from app.price_updater.flight import (
+    bulk_insert_flights, create_flights_partition, drop_flights_partition, get_partitioned_update_ids
+)
+from app.price_updater.jobs import (
+    checkpoint_directions, count_missing_jobs, drop_outdated_jobs, enqueue_jobs, get_jobs_progress,
+    get_saved_directions, get_unfinished_routes, requeue_unfinished_jobs
+)
+from app.price_updater.price_changes import apply_price_changes, drop_outdated_price_changes, save_price_changes
+from app.price_updater.price_history import save_price_history
+from app.price_updater.routes import Route, load_routes, mark_routes_refreshed
 from app.utils.loop import get_loop_time
 
 log = logging.getLogger(__name__)
 
+# Departure dates of each direction
+DateSpans = Mapping[Tuple[str, str], Tuple[datetime.date, datetime.date]]
+
+
+async def save_flights(db_conn, flights: List[Flight], price_update_id: int, incremental: bool = False,
+                       date_spans: Optional[DateSpans] = None) -> int:
+    """
+    :param date_spans: departure dates the flights of each direction were
+                       searched in, used in the incremental mode only
+    :return: number of saved flights, flights without changes
+             count as saved in the incremental mode
+    """
+    if incremental:
+        log.info(f'Saving changes of {len(flights)} flights')
+        await save_price_changes(flights, price_update_id, db_conn, date_spans=date_spans)
+        return len(flights)
+    log.info(f'Inserting {len(flights)} flights')
+    return await bulk_insert_flights(flights, price_update_id, db_conn)
+
 
 class PeriodicalPriceUpdateScheduler:
     """
     Class that updates flight prices and schedules updates
     """
 
+    # Number of directions waiting to be saved before PriceMonitor blocks,
+    # directions waiting at once are saved in one transaction
+    STAGING_QUEUE_SIZE = 32
+
+    # Directions fetched and confirmed at once
+    MAX_CONCURRENT_DIRECTIONS = 100
+
+    # Seconds between checks of jobs of an update in the distributed mode
+    JOBS_POLL_INTERVAL = 10
+
+    # An update with directions without flights is resumed this many times
+    MAX_RESUMES = 3
+
+    # An update left in_process is resumed by a new leader within this time
+    RESUME_WINDOW = datetime.timedelta(hours=6)
+
+    # Changes of current prices saved by incremental updates are kept this
+    # long, changes of failed updates are dropped after the next update
+    PRICE_CHANGES_RETENTION = datetime.timedelta(days=1)
+
+    # Jobs of distributed updates are kept this long, well beyond the resume
+    # window and the refresh intervals of routes, whose refreshed departure
+    # dates are read from the jobs
+    JOBS_RETENTION = datetime.timedelta(days=7)
+
     def __init__(self,
                  pg: PG,
                  provider: AsyncAirlineTicketProvider,
-                 directions: Collection[Tuple[str, str]],
-                 number_of_days: int):
+                 directions: Optional[Collection[Tuple[str, str]]],
+                 number_of_days: int,
+                 confirmation_budget: Optional[float] = None,
+                 confirmation_cache: Optional[ConfirmationCache] = None,
+                 window_days: Optional[int] = None,
+                 keep_snapshots: Optional[int] = None,
+                 incremental: bool = False,
+                 distributed: bool = False,
+                 on_update_completed: Optional[Callable[[], Awaitable]] = None):
+        """
+        :param directions: directions to update, if None routes are loaded
+                           from the routes table at the start of each update
+        :param number_of_days: horizon of the given directions
+        :param keep_snapshots: flights of only this many latest completed
+                               updates are kept, all of them by default
+        :param incremental: instead of saving all flights of each update,
+                            save only changes of current prices and apply
+                            them when the update completes
+        :param distributed: instead of processing directions by itself,
+                            put a job for each direction of an update to
+                            the queue processed by PriceUpdateWorkers, and
+                            complete the update once all jobs are finished
+        """
         self._directions = directions
+        self._routes: List[Route] = []
+        # Departure dates of directions which aren't refreshed whole
+        self._date_spans: DateSpans = {}
+        # Directions whose flights were saved by the current update,
+        # none if it failed
+        self._saved_directions: Set[Tuple[str, str]] = set()
         self._number_of_days = number_of_days
         self._pg = pg
+        self._keep_snapshots = keep_snapshots
+        self._incremental = incremental
+        self._distributed = distributed
+        self._on_update_completed = on_update_completed
+        self._resumes = 0
+        # Update to be resumed by the next run of _update_prices
+        self._interrupted_update_id: Optional[int] = None
+        self._next_update: Optional[asyncio.TimerHandle] = None
+        self._update_task: Optional[asyncio.Task] = None
         self._updater = PriceMonitor(
             provider=provider,
-            directions=directions,
+            directions=(),
             number_of_days=number_of_days,
+            confirmation_budget=confirmation_budget,
+            confirmation_cache=confirmation_cache,
+            window_days=window_days,
+            max_concurrent_directions=self.MAX_CONCURRENT_DIRECTIONS,
         )
 
     async def run(self):
         """
-        The entry method. If no price updates today was made run first update,
-        otherwise just schedule next update for midnight.
+        The entry method. If an update was interrupted or no price updates today
+        was made start first update, otherwise just schedule next update for
+        midnight. Updates run in background until stop() is called.
         :return:
         """
+        self._resumes = 0
+        self._interrupted_update_id = await self._find_interrupted_update_id()
         last_update = await self._get_last_update()
-        if not last_update or last_update['created_at'].date() != datetime.datetime.utcnow().date():
-            await self._update_prices()
+        if self._interrupted_update_id is not None or not last_update \
+                or last_update['created_at'].date() != datetime.datetime.utcnow().date():
+            self._start_update()
         else:
             self._schedule_next_update()
 
     async def _update_prices(self):
         """
-        Update prices and schedule new update for the midnight
+        Update prices and schedule new update for the midnight.
+        No connection is held while flights are fetched and confirmed:
+        0. an update interrupted by a restart is resumed if there's one,
+           otherwise routes are loaded, in the incremental mode only the
+           ones due for a refresh, prices of the rest are kept as they are;
+        1. a price update record is created in the in_process status along
+           with a job for each direction, which checkpoints its progress;
+        2. confirmed flights of each direction are saved under it as soon
+           as the direction is processed, in a short transaction each,
+           which completes the job of the direction as well;
+           in the incremental mode only changes of current prices
+           of the direction are saved; in the distributed mode directions
+           are processed and saved the same way by PriceUpdateWorkers;
+        3. if some directions have no flights, the update is resumed soon,
+           only those directions are processed again, `MAX_RESUMES` times;
+           in the distributed mode their jobs, failed or completed without
+           flights, are returned to the queue;
+        4. the update is marked completed, which makes all its flights
+           visible at once; in the incremental mode its changes are
+           applied to current prices in the same transaction;
+           prices of its saved directions are recorded to the price
+           history as well and their routes are marked refreshed;
+        5. partitions of flights of outdated updates are dropped, in the
+           incremental mode outdated changes of current prices are dropped.
         :return:
         """
-        async with self._pg.transaction() as db_conn:
-            price_update_id = await self._create_price_update_record(db_conn)
-            flights = await self._updater.get_cheapest_flights()
-            flights_saved = await self._save_flights(db_conn, flights, price_update_id)
+        price_update_id, self._interrupted_update_id = self._interrupted_update_id, None
+        try:
+            if price_update_id is None:
+                await self._load_routes()
+            else:
+                await self._load_unfinished_routes(price_update_id)
+        except Exception:
+            log.exception('Failed to load routes')
+            self._schedule_next_update(soon=True)
+            return
+        if price_update_id is None and not self._routes:
+            log.info('No routes are due for a refresh')
+            self._schedule_next_update()
+            return
+
+        self._saved_directions = set()
+        try:
+            if price_update_id is None:
+                price_update_id = await self._create_price_update()
+            elif self._distributed:
+                await requeue_unfinished_jobs(price_update_id, self._pg)
+            await self._fetch_and_save_flights(price_update_id)
+            _, flights_saved = await get_jobs_progress(price_update_id, self._pg)
+            missing_jobs = await count_missing_jobs(price_update_id, self._pg)
+            if missing_jobs and self._resumes < self.MAX_RESUMES:
+                self._resumes += 1
+                log.warning(f'{missing_jobs} directions of prices update {price_update_id} have no flights, '
+                            f'resuming it soon ({self._resumes} of {self.MAX_RESUMES} times)')
+                self._interrupted_update_id = price_update_id
+                self._schedule_next_update(soon=True)
+                return
+            self._resumes = 0
+            self._saved_directions |= await get_saved_directions(price_update_id, self._pg)
             if flights_saved > 0:
-                await self._confirm_successful_update(db_conn, price_update_id)
+                async with self._pg.transaction() as db_conn:
+                    if self._incremental:
+                        await apply_price_changes(price_update_id, db_conn)
+                    await save_price_history(price_update_id, datetime.datetime.utcnow().date(), db_conn,
+                                             incremental=self._incremental, directions=self._saved_directions,
+                                             date_spans=self._date_spans)
+                    if self._directions is None:
+                        await mark_routes_refreshed(price_update_id, self._saved_directions, db_conn)
+                    await self._confirm_successful_update(db_conn, price_update_id)
             else:
-                await self._mark_update_failed(db_conn, price_update_id)
+                await self._mark_update_failed(self._pg, price_update_id)
+        except Exception:
+            log.exception(f'Prices update {price_update_id} failed')
+            if price_update_id is not None:
+                # The database may be down as well, the next update
+                # must be scheduled anyway
+                try:
+                    await self._mark_update_failed(self._pg, price_update_id)
+                except Exception:
+                    log.exception(f'Failed to mark prices update {price_update_id} failed')
+            flights_saved = 0
+            self._resumes = 0
+            self._saved_directions = set()
+
+        # The update is completed whatever happens to these,
+        # errors are logged and the next update is scheduled anyway
+        if flights_saved > 0 and self._on_update_completed is not None:
+            try:
+                await self._on_update_completed()
+            except Exception:
+                log.exception(f'Failed to handle completion of prices update {price_update_id}')
+        if flights_saved > 0 and self._keep_snapshots is not None:
+            try:
+                await self._drop_outdated_snapshots()
+            except Exception:
+                log.exception('Failed to drop outdated flights')
+        if self._incremental:
+            await self._drop_outdated_price_changes()
+        if self._distributed:
+            await self._drop_outdated_jobs()
+
+        # Directions without flights were already retried by resuming
+        # the update, the whole update is retried soon only if it failed
+        self._schedule_next_update(soon=flights_saved == 0)
+
+    def stop(self):
+        """
+        Cancels the scheduled update and the update in progress if any,
+        the update in progress is left in the in_process status.
+        """
+        if self._next_update is not None:
+            self._next_update.cancel()
+            self._next_update = None
+        if self._update_task is not None:
+            self._update_task.cancel()
+            self._update_task = None
 
-        # Schedule next update soon if retrieved less than 2/3 of expected number of flights
-        next_update_soon = flights_saved < len(self._directions) * self._number_of_days * 2 / 3
-        self._schedule_next_update(soon=next_update_soon)
+    def _start_update(self):
+        self._update_task = asyncio.create_task(self._update_prices())
 
     def _schedule_next_update(self, soon: bool = False):
         loop = asyncio.get_event_loop()
@@ -73,24 +276,180 @@ class PeriodicalPriceUpdateScheduler:
             call_time = get_loop_time(loop, next_day_midnight)
         else:
             call_time = loop.time() + datetime.timedelta(minutes=20).total_seconds()
-        loop.call_at(call_time, asyncio.create_task, self._update_prices())
+        self._next_update = loop.call_at(call_time, self._start_update)
         log.info(f'Next prices update scheduled on {call_time}')
 
     async def _get_last_update(self):
         last_update_query = price_updates_table.select() \
             .where(price_updates_table.c.status == Status.completed.value) \
-            .order_by(desc(price_updates_table.c.created_at))
+            .order_by(desc(price_updates_table.c.created_at)) \
+            .limit(1)
         return await self._pg.fetchrow(last_update_query)
 
+    async def _drop_outdated_snapshots(self):
+        """
+        Drops partitions of flights of updates older than the `keep_snapshots`
+        latest completed updates, whatever their status is. Errors are logged,
+        they'll be dropped after the next update.
+        """
+        oldest_kept_update_query = price_updates_table.select() \
+            .where(price_updates_table.c.status == Status.completed.value) \
+            .order_by(desc(price_updates_table.c.created_at)) \
+            .offset(self._keep_snapshots - 1) \
+            .limit(1)
+        try:
+            oldest_kept_update = await self._pg.fetchrow(oldest_kept_update_query)
+            if oldest_kept_update is None:
+                return
+            for update_id in await get_partitioned_update_ids(self._pg):
+                if update_id < oldest_kept_update['id']:
+                    await drop_flights_partition(update_id, self._pg)
+                    log.info(f'Dropped flights of prices update {update_id}')
+        except Exception:
+            log.exception('Failed to drop outdated flights')
+
+    async def _drop_outdated_price_changes(self):
+        """
+        Errors are logged, changes are dropped after the next update.
+        """
+        try:
+            await drop_outdated_price_changes(self.PRICE_CHANGES_RETENTION, self._pg)
+        except Exception:
+            log.exception('Failed to drop outdated price changes')
+
+    async def _drop_outdated_jobs(self):
+        """
+        Errors are logged, jobs are dropped after the next update.
+        """
+        try:
+            await drop_outdated_jobs(self.JOBS_RETENTION, self._pg)
+        except Exception:
+            log.exception('Failed to drop outdated price update jobs')
+
+    async def _load_routes(self):
+        if self._directions is None:
+            routes = await load_routes(self._pg, due_only=self._incremental)
+        else:
+            routes = [Route(city_code_from, city_code_to, self._number_of_days)
+                      for city_code_from, city_code_to in self._directions]
+        self._set_routes(routes)
+        log.info(f'Loaded {len(self._routes)} routes')
+
+    def _set_routes(self, routes: List[Route],
+                    date_spans: Optional[DateSpans] = None):
+        """
+        Sets routes of the next update, whole routes are refreshed
+        unless their departure dates are given.
+        """
+        self._routes = routes
+        self._date_spans = date_spans or {}
+        self._updater.directions = [(route.city_code_from, route.city_code_to) for route in routes]
+        self._updater.horizons = {(route.city_code_from, route.city_code_to): route.number_of_days for route in routes}
+        self._updater.date_spans = self._date_spans
+
+    async def _load_unfinished_routes(self, price_update_id: int):
+        routes, date_spans = await get_unfinished_routes(price_update_id, self._pg)
+        self._set_routes(routes, date_spans)
+        log.info(f'Resuming prices update {price_update_id}: {len(routes)} directions left')
+
+    async def _find_interrupted_update_id(self) -> Optional[int]:
+        """
+        :return: the latest recent update left in_process by a previous
+                 leader which was stopped or died, to be resumed
+        """
+        query = price_updates_table.select() \
+            .where(price_updates_table.c.status == Status.in_process.value) \
+            .where(price_updates_table.c.created_at >= datetime.datetime.utcnow() - self.RESUME_WINDOW) \
+            .order_by(desc(price_updates_table.c.created_at)) \
+            .limit(1)
+        interrupted_update = await self._pg.fetchrow(query)
+        return None if interrupted_update is None else interrupted_update['id']
+
+    async def _create_price_update(self) -> int:
+        """
+        Creates a price update record along with the partition of its
+        flights and a job for each of its directions in one transaction.
+        :return: id of the update
+        """
+        status = Status.pending if self._distributed else Status.in_process
+        async with self._pg.transaction() as db_conn:
+            price_update_id = await self._create_price_update_record(db_conn)
+            if not self._incremental:
+                await create_flights_partition(price_update_id, db_conn)
+            await enqueue_jobs(price_update_id, self._routes, db_conn, date_spans=self._date_spans, status=status)
+        return price_update_id
+
     @classmethod
     async def _create_price_update_record(cls, db_conn):
-        query = price_updates_table.insert().returning(price_updates_table.c.id)
+        query = price_updates_table.insert() \
+            .values(status=Status.in_process.value) \
+            .returning(price_updates_table.c.id)
         return await db_conn.fetchval(query)
 
-    @classmethod
-    async def _save_flights(cls, db_conn, flights: List[Flight], price_update_id: int):
-        log.info(f'Inserting {len(flights)} flights')
-        return await bulk_insert_flights(flights, price_update_id, db_conn)
+    async def _fetch_and_save_flights(self, price_update_id: int) -> int:
+        if self._distributed:
+            return await self._wait_for_jobs(price_update_id)
+        return await self._fetch_and_save_flights_locally(price_update_id)
+
+    async def _wait_for_jobs(self, price_update_id: int) -> int:
+        """
+        Waits until workers complete or fail all jobs of the update.
+        :return: number of flights saved by workers
+        """
+        while True:
+            await asyncio.sleep(self.JOBS_POLL_INTERVAL)
+            unfinished_jobs, flights_saved = await get_jobs_progress(price_update_id, self._pg)
+            if not unfinished_jobs:
+                return flights_saved
+            log.info(f'{unfinished_jobs} directions of prices update {price_update_id} are being processed')
+
+    async def _fetch_and_save_flights_locally(self, price_update_id: int) -> int:
+        """
+        Runs PriceMonitor and a writer of flights it finds concurrently,
+        connected with a bounded queue.
+        :return: number of saved flights
+        """
+        queue = asyncio.Queue(maxsize=self.STAGING_QUEUE_SIZE)
+
+        async def produce():
+            await self._updater.put_cheapest_flights(queue)
+            await queue.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        writer = asyncio.ensure_future(self._save_queued_flights(queue, price_update_id))
+        try:
+            await asyncio.gather(producer, writer)
+        finally:
+            producer.cancel()
+            writer.cancel()
+        return writer.result()
+
+    async def _save_queued_flights(self, queue: asyncio.Queue, price_update_id: int) -> int:
+        """
+        Saves flights of all the directions waiting in the queue at once.
+        """
+        flights_saved = 0
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            flights = [flight for direction_flights in batch if direction_flights for flight in direction_flights]
+            if flights:
+                async with self._pg.transaction() as db_conn:
+                    flights_saved += await self._save_flights(db_conn, flights, price_update_id)
+            if batch[-1] is None:
+                return flights_saved
+
+    async def _save_flights(self, db_conn, flights: List[Flight], price_update_id: int):
+        """
+        Saves flights and completes jobs of their directions.
+        """
+        flights_saved = await save_flights(db_conn, flights, price_update_id,
+                                           incremental=self._incremental, date_spans=self._date_spans)
+        directions = Counter((flight.city_code_from, flight.city_code_to) for flight in flights)
+        await checkpoint_directions(price_update_id, directions, db_conn)
+        self._saved_directions.update(directions)
+        return flights_saved
 
     @classmethod
     async def _confirm_successful_update(cls, db_conn, price_update_id):
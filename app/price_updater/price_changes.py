@@ -0,0 +1,154 @@
+import logging
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.schema import ChangeType, Status, current_prices_table, price_changes_table, price_updates_table
+from .flight import Flight
+
+log = logging.getLogger(__name__)
+
+# Columns of a record made by get_price_changes
+PRICE_CHANGE_RECORD_COLUMNS = (
+    'update_id', 'change_type', 'city_code_from', 'city_code_to', 'departure_date', 'price', 'booking_token'
+)
+
+
+def get_price_changes(current_prices: Iterable[Mapping],
+                      flights: Iterable[Flight],
+                      price_update_id: int) -> List[Tuple]:
+    """
+    Diffs the cheapest flights of a direction against its current prices.
+    A price is changed if it or its booking token differs from the current
+    one, so that the token confirmed by the latest update is served.
+    Current prices of the dates which have no flights any more (including
+    departed ones) are removed.
+    :return: records of price changes
+    """
+    current = {row['departure_date']: row for row in current_prices}
+    changes = []
+    for flight in flights:
+        row = current.pop(flight.departure_date, None)
+        if row is None:
+            change_type = ChangeType.inserted
+        elif row['price'] != flight.price or row['booking_token'] != flight.booking_token:
+            change_type = ChangeType.changed
+        else:
+            continue
+        changes.append((
+            price_update_id, change_type.value, flight.city_code_from, flight.city_code_to,
+            flight.departure_date, flight.price, flight.booking_token
+        ))
+    for departure_date, row in current.items():
+        changes.append((
+            price_update_id, ChangeType.removed.value, row['city_code_from'], row['city_code_to'],
+            departure_date, None, None
+        ))
+    return changes
+
+
+async def save_price_changes(flights: Iterable[Flight], price_update_id: int, db_conn,
+                             date_spans: Optional[Mapping[Tuple[str, str], Tuple[date, date]]] = None) -> int:
+    """
+    Saves changes of current prices of the directions of given flights.
+    Changes are applied to current prices only when the update completes.
+    Current prices of all the directions are read with one query.
+    :param date_spans: departure dates the flights of a direction were
+                       searched in, current prices of other dates aren't
+                       changed, except departed ones
+    :return: number of saved changes
+    """
+    directions: Dict[Tuple[str, str], List[Flight]] = {}
+    for flight in flights:
+        directions.setdefault((flight.city_code_from, flight.city_code_to), []).append(flight)
+    if not directions:
+        return 0
+
+    query = current_prices_table.select().where(
+        tuple_(current_prices_table.c.city_code_from, current_prices_table.c.city_code_to).in_(list(directions))
+    )
+    current_prices: Dict[Tuple[str, str], List[Mapping]] = {direction: [] for direction in directions}
+    date_spans = date_spans or {}
+    today = datetime.today().date()
+    for row in await db_conn.fetch(query):
+        direction = (row['city_code_from'], row['city_code_to'])
+        date_span = date_spans.get(direction)
+        if date_span is None or row['departure_date'] < today \
+                or date_span[0] <= row['departure_date'] <= date_span[1]:
+            current_prices[direction].append(row)
+
+    changes = []
+    for (city_code_from, city_code_to), direction_flights in directions.items():
+        direction_changes = get_price_changes(
+            current_prices[city_code_from, city_code_to], direction_flights, price_update_id
+        )
+        counts = Counter(change[1] for change in direction_changes)
+        log.info(f'{city_code_from} -> {city_code_to}: {counts[ChangeType.inserted.value]} inserted, '
+                 f'{counts[ChangeType.changed.value]} changed, {counts[ChangeType.removed.value]} removed, '
+                 f'{len(direction_flights) - len(direction_changes) + counts[ChangeType.removed.value]} unchanged')
+        changes.extend(direction_changes)
+
+    if not changes:
+        return 0
+    await db_conn.copy_records_to_table(
+        price_changes_table.name,
+        records=changes,
+        columns=PRICE_CHANGE_RECORD_COLUMNS
+    )
+    return len(changes)
+
+
+async def apply_price_changes(price_update_id: int, db_conn):
+    """
+    Applies changes saved by a price update to current prices,
+    should be run in the transaction which completes the update.
+    """
+    changes = price_changes_table
+    upserted_changes = select([
+        changes.c.city_code_from, changes.c.city_code_to, changes.c.departure_date,
+        changes.c.price, changes.c.booking_token, changes.c.update_id
+    ]) \
+        .where(changes.c.update_id == price_update_id) \
+        .where(changes.c.change_type.in_([ChangeType.inserted.value, ChangeType.changed.value]))
+    upsert = insert(current_prices_table).from_select(
+        ['city_code_from', 'city_code_to', 'departure_date', 'price', 'booking_token', 'update_id'],
+        upserted_changes
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[
+            current_prices_table.c.city_code_from,
+            current_prices_table.c.city_code_to,
+            current_prices_table.c.departure_date,
+        ],
+        set_={
+            'price': upsert.excluded.price,
+            'booking_token': upsert.excluded.booking_token,
+            'update_id': upsert.excluded.update_id,
+        }
+    )
+    await db_conn.execute(upsert)
+
+    delete_removed = current_prices_table.delete().where(and_(
+        changes.c.update_id == price_update_id,
+        changes.c.change_type == ChangeType.removed.value,
+        changes.c.city_code_from == current_prices_table.c.city_code_from,
+        changes.c.city_code_to == current_prices_table.c.city_code_to,
+        changes.c.departure_date == current_prices_table.c.departure_date,
+    ))
+    await db_conn.execute(delete_removed)
+
+
+async def drop_outdated_price_changes(retention: timedelta, db_conn):
+    """
+    Deletes changes of failed price updates, which are never applied,
+    and changes of updates older than `retention`, which were applied
+    or abandoned long ago.
+    """
+    outdated_updates = select([price_updates_table.c.id]).where(or_(
+        price_updates_table.c.status == Status.failed.value,
+        price_updates_table.c.created_at < datetime.utcnow() - retention,
+    ))
+    await db_conn.execute(price_changes_table.delete().where(price_changes_table.c.update_id.in_(outdated_updates)))
@@ -0,0 +1,98 @@
+from datetime import date
+from typing import Collection, Mapping, Optional, Tuple
+
+from sqlalchemy import Date, Integer, and_, cast, func, literal, or_, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db.schema import (
+    current_prices_table, flights_table, price_history_rollups_table, price_history_table
+)
+
+
+async def save_price_history(price_update_id: int, observed_on: date, db_conn, incremental: bool = False,
+                             directions: Optional[Collection[Tuple[str, str]]] = None,
+                             date_spans: Optional[Mapping[Tuple[str, str], Tuple[date, date]]] = None):
+    """
+    Records prices of a completed update as observed on a given day and
+    rollups of them for each direction. Prices and rollups of directions
+    observed earlier on the same day are overwritten. Should be run in the
+    transaction which completes the update, after its changes are applied
+    in the incremental mode.
+    :param directions: in the incremental mode only current prices of these
+                       directions are recorded, e.g. the ones refreshed
+                       by the update
+    :param date_spans: departure dates the flights of a direction were
+                       searched in, prices of other dates of the direction
+                       weren't observed and aren't recorded
+    """
+    if incremental:
+        table = current_prices_table
+        prices = select([table])
+        if directions is not None:
+            prices = prices.where(tuple_(table.c.city_code_from, table.c.city_code_to).in_(list(directions)))
+    else:
+        table = flights_table
+        prices = select([table]).where(table.c.update_id == price_update_id)
+    if date_spans:
+        prices = prices.where(or_(
+            tuple_(table.c.city_code_from, table.c.city_code_to).notin_(list(date_spans)),
+            *(and_(table.c.city_code_from == city_code_from, table.c.city_code_to == city_code_to,
+                   table.c.departure_date.between(date_from, date_to))
+              for (city_code_from, city_code_to), (date_from, date_to) in date_spans.items())
+        ))
+    prices = prices.alias('prices')
+
+    # Flights of an update have one price for each date,
+    # min() merely makes sure of that
+    observed_prices = select([
+        prices.c.city_code_from,
+        prices.c.city_code_to,
+        prices.c.departure_date,
+        cast(literal(observed_on), Date).label('observed_on'),
+        cast(func.round(func.min(prices.c.price) * 100), Integer).label('price_cents'),
+    ]) \
+        .group_by(prices.c.city_code_from, prices.c.city_code_to, prices.c.departure_date) \
+        .alias('observed_prices')
+    upsert_history = insert(price_history_table).from_select(
+        ['city_code_from', 'city_code_to', 'departure_date', 'observed_on', 'price_cents'],
+        select([observed_prices])
+    )
+    upsert_history = upsert_history.on_conflict_do_update(
+        index_elements=[
+            price_history_table.c.city_code_from,
+            price_history_table.c.city_code_to,
+            price_history_table.c.departure_date,
+            price_history_table.c.observed_on,
+        ],
+        set_={'price_cents': upsert_history.excluded.price_cents}
+    )
+    await db_conn.execute(upsert_history)
+
+    rollups = select([
+        observed_prices.c.city_code_from,
+        observed_prices.c.city_code_to,
+        observed_prices.c.observed_on,
+        func.min(observed_prices.c.price_cents),
+        func.max(observed_prices.c.price_cents),
+        func.sum(observed_prices.c.price_cents),
+        func.count(),
+    ]).group_by(observed_prices.c.city_code_from, observed_prices.c.city_code_to, observed_prices.c.observed_on)
+    upsert_rollups = insert(price_history_rollups_table).from_select(
+        ['city_code_from', 'city_code_to', 'observed_on',
+         'min_price_cents', 'max_price_cents', 'sum_price_cents', 'prices_count'],
+        rollups
+    )
+    upsert_rollups = upsert_rollups.on_conflict_do_update(
+        index_elements=[
+            price_history_rollups_table.c.city_code_from,
+            price_history_rollups_table.c.city_code_to,
+            price_history_rollups_table.c.observed_on,
+        ],
+        set_={
+            'min_price_cents': upsert_rollups.excluded.min_price_cents,
+            'max_price_cents': upsert_rollups.excluded.max_price_cents,
+            'sum_price_cents': upsert_rollups.excluded.sum_price_cents,
+            'prices_count': upsert_rollups.excluded.prices_count,
+        }
+    )
+    await db_conn.execute(upsert_rollups)
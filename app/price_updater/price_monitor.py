@@ -1,15 +1,18 @@
 import asyncio
+import heapq
 import logging
-import operator
-from functools import reduce
-from typing import List, Tuple, Iterable
-from datetime import datetime, timedelta
+from typing import Collection, List, Tuple, Optional, Dict, Set, Mapping
+from datetime import date, datetime, timedelta
 
+from app.price_updater.confirmation_cache import ConfirmationCache
 from app.price_updater.providers import AsyncAirlineTicketProvider
 from .flight import Flight
 
 log = logging.getLogger(__name__)
 
+# Min-heaps of (price, order, Flight) for each departure date
+Candidates = Dict[date, List[Tuple]]
+
 
 class PriceMonitor:
     """
@@ -17,136 +20,288 @@ class PriceMonitor:
     for given directions in a given date span from today.
     """
 
+    # Flights of a date are tried one after another this many times at most
+    CONFIRMATION_ROUNDS = 3
+    CANDIDATES_PER_DATE = CONFIRMATION_ROUNDS
+
     def __init__(self,
                  provider: AsyncAirlineTicketProvider,
                  number_of_days: int,
-                 directions: Iterable[Tuple[str, str]]):
+                 directions: Collection[Tuple[str, str]],
+                 confirmation_budget: Optional[float] = None,
+                 confirmation_cache: Optional[ConfirmationCache] = None,
+                 window_days: Optional[int] = None,
+                 horizons: Optional[Mapping[Tuple[str, str], int]] = None,
+                 date_spans: Optional[Mapping[Tuple[str, str], Tuple[date, date]]] = None,
+                 max_concurrent_directions: Optional[int] = None):
+        """
+        :param horizons: number of days of each direction,
+                         `number_of_days` for directions not listed
+        :param date_spans: departure dates of each direction, overrides
+                           its horizon, e.g. to refresh a part of it
+        :param max_concurrent_directions: directions processed at once,
+                                          all of them by default
+        :param window_days: flights of a direction are requested in windows
+                            of this many days concurrently, the whole date
+                            span is requested at once by default
+        :param confirmation_budget: seconds a run may spend confirming flights,
+                                    flights not confirmed in time are dropped
+        :param confirmation_cache: cache of recent confirmation results,
+                                   flights with fresh results aren't checked again
+        """
         self.provider = provider
         self.number_of_days = number_of_days
         self.directions = directions
+        self.confirmation_budget = confirmation_budget
+        self.confirmation_cache = confirmation_cache
+        self.window_days = window_days
+        self.horizons = horizons or {}
+        self.date_spans = date_spans or {}
+        self.max_concurrent_directions = max_concurrent_directions
+        self._confirmation_deadline: Optional[float] = None
 
     async def get_cheapest_flights(self) -> List[Flight]:
         """
         Method to get cheapest prices for top flights within a month
         """
-        date_from, date_to = self._get_date_span()
-
-        log.info(f'Started cheapest prices update in {date_from} {date_to} for:')
-        for src, dst in self.directions:
-            log.info(f'{src} -> {dst}')
-
-        cheapest_flights = await self._get_cheapest_flights_for_all_directions(date_from, date_to)
-        confirmed_flights = await self._confirm_flights(cheapest_flights)
+        queue = asyncio.Queue()
+        await self.put_cheapest_flights(queue)
 
+        confirmed_flights = []
+        while not queue.empty():
+            confirmed_flights.extend(queue.get_nowait())
         return confirmed_flights
 
-    def _get_date_span(self) -> (str, str):
-        date_from = datetime.today().date()
-        date_to = (datetime.today() + timedelta(days=self.number_of_days)).date()
-        return date_from, date_to
-
-    async def _get_cheapest_flights_for_all_directions(self,
-                                                       date_from: datetime.date,
-                                                       date_to: datetime.date) -> List[Flight]:
+    async def put_cheapest_flights(self, queue: asyncio.Queue):
         """
-        Schedules coroutines to get cheapest prices for each direction within
-        given dates.
-        :return: List of Flights with minimal cost
+        Processes all directions concurrently and puts a List of confirmed
+        cheapest Flights of each direction to the queue as soon as
+        the direction is processed. Directions without flights are skipped.
         """
-        get_cheapest_flights_coros = []
-        for city_code_from, city_code_to in self.directions:
-            get_cheapest_flights_coros.append(
-                self._get_cheapest_flights_for_a_direction(
+        log.info(f'Started cheapest prices update of {len(self.directions)} directions')
+
+        if self.confirmation_budget is not None:
+            self._confirmation_deadline = asyncio.get_event_loop().time() + self.confirmation_budget
+        if self.confirmation_cache is not None:
+            await self.confirmation_cache.evict_expired()
+        semaphore = asyncio.Semaphore(self.max_concurrent_directions or len(self.directions) or 1)
+
+        async def put_confirmed_flights(city_code_from: str, city_code_to: str):
+            direction = (city_code_from, city_code_to)
+            date_from, date_to = self.date_spans.get(direction) or self._get_date_span(self.horizons.get(direction))
+            async with semaphore:
+                await self._put_confirmed_flights_for_a_direction(
+                    queue=queue,
                     city_code_from=city_code_from,
                     city_code_to=city_code_to,
                     date_from=date_from,
                     date_to=date_to
                 )
-            )
-        cheapest_flights = await asyncio.gather(*get_cheapest_flights_coros)
-        return reduce(operator.concat, cheapest_flights)
 
-    async def _get_cheapest_flights_for_a_direction(self,
-                                                    city_code_from: str,
-                                                    city_code_to: str,
-                                                    date_from: datetime.date,
-                                                    date_to: datetime.date) -> List[Flight]:
+        await asyncio.gather(*(
+            put_confirmed_flights(city_code_from, city_code_to)
+            for city_code_from, city_code_to in self.directions
+        ))
+        self.provider.report_metrics()
+        if self.confirmation_cache is not None:
+            log.info(self.confirmation_cache)
+
+    def _get_date_span(self, number_of_days: Optional[int] = None) -> (str, str):
+        if number_of_days is None:
+            number_of_days = self.number_of_days
+        date_from = datetime.today().date()
+        date_to = (datetime.today() + timedelta(days=number_of_days)).date()
+        return date_from, date_to
+
+    async def _put_confirmed_flights_for_a_direction(self,
+                                                     queue: asyncio.Queue,
+                                                     city_code_from: str,
+                                                     city_code_to: str,
+                                                     date_from: datetime.date,
+                                                     date_to: datetime.date):
+        candidates = await self._get_candidates_for_a_direction(
+            city_code_from=city_code_from,
+            city_code_to=city_code_to,
+            date_from=date_from,
+            date_to=date_to
+        )
+        confirmed_flights = await self._confirm_flights(city_code_from, city_code_to, candidates)
+        if confirmed_flights:
+            await queue.put(confirmed_flights)
+
+    async def _get_candidates_for_a_direction(self,
+                                              city_code_from: str,
+                                              city_code_to: str,
+                                              date_from: datetime.date,
+                                              date_to: datetime.date) -> Candidates:
         """
-        Retrieves a list of flights available for a given direction and time period.
-        Then selects flights with minimal cost.
-        :return: List of Flights with only one cheapest Flight for a direction per date
+        Retrieves flights available for a given direction and time period
+        window by window, windows are requested concurrently. Then selects
+        flights with minimal cost, dropping flights outside of the time period.
+        A window which failed to be retrieved is skipped.
+        :return: Dict with a min-heap of the cheapest Flights for each date
         """
+        windows_candidates = await asyncio.gather(*(
+            self._get_candidates_for_a_window(city_code_from, city_code_to, window_from, window_to)
+            for window_from, window_to in self._split_date_span(date_from, date_to)
+        ))
+        # Windows don't overlap, so neither do their dates
+        candidates = {}
+        for window_candidates in windows_candidates:
+            candidates.update(window_candidates)
+        return candidates
+
+    async def _get_candidates_for_a_window(self,
+                                           city_code_from: str,
+                                           city_code_to: str,
+                                           date_from: datetime.date,
+                                           date_to: datetime.date) -> Candidates:
         try:
-            all_flights = await self.provider.get_flights(
+            return await self.provider.get_cheapest_flights(
                 city_code_from=city_code_from,
                 city_code_to=city_code_to,
                 date_from=date_from,
-                date_to=date_to
+                date_to=date_to,
+                number=self.CANDIDATES_PER_DATE
             )
-        except Exception:
-            return []
-        actual_flights = self._filter_outliers(all_flights, date_from, date_to)
-        cheapest_flights = self._get_cheapest_flight_for_each_date(actual_flights)
-        return cheapest_flights
+        except Exception as e:
+            log.warning(f'Failed to get flights {city_code_from} -> {city_code_to} '
+                        f'in {date_from} {date_to}: {e!r}')
+            return {}
 
-    @classmethod
-    def _get_cheapest_flight_for_each_date(cls, flights: List[Flight]) -> List[Flight]:
+    def _split_date_span(self, date_from: date, date_to: date) -> List[Tuple[date, date]]:
         """
-        Form a List of Flights for one direction where multiple flights at same date
-        might occur, return List of Flights where only one cheapest Flight per date
-        exists.
+        :return: consecutive windows of `window_days` days which cover
+                 given dates, the last one may be shorter
         """
-        result = {}
-        for flight in flights:
-            if flight.departure_date not in result or flight.price < result[flight.departure_date].price:
-                result[flight.departure_date] = flight
-        return list(result.values())
+        if self.window_days is None:
+            return [(date_from, date_to)]
+        windows = []
+        window_from = date_from
+        while window_from <= date_to:
+            window_to = min(window_from + timedelta(days=self.window_days - 1), date_to)
+            windows.append((window_from, window_to))
+            window_from = window_to + timedelta(days=1)
+        return windows
 
     @classmethod
-    def _filter_outliers(cls, flights, date_from, date_to):
-        result = []
-        for flight in flights:
-            if date_from <= flight.departure_date <= date_to:
-                result.append(flight)
-        return result
+    def _pop_candidate(cls, heap: List[Tuple], rejected_tokens: Set[str]) -> Optional[Flight]:
+        while heap:
+            _, _, flight = heapq.heappop(heap)
+            if flight.booking_token not in rejected_tokens:
+                return flight
+        return None
 
-    async def _confirm_flights(self, flights: List[Flight], retries: int = 0):
+    async def _confirm_flights(self, city_code_from: str, city_code_to: str, candidates: Candidates):
         """
-        Confirm given flights using provider API.
-        Retry to get cheapest price for Flight that is not confirmed.
-        If retries number reached 3, then assume that flights are not available.
+        Confirm the cheapest candidate Flight of each date using provider API.
+        If a Flight is not confirmed, the next cheapest candidate of that date
+        is tried. Flights are requested from provider again only once all
+        candidates of a date are rejected.
+        If number of rounds reached 3, then assume that flights are not available.
         :return: List of confirmed Flights
         """
-        if len(flights) == 0 or retries == 3:
-            return []
-        log.info(f'Trying to confirm {len(flights)} flights')
-        confirm_flight_coros = []
-        for flight in flights:
-            confirm_flight_coros.append(self.provider.confirm_flight(flight))
-        confirm_flight_results = await asyncio.gather(*confirm_flight_coros)
-
-        # Split confirmed flights and flights that need to retry to find cheapest cost
+        rejected_tokens = set()
+        to_confirm = {
+            departure_date: self._pop_candidate(heap, rejected_tokens)
+            for departure_date, heap in candidates.items()
+        }
         confirmed_flights = []
-        retry_get_cheapest_flight_list = []
-        for flight, confirmed in confirm_flight_results:
-            if confirmed:
-                confirmed_flights.append(flight)
-            else:
-                retry_get_cheapest_flight_list.append(
-                    self._get_cheapest_flights_for_a_direction(
-                        flight.city_code_from,
-                        flight.city_code_to,
-                        flight.departure_date,
-                        flight.departure_date
-                    )
-                )
+        for _ in range(self.CONFIRMATION_ROUNDS):
+            await self._request_more_candidates(city_code_from, city_code_to, candidates, to_confirm, rejected_tokens)
+            flights = [flight for flight in to_confirm.values() if flight is not None]
+            if not flights:
+                break
+
+            log.info(f'Trying to confirm {len(flights)} flights')
+            confirm_flight_results = await self._confirm_within_budget(flights)
+
+            # Split confirmed flights and dates that need to retry with the next candidate
+            to_confirm = {}
+            for flight, confirmed in confirm_flight_results:
+                if confirmed:
+                    confirmed_flights.append(flight)
+                else:
+                    rejected_tokens.add(flight.booking_token)
+                    heap = candidates[flight.departure_date]
+                    to_confirm[flight.departure_date] = self._pop_candidate(heap, rejected_tokens)
 
-        log.info(f'{len(confirmed_flights)} flights confirmed, {len(retry_get_cheapest_flight_list)} need to retry')
+            log.info(f'{len(confirmed_flights)} flights confirmed, {len(to_confirm)} need to retry')
 
-        # Retry cheapest cost find for unconfirmed Flights and add confirmed Flights
-        # to the result list
-        retried_flights_requests = await asyncio.gather(*retry_get_cheapest_flight_list)
-        retried_flights_requests = reduce(operator.concat, retried_flights_requests, [])
-        confirmed_flights.extend(await self._confirm_flights(retried_flights_requests, retries + 1))
+            if to_confirm and self._is_confirmation_budget_exhausted():
+                log.warning(f'Confirmation budget is exhausted, dropping {len(to_confirm)} flights')
+                break
 
         return confirmed_flights
+
+    async def _request_more_candidates(self,
+                                       city_code_from: str,
+                                       city_code_to: str,
+                                       candidates: Candidates,
+                                       to_confirm: Dict[date, Optional[Flight]],
+                                       rejected_tokens: Set[str]):
+        """
+        Query provider for dates that ran out of candidates.
+        """
+        exhausted_dates = [departure_date for departure_date, flight in to_confirm.items() if flight is None]
+        if not exhausted_dates:
+            return
+        requested_candidates = await asyncio.gather(*(
+            self._get_candidates_for_a_direction(city_code_from, city_code_to, departure_date, departure_date)
+            for departure_date in exhausted_dates
+        ))
+        for departure_date, date_candidates in zip(exhausted_dates, requested_candidates):
+            candidates[departure_date] = date_candidates.get(departure_date, [])
+            to_confirm[departure_date] = self._pop_candidate(candidates[departure_date], rejected_tokens)
+
+    async def _confirm_within_budget(self, flights: List[Flight]) -> List[Tuple[Flight, bool]]:
+        """
+        Confirm flights concurrently. Confirmations which fail or don't
+        finish before the confirmation deadline count as not confirmed.
+        Fresh results from the confirmation cache are used as is.
+        :return: List of (Flight, confirmed) tuples in order of given flights
+        """
+        cached_results = {}
+        if self.confirmation_cache is not None:
+            cached_results = await self.confirmation_cache.get_many(flight.booking_token for flight in flights)
+
+        timeout = None
+        if self._confirmation_deadline is not None:
+            timeout = max(self._confirmation_deadline - asyncio.get_event_loop().time(), 0)
+        tasks = {
+            flight.booking_token: asyncio.ensure_future(self.provider.confirm_flight(flight))
+            for flight in flights if flight.booking_token not in cached_results
+        }
+        done = set()
+        if tasks:
+            try:
+                done, _ = await asyncio.wait(tasks.values(), timeout=timeout)
+            finally:
+                # Confirmations are never left running, whether the
+                # deadline passes or the update itself is cancelled
+                for task in tasks.values():
+                    if not task.done():
+                        task.cancel()
+
+        results = []
+        checked_results = []
+        for flight in flights:
+            if flight.booking_token in cached_results:
+                results.append((flight, cached_results[flight.booking_token]))
+                continue
+            task = tasks[flight.booking_token]
+            if task in done and task.exception() is None:
+                _, confirmed = task.result()
+                results.append((flight, bool(confirmed)))
+                if confirmed is not None:
+                    checked_results.append((flight.booking_token, confirmed))
+            else:
+                results.append((flight, False))
+
+        if self.confirmation_cache is not None:
+            await self.confirmation_cache.put_many(checked_results)
+        return results
+
+    def _is_confirmation_budget_exhausted(self) -> bool:
+        return (self._confirmation_deadline is not None and
+                asyncio.get_event_loop().time() >= self._confirmation_deadline)
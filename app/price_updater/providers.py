@@ -2,11 +2,17 @@ import abc
 import asyncio
 import logging
 from datetime import date
-from decimal import Decimal
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from retry import retry
+import numpy as np
 
+from app.price_updater.flight_batch import (
+    CheapestFlightsSelector, FlightBatch, prices_to_cents, timestamps_to_days
+)
+from app.utils.json_stream import iter_json_array
+from app.utils.metrics import Histogram
+from app.utils.request_scheduler import RequestScheduler
+from app.utils.resilience import CircuitBreaker, async_retry
 from .flight import Flight
 
 
@@ -16,12 +22,37 @@ log = logging.getLogger(__name__)
 class AsyncAirlineTicketProvider(abc.ABC):
 
     async def get_flights(self, city_code_from: str, city_code_to: str,
-                          date_from: date, date_to: date) -> List[Flight]:
+                          date_from: date, date_to: date) -> Sequence[Flight]:
         raise NotImplementedError
 
-    async def confirm_flight(self, flight: Flight) -> (Flight, bool):
+    async def confirm_flight(self, flight: Flight) -> (Flight, Optional[bool]):
         raise NotImplementedError
 
+    async def get_cheapest_flights(self, city_code_from: str, city_code_to: str,
+                                   date_from: date, date_to: date,
+                                   number: int) -> Dict[date, List[Tuple[int, int, Flight]]]:
+        """
+        Fetches flights for a given direction within given dates
+        and selects up to `number` cheapest flights for each date.
+        :return: Dict with a min-heap of (price in cents, position, Flight)
+                 for each date
+        """
+        flights = await self.get_flights(
+            city_code_from=city_code_from,
+            city_code_to=city_code_to,
+            date_from=date_from,
+            date_to=date_to
+        )
+        if not isinstance(flights, FlightBatch):
+            flights = FlightBatch.from_flights(flights)
+        return flights.get_cheapest_for_each_date(date_from, date_to, number)
+
+    def report_metrics(self):
+        """
+        Log metrics collected by the provider since the previous report,
+        called after each prices update.
+        """
+
 
 class SkypickerProvider(AsyncAirlineTicketProvider):
     """
@@ -46,65 +77,185 @@ class SkypickerProvider(AsyncAirlineTicketProvider):
                               'children=0&' \
                               'infants=0'
 
-    def __init__(self, client_session):
+    # Limits of requests made to Skypicker by one provider
+    REQUESTS_PER_SECOND = 10
+    REQUESTS_BURST = 20
+    CONCURRENCY_LIMITS = {
+        'get_flights': 5,
+        'confirm_flight': 10,
+    }
+
+    # Consecutive failed requests after which Skypicker is considered down
+    # and requests fail fast for CIRCUIT_RESET_TIMEOUT seconds
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_RESET_TIMEOUT = 60
+
+    # Confirmation of a flight is polled with growing intervals
+    # until it's checked or the deadline is reached
+    CONFIRM_DEADLINE = 120
+    CONFIRM_POLL_INITIAL_INTERVAL = 1
+    CONFIRM_POLL_MAX_INTERVAL = 10
+    CONFIRM_POLL_BACKOFF = 1.5
+
+    # Size of chunks in which responses are read in the streaming mode
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self,
+                 client_session,
+                 request_scheduler: Optional[RequestScheduler] = None,
+                 stream_responses: bool = False):
+        """
+        :param stream_responses: parse flights while a response is being read
+                                 and keep only the cheapest of them, instead of
+                                 loading the whole response
+        """
         self._client_session = client_session
+        self._stream_responses = stream_responses
+        self._circuit_breaker = CircuitBreaker(
+            name='skypicker',
+            failure_threshold=self.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=self.CIRCUIT_RESET_TIMEOUT
+        )
+        self._request_scheduler = request_scheduler or RequestScheduler(
+            rate=self.REQUESTS_PER_SECOND,
+            burst=self.REQUESTS_BURST,
+            concurrency_limits=self.CONCURRENCY_LIMITS
+        )
+        self.confirm_polls = Histogram('confirm_flight polls', buckets=(1, 2, 3, 5, 8, 13, 21))
+        self.confirm_latency = Histogram('confirm_flight seconds', buckets=(1, 2, 5, 10, 30, 60, 120))
+
+    @property
+    def request_scheduler(self) -> RequestScheduler:
+        return self._request_scheduler
 
-    @retry(tries=3, delay=2)
     async def get_flights(self, city_code_from: str, city_code_to: str,
-                          date_from: date, date_to: date) -> List[Flight]:
+                          date_from: date, date_to: date) -> FlightBatch:
         """
         Fetches flight information for a given direction within given dates.
-        :return: List of Flights which contain all available flights for all
+        :return: FlightBatch which contains all available flights for all
                  the dates within a given date span
         """
         logging.info(f'Called get_flights({city_code_from}, {city_code_to}, '
                      f'{date_from}, {date_to})')
-        get_flights_endpoint = self.GET_FLIGHTS_ENDPOINT.format(
-            city_code_from=city_code_from,
-            city_code_to=city_code_to,
-            date_from=date_from.strftime('%d/%m/%Y'),
-            date_to=date_to.strftime('%d/%m/%Y')
+        get_flights_endpoint = self._get_flights_endpoint(city_code_from, city_code_to, date_from, date_to)
+        data = await self._get_json('get_flights', get_flights_endpoint)
+        rows = data['data']
+        return FlightBatch.from_columns(
+            cities_from=[row['cityCodeFrom'] for row in rows],
+            cities_to=[row['cityCodeTo'] for row in rows],
+            days=timestamps_to_days(np.fromiter((row['dTime'] for row in rows), dtype=np.int64, count=len(rows))),
+            cents=prices_to_cents(np.fromiter((row['price'] for row in rows), dtype=np.float64, count=len(rows))),
+            booking_tokens=[row['booking_token'] for row in rows]
         )
 
-        async with self._client_session.get(get_flights_endpoint) as get_flights_response:
-            data = await get_flights_response.json()
-        flights = []
-        for flight in data['data']:
-            flights.append(
-                Flight(
-                    city_code_from=flight['cityCodeFrom'],
-                    city_code_to=flight['cityCodeTo'],
-                    departure_date=date.fromtimestamp(flight['dTime']),
-                    price=Decimal(flight['price']),
-                    booking_token=flight['booking_token']
-                )
-            )
-        return flights
-
-    async def confirm_flight(self, flight: Flight) -> (Flight, bool):
+    async def get_cheapest_flights(self, city_code_from: str, city_code_to: str,
+                                   date_from: date, date_to: date,
+                                   number: int) -> Dict[date, List[Tuple[int, int, Flight]]]:
+        if not self._stream_responses:
+            return await super().get_cheapest_flights(city_code_from, city_code_to, date_from, date_to, number)
+
+        logging.info(f'Called get_cheapest_flights({city_code_from}, {city_code_to}, '
+                     f'{date_from}, {date_to})')
+        get_flights_endpoint = self._get_flights_endpoint(city_code_from, city_code_to, date_from, date_to)
+        return await self._select_cheapest_flights(get_flights_endpoint, date_from, date_to, number)
+
+    async def confirm_flight(self, flight: Flight) -> (Flight, Optional[bool]):
         """
         Check booking confirmation and price for a given Flight.
         :return: a tuple where the first value is always a Flight,
                  the second value is True iff flight is valid
-                 and price didn't change
+                 and price didn't change, None if the flight
+                 couldn't be checked
         """
         log.info(f'Checking {flight}')
         confirm_flight_endpoint = self.CONFIRM_FLIGHT_ENDPOINT.format(
             booking_token=flight.booking_token
         )
 
-        flights_checked = False
-        while not flights_checked:
-            try:
-                async with self._client_session.get(confirm_flight_endpoint) as confirm_flight_response:
-                    data = await confirm_flight_response.json(content_type='text/html')
-            except Exception:
-                return flight, False
-            flights_checked = data.get('flights_checked', False)
-            if not flights_checked:
-                await asyncio.sleep(5)
+        loop = asyncio.get_event_loop()
+        started_at = loop.time()
+        deadline = started_at + self.CONFIRM_DEADLINE
+        interval = self.CONFIRM_POLL_INITIAL_INTERVAL
+        polls = 0
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(
+                        self._get_json('confirm_flight', confirm_flight_endpoint, content_type='text/html'),
+                        timeout=max(deadline - loop.time(), 0)
+                    )
+                except Exception:
+                    return flight, None
+                finally:
+                    polls += 1
+                if data.get('flights_checked', False):
+                    break
+                if loop.time() + interval > deadline:
+                    log.warning(f'{flight} was not checked in {self.CONFIRM_DEADLINE}s')
+                    return flight, None
+                await asyncio.sleep(interval)
+                interval = min(interval * self.CONFIRM_POLL_BACKOFF, self.CONFIRM_POLL_MAX_INTERVAL)
+        finally:
+            self.confirm_polls.observe(polls)
+            self.confirm_latency.observe(loop.time() - started_at)
 
         if data['flights_invalid'] or data['price_change']:
             return flight, False
 
         return flight, True
+
+    def report_metrics(self):
+        for endpoint, stats in self._request_scheduler.stats().items():
+            log.info(f'{endpoint} requests: {stats}')
+        log.info(self.confirm_polls)
+        log.info(self.confirm_latency)
+        # Histograms are reported for each update separately
+        self.confirm_polls.reset()
+        self.confirm_latency.reset()
+
+    def _get_flights_endpoint(self, city_code_from: str, city_code_to: str,
+                              date_from: date, date_to: date) -> str:
+        return self.GET_FLIGHTS_ENDPOINT.format(
+            city_code_from=city_code_from,
+            city_code_to=city_code_to,
+            date_from=date_from.strftime('%d/%m/%Y'),
+            date_to=date_to.strftime('%d/%m/%Y')
+        )
+
+    @async_retry(tries=3, base_delay=1, max_delay=10)
+    async def _select_cheapest_flights(self, url: str, date_from: date, date_to: date,
+                                       number: int) -> Dict[date, List[Tuple[int, int, Flight]]]:
+        """
+        Reads flights from a response in chunks and passes only the fields
+        of a Flight to the selector, the rest of each flight is dropped
+        as soon as it's parsed. Retries the same way _get_json does.
+        :return: cheapest flights for each date
+        """
+        selector = CheapestFlightsSelector(date_from, date_to, number)
+        async with self._circuit_breaker:
+            async with self._request_scheduler.slot('get_flights'):
+                async with self._client_session.get(url) as response:
+                    response.raise_for_status()
+                    chunks = response.content.iter_chunked(self.STREAM_CHUNK_SIZE)
+                    async for flight in iter_json_array(chunks, 'data'):
+                        selector.add(
+                            city_code_from=flight['cityCodeFrom'],
+                            city_code_to=flight['cityCodeTo'],
+                            timestamp=flight['dTime'],
+                            price=flight['price'],
+                            booking_token=flight['booking_token']
+                        )
+        return selector.get_cheapest_for_each_date()
+
+    @async_retry(tries=3, base_delay=1, max_delay=10)
+    async def _get_json(self, endpoint: str, url: str, **json_kwargs):
+        """
+        Makes a GET request through the request scheduler and the circuit
+        breaker. Retries on network errors, timeouts and retryable statuses.
+        :return: decoded JSON body of the response
+        """
+        async with self._circuit_breaker:
+            async with self._request_scheduler.slot(endpoint):
+                async with self._client_session.get(url) as response:
+                    response.raise_for_status()
+                    return await response.json(**json_kwargs)
@@ -0,0 +1,116 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Integer, cast, distinct, func, literal_column, or_, select, tuple_
+
+from app.db.schema import price_history_table, routes_table
+
+# A route is due if it'll be due within this time, so that a route
+# refreshed by yesterday's update is refreshed by today's one as well
+REFRESH_TOLERANCE = timedelta(hours=1)
+
+
+class Route(NamedTuple):
+    city_code_from: str
+    city_code_to: str
+    number_of_days: int
+    refresh_interval: Optional[timedelta] = None
+    refreshed_at: Optional[datetime] = None
+    demand: float = 0
+
+
+async def load_routes(db_conn, due_only: bool = False) -> List[Route]:
+    """
+    :param due_only: only routes which weren't refreshed within their
+                     refresh interval
+    :return: enabled routes
+    """
+    routes = routes_table
+    query = routes.select() \
+        .where(routes.c.enabled) \
+        .order_by(routes.c.city_code_from, routes.c.city_code_to)
+    if due_only:
+        query = query.where(or_(
+            routes.c.refreshed_at.is_(None),
+            routes.c.refreshed_at + routes.c.refresh_interval <= func.timezone('utc', func.now()) + REFRESH_TOLERANCE,
+        ))
+    return [
+        Route(row['city_code_from'], row['city_code_to'], row['number_of_days'], row['refresh_interval'],
+              row['refreshed_at'], row['demand'])
+        for row in await db_conn.fetch(query)
+    ]
+
+
+async def mark_routes_refreshed(price_update_id: int, directions: Iterable[Tuple[str, str]], db_conn):
+    """
+    Sets the start of a price update as the refresh time of routes of given
+    directions, should be run in the transaction which completes the update.
+    Directions are passed as two arrays, so that the number of query
+    arguments doesn't depend on the number of directions.
+    """
+    directions = list(directions)
+    await db_conn.execute(
+        'UPDATE routes SET refreshed_at = price_updates.created_at '
+        'FROM price_updates, unnest($2::varchar[], $3::varchar[]) AS refreshed(city_code_from, city_code_to) '
+        'WHERE price_updates.id = $1 '
+        'AND routes.city_code_from = refreshed.city_code_from '
+        'AND routes.city_code_to = refreshed.city_code_to',
+        price_update_id,
+        [city_code_from for city_code_from, _ in directions],
+        [city_code_to for _, city_code_to in directions],
+    )
+
+
+async def add_route_demand(counts: Mapping[Tuple[str, str], int], db_conn):
+    """
+    Adds counts of requests of prices of routes to their demand.
+    """
+    await db_conn.execute(
+        'UPDATE routes SET demand = demand + requested.count '
+        'FROM unnest($1::varchar[], $2::varchar[], $3::integer[]) AS requested(city_code_from, city_code_to, count) '
+        'WHERE routes.city_code_from = requested.city_code_from '
+        'AND routes.city_code_to = requested.city_code_to',
+        [city_code_from for city_code_from, _ in counts],
+        [city_code_to for _, city_code_to in counts],
+        list(counts.values()),
+    )
+
+
+async def decay_route_demand(factor: float, db_conn):
+    """
+    Multiplies demand of all routes by a factor, so that
+    recent requests weigh more than old ones.
+    """
+    await db_conn.execute(routes_table.update().values(demand=routes_table.c.demand * factor))
+
+
+async def get_route_volatility(window_days: int, days: int, db_conn) -> Dict[Tuple[str, str, int], float]:
+    """
+    Volatility of prices of each window of `window_days` departure dates
+    of routes, counted from (0) today: the share of daily observations
+    of the last `days` days which saw a price of a departure date
+    that wasn't seen before.
+    :return: volatility from 0 to 1 of each (city_code_from, city_code_to, window)
+    """
+    history = price_history_table
+    today = func.current_date()
+    # Rendered inline, so that the grouping expression is the selected one
+    window = cast((history.c.departure_date - today) / literal_column(str(int(window_days))), Integer).label('window')
+    query = select([
+        history.c.city_code_from,
+        history.c.city_code_to,
+        window,
+        func.count().label('observations'),
+        func.count(distinct(tuple_(history.c.departure_date, history.c.price_cents))).label('prices'),
+        func.count(distinct(history.c.departure_date)).label('dates'),
+    ]) \
+        .where(history.c.observed_on >= date.today() - timedelta(days=days)) \
+        .where(history.c.departure_date >= today) \
+        .group_by(history.c.city_code_from, history.c.city_code_to, window)
+    volatility = {}
+    for row in await db_conn.fetch(query):
+        changes = row['observations'] - row['dates']
+        if changes > 0:
+            volatility[row['city_code_from'], row['city_code_to'], row['window']] = \
+                (row['prices'] - row['dates']) / changes
+    return volatility
@@ -0,0 +1,251 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from asyncpgsa import PG
+
+from app.price_updater import AsyncAirlineTicketProvider
+from app.price_updater.jobs import get_refreshed_spans
+from app.price_updater.periodical_price_update import PeriodicalPriceUpdateScheduler
+from app.price_updater.routes import Route, decay_route_demand, get_route_volatility, load_routes
+
+log = logging.getLogger(__name__)
+
+# (city_code_from, city_code_to, window)
+TaskKey = Tuple[str, str, int]
+
+
+class RefreshTask:
+    """
+    Refresh of one window of departure dates of a route,
+    windows are counted from (0) today.
+    """
+    __slots__ = ('route', 'window', 'boost', 'refreshed_at', 'attempts', 'due_at')
+
+    def __init__(self, route: Route, window: int, refreshed_at: Optional[datetime.datetime] = None):
+        self.route = route
+        self.window = window
+        self.boost = 1.0
+        self.refreshed_at = refreshed_at
+        self.attempts = 0
+        self.due_at = datetime.datetime.min
+
+    @property
+    def key(self) -> TaskKey:
+        return self.route.city_code_from, self.route.city_code_to, self.window
+
+    @property
+    def direction(self) -> Tuple[str, str]:
+        return self.route.city_code_from, self.route.city_code_to
+
+    def schedule(self):
+        """
+        The window is due once the refresh interval of its route,
+        shortened by its boost, passes since its last refresh.
+        """
+        if self.refreshed_at is None:
+            self.due_at = datetime.datetime.min
+        else:
+            self.due_at = self.refreshed_at + self.route.refresh_interval / self.boost
+
+    def get_date_span(self, window_days: int, today: datetime.date) -> Tuple[datetime.date, datetime.date]:
+        date_from = today + datetime.timedelta(days=self.window * window_days)
+        date_to = min(date_from + datetime.timedelta(days=window_days - 1),
+                      today + datetime.timedelta(days=self.route.number_of_days))
+        return date_from, date_to
+
+    def __repr__(self):
+        return (f'<RefreshTask: {self.route.city_code_from} → {self.route.city_code_to} '
+                f'#{self.window} @ {self.due_at}>')
+
+
+class StaggeredPriceUpdateScheduler(PeriodicalPriceUpdateScheduler):
+    """
+    Refreshes routes window by window, spreading the load over the day
+    instead of updating all routes at midnight. Every tick a small
+    incremental update refreshes the most overdue windows, at most one
+    window of a route and `tasks_per_hour` windows per hour overall.
+    A window is due once the refresh interval of its route passes since
+    its last refresh, the interval is shortened for routes in demand and
+    windows with volatile prices. Failed windows are retried on their own.
+    """
+
+    # A window is refreshed this many times per refresh interval at most
+    MAX_BOOST = 8
+
+    # Boost of a window whose every observed price was a new one
+    VOLATILITY_WEIGHT = 4
+
+    # Days of price history volatility of windows is estimated from
+    VOLATILITY_DAYS = 14
+
+    # Routes, their demand and volatility are reloaded this often
+    ROUTES_RELOAD_INTERVAL = datetime.timedelta(hours=1)
+
+    # Demand of routes is multiplied by this each time routes are reloaded
+    DEMAND_DECAY = 0.9
+
+    # Windows without flights are retried on their own instead
+    MAX_RESUMES = 0
+
+    # Delay of the first retry of a failed window, doubled by each next one
+    RETRY_DELAY = datetime.timedelta(minutes=10)
+    MAX_RETRY_DELAY = datetime.timedelta(hours=4)
+
+    def __init__(self,
+                 pg: PG,
+                 provider: AsyncAirlineTicketProvider,
+                 number_of_days: int,
+                 window_days: int,
+                 tasks_per_hour: float,
+                 tick_interval: float = 300,
+                 **kwargs):
+        """
+        :param window_days: days of departure dates refreshed at once
+        :param tasks_per_hour: windows refreshed per hour at most
+        :param tick_interval: seconds between the end of an update
+                              and the start of the next one
+        """
+        super().__init__(pg=pg, provider=provider, directions=None, number_of_days=number_of_days,
+                         window_days=window_days, incremental=True, **kwargs)
+        self._window_days = window_days
+        self._tasks_per_hour = tasks_per_hour
+        self._tick_interval = tick_interval
+        self._tasks: Dict[TaskKey, RefreshTask] = {}
+        # Min-heap of (due_at, order, key) of tasks waiting for their turn
+        self._queue: List[Tuple[datetime.datetime, int, TaskKey]] = []
+        self._order = itertools.count()
+        self._budget = 0.0
+        self._routes_loaded_at: Optional[datetime.datetime] = None
+        self._current_tasks: List[RefreshTask] = []
+
+    async def run(self):
+        """
+        Starts the first tick, which resumes an interrupted update if there's
+        one, the next ones are scheduled one after another until stop() is called.
+        """
+        self._routes_loaded_at = None
+        self._interrupted_update_id = await self._find_interrupted_update_id()
+        self._start_update()
+
+    async def _update_prices(self):
+        """
+        Refreshes the windows due for a refresh and puts them back to the
+        queue, the ones which weren't saved are retried after a backoff.
+        """
+        saved_directions = set()
+        try:
+            await super()._update_prices()
+            saved_directions = self._saved_directions
+        finally:
+            self._requeue_current_tasks(datetime.datetime.utcnow(), saved_directions)
+
+    def _schedule_next_update(self, soon: bool = False):
+        loop = asyncio.get_event_loop()
+        self._next_update = loop.call_at(loop.time() + self._tick_interval, self._start_update)
+
+    async def _load_routes(self):
+        now = datetime.datetime.utcnow()
+        if self._routes_loaded_at is None or now - self._routes_loaded_at >= self.ROUTES_RELOAD_INTERVAL:
+            await self._reload_tasks()
+            self._routes_loaded_at = now
+
+        self._current_tasks = self._pop_due_tasks(now)
+        today = datetime.datetime.today().date()
+        self._set_routes(
+            [task.route for task in self._current_tasks],
+            {task.direction: task.get_date_span(self._window_days, today) for task in self._current_tasks}
+        )
+        if self._current_tasks:
+            log.info(f'Refreshing {len(self._current_tasks)} windows, {len(self._queue)} windows queued')
+
+    async def _reload_tasks(self):
+        """
+        Rebuilds the queue from the current routes, keeping the state
+        of windows of known routes. Windows of new routes, e.g. all of them
+        after a restart, get the refresh time of the latest update which
+        refreshed their departure dates, never refreshed windows are due.
+        """
+        routes = await load_routes(self._pg)
+        volatility = await get_route_volatility(self._window_days, self.VOLATILITY_DAYS, self._pg)
+        await decay_route_demand(self.DEMAND_DECAY, self._pg)
+        # Refreshes older than the refresh interval of a route are due anyway
+        longest_interval = max((route.refresh_interval for route in routes), default=datetime.timedelta(0))
+        refreshed_spans = await get_refreshed_spans(datetime.datetime.utcnow() - longest_interval, self._pg)
+
+        mean_demand = sum(route.demand for route in routes) / len(routes) if routes else 0
+        today = datetime.datetime.today().date()
+        tasks = {}
+        for route in routes:
+            demand_boost = route.demand / mean_demand if mean_demand else 0
+            # Departure dates from today to today + number_of_days inclusive
+            for window in range(route.number_of_days // self._window_days + 1):
+                key = (route.city_code_from, route.city_code_to, window)
+                task = self._tasks.get(key)
+                if task is None:
+                    task = RefreshTask(route, window)
+                    spans = refreshed_spans.get(task.direction, ())
+                    task.refreshed_at = self._get_window_refreshed_at(task, spans, today)
+                task.route = route
+                task.boost = min(self.MAX_BOOST, 1 + demand_boost + self.VOLATILITY_WEIGHT * volatility.get(key, 0))
+                if not task.attempts:
+                    task.schedule()
+                tasks[key] = task
+        self._tasks = tasks
+        self._queue = [(task.due_at, next(self._order), key) for key, task in tasks.items()]
+        heapq.heapify(self._queue)
+        log.info(f'Loaded {len(routes)} routes, {len(tasks)} windows')
+
+    def _get_window_refreshed_at(self, task: RefreshTask,
+                                 spans: Iterable[Tuple[Optional[datetime.date], Optional[datetime.date],
+                                                       datetime.datetime]],
+                                 today: datetime.date) -> Optional[datetime.datetime]:
+        """
+        :param spans: departure dates refreshed along with the time of their
+                      refresh, the latest first
+        :return: the latest refresh of the first departure date of a window
+        """
+        date_from, _ = task.get_date_span(self._window_days, today)
+        for span_from, span_to, refreshed_at in spans:
+            if span_from is None or span_from <= date_from <= span_to:
+                return refreshed_at
+        return None
+
+    def _pop_due_tasks(self, now: datetime.datetime) -> List[RefreshTask]:
+        """
+        :return: the most overdue tasks within the budget of a tick,
+                 one task of a route at most
+        """
+        self._budget += self._tasks_per_hour * self._tick_interval / 3600
+        tasks = []
+        postponed = []
+        directions = set()
+        while self._queue and len(tasks) < int(self._budget) and self._queue[0][0] <= now:
+            entry = heapq.heappop(self._queue)
+            task = self._tasks[entry[2]]
+            if task.direction in directions:
+                postponed.append(entry)
+                continue
+            directions.add(task.direction)
+            tasks.append(task)
+        for entry in postponed:
+            heapq.heappush(self._queue, entry)
+        # Budget left unused by a tick isn't saved up for a burst
+        self._budget = min(self._budget - len(tasks), 1.0)
+        return tasks
+
+    def _requeue_current_tasks(self, now: datetime.datetime, saved_directions: Set[Tuple[str, str]]):
+        for task in self._current_tasks:
+            if task.direction in saved_directions:
+                task.refreshed_at = now
+                task.attempts = 0
+                task.schedule()
+            else:
+                task.attempts += 1
+                task.due_at = now + min(self.RETRY_DELAY * 2 ** (task.attempts - 1), self.MAX_RETRY_DELAY)
+                log.info(f'{task} failed {task.attempts} times')
+            heapq.heappush(self._queue, (task.due_at, next(self._order), task.key))
+        self._current_tasks = []
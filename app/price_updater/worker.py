@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from asyncpgsa import PG
+
+from app.price_updater import PriceMonitor, AsyncAirlineTicketProvider
+from app.price_updater.confirmation_cache import ConfirmationCache
+from app.price_updater.jobs import claim_job, complete_job, release_job
+from app.price_updater.periodical_price_update import save_flights
+
+log = logging.getLogger(__name__)
+
+
+class JobClaimLost(Exception):
+    """
+    Raised when a job was taken over by another worker
+    while it was being processed.
+    """
+
+
+class PriceUpdateWorker:
+    """
+    Processes directions of distributed price updates. Each job of the queue
+    is a direction of an update, any number of workers in any number of
+    processes may process the queue, each job is claimed by one of them.
+    """
+
+    def __init__(self,
+                 pg: PG,
+                 provider: AsyncAirlineTicketProvider,
+                 number_of_days: int,
+                 concurrency: int = 4,
+                 poll_interval: float = 5,
+                 confirmation_budget: Optional[float] = None,
+                 confirmation_cache: Optional[ConfirmationCache] = None,
+                 window_days: Optional[int] = None,
+                 incremental: bool = False):
+        """
+        :param number_of_days: horizon of jobs which have none
+        :param concurrency: number of jobs processed at once
+        :param poll_interval: seconds between checks of an empty queue
+        :param confirmation_budget: seconds one job may spend confirming flights
+        :param incremental: save changes of current prices instead of flights,
+                            must be the same as the one of the scheduler
+        """
+        self._pg = pg
+        self._provider = provider
+        self._number_of_days = number_of_days
+        self._concurrency = concurrency
+        self._poll_interval = poll_interval
+        self._confirmation_budget = confirmation_budget
+        self._confirmation_cache = confirmation_cache
+        self._window_days = window_days
+        self._incremental = incremental
+
+    async def run(self):
+        """
+        Processes jobs until cancelled.
+        """
+        await asyncio.gather(*(self._process_jobs() for _ in range(self._concurrency)))
+
+    async def _process_jobs(self):
+        while True:
+            try:
+                job = await claim_job(self._pg)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Failed to claim a prices update job')
+                job = None
+            if job is None:
+                await asyncio.sleep(self._poll_interval)
+                continue
+            await self._process_job(job)
+
+    async def _process_job(self, job):
+        """
+        Saves flights of the job and completes it in one transaction,
+        so the flights are saved exactly once whatever happens to workers.
+        A failed job is returned to the queue.
+        """
+        direction = f"{job['city_code_from']} -> {job['city_code_to']}"
+        log.info(f"Processing {direction} of prices update {job['update_id']}, attempt {job['attempts']}")
+        try:
+            flights = await self._get_monitor(job).get_cheapest_flights()
+            async with self._pg.transaction() as db_conn:
+                flights_saved = await save_flights(db_conn, flights, job['update_id'],
+                                                   incremental=self._incremental,
+                                                   date_spans=self._get_date_spans(job)) if flights else 0
+                if not await complete_job(db_conn, job, flights_saved):
+                    raise JobClaimLost(f"Job {job['id']} was claimed by another worker")
+        except asyncio.CancelledError:
+            await asyncio.shield(self._release_job(job))
+            raise
+        except JobClaimLost:
+            log.warning(f"{direction} of prices update {job['update_id']} is processed by another worker")
+        except Exception:
+            log.exception(f"Failed to process {direction} of prices update {job['update_id']}")
+            await self._release_job(job)
+        else:
+            log.info(f"Saved {flights_saved} flights of {direction} of prices update {job['update_id']}")
+
+    async def _release_job(self, job):
+        try:
+            await release_job(self._pg, job)
+        except Exception:
+            # The job is claimed again once its lease expires
+            log.exception(f"Failed to release job {job['id']}")
+
+    def _get_monitor(self, job) -> PriceMonitor:
+        return PriceMonitor(
+            provider=self._provider,
+            directions=[(job['city_code_from'], job['city_code_to'])],
+            number_of_days=job['number_of_days'] or self._number_of_days,
+            date_spans=self._get_date_spans(job),
+            confirmation_budget=self._confirmation_budget,
+            confirmation_cache=self._confirmation_cache,
+            window_days=self._window_days,
+        )
+
+    @classmethod
+    def _get_date_spans(cls, job) -> Dict[Tuple[str, str], Tuple[date, date]]:
+        """
+        :return: departure dates of a job which refreshes a part of its route
+        """
+        if job['date_from'] is None:
+            return {}
+        return {(job['city_code_from'], job['city_code_to']): (job['date_from'], job['date_to'])}
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from collections import Counter
+
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+
+from app.price_updater.routes import add_route_demand
+
+log = logging.getLogger(__name__)
+
+
+class RouteDemandCounter:
+    """
+    Counts requests of prices of each route in memory and adds
+    the counts to the demand of routes in the database periodically,
+    so that counting doesn't slow requests down.
+    """
+
+    def __init__(self, pg: PG, flush_interval: float = 60, max_routes: int = 10000):
+        """
+        :param max_routes: routes counted between flushes at most, requests
+                           of other routes aren't counted until the next flush
+        """
+        self._pg = pg
+        self._flush_interval = flush_interval
+        self._max_routes = max_routes
+        self._counts = Counter()
+
+    def count(self, city_from: str, city_to: str, requests: int = 1):
+        key = (city_from, city_to)
+        if key in self._counts or len(self._counts) < self._max_routes:
+            self._counts[key] += requests
+
+    async def flush(self):
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, Counter()
+        try:
+            await add_route_demand(counts, self._pg)
+        except Exception:
+            # Counts are kept for the next flush, as long as they fit
+            for (city_from, city_to), requests in counts.items():
+                self.count(city_from, city_to, requests)
+            raise
+
+    async def run_periodic_flush(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Failed to save demand of routes')
+
+
+async def setup_route_demand(app: Application):
+    app['route_demand'] = RouteDemandCounter(app['pg'])
+    flush_task = asyncio.create_task(app['route_demand'].run_periodic_flush())
+
+    try:
+        yield
+    finally:
+        flush_task.cancel()
+        await asyncio.gather(flush_task, return_exceptions=True)
+        try:
+            await app['route_demand'].flush()
+        except Exception:
+            log.exception('Failed to save demand of routes')
@@ -0,0 +1,369 @@
+import asyncio
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Tuple, Optional, Sequence, Iterable, List, Mapping
+
+from aiohttp.web_app import Application
+from asyncpgsa import PG
+from sqlalchemy import Integer, cast, desc, func, literal, select
+
+from app.db.schema import price_updates_table, flights_table, current_prices_table, Status
+from app.payloads import EncodedJSON
+
+log = logging.getLogger(__name__)
+
+Direction = Tuple[str, str]
+
+# (city_code_from, city_code_to, departure_date) of the last flight of a page
+PageKey = Tuple[str, str, date]
+
+# (update_id, city_from, city_to)
+BodyKey = Tuple[int, Optional[str], Optional[str]]
+
+
+class PricesSnapshot:
+    """
+    Read-only in-memory copy of the flights of one completed price update,
+    indexed by (city_code_from, city_code_to) and ordered by departure date,
+    along with JSON responses serialized from it.
+    """
+    __slots__ = ('update_id', '_flights', '_directions', '_departure_dates', '_bodies', '_empty_body')
+
+    def __init__(self, update_id: int, flights: Dict[Direction, Tuple[Mapping, ...]]):
+        self.update_id = update_id
+        self._directions: List[Direction] = sorted(flights)
+        self._flights = {
+            direction: tuple(sorted(flights[direction], key=lambda flight: flight['departure_date']))
+            for direction in self._directions
+        }
+        # Departure dates of each direction in the order of flights, for bisection
+        self._departure_dates: Dict[Direction, List[date]] = {
+            direction: [flight['departure_date'] for flight in rows] for direction, rows in self._flights.items()
+        }
+        self._bodies: Dict[Tuple[Optional[str], Optional[str]], EncodedJSON] = {}
+        self._empty_body = EncodedJSON.from_rows((), etag=self.etag)
+
+    @classmethod
+    def from_records(cls, update_id: int, records: Iterable[Mapping]) -> 'PricesSnapshot':
+        flights = {}
+        for record in records:
+            direction = (record['city_code_from'], record['city_code_to'])
+            flights.setdefault(direction, []).append(record)
+        snapshot = cls(update_id, {direction: tuple(rows) for direction, rows in flights.items()})
+        snapshot.prepare_bodies()
+        return snapshot
+
+    @property
+    def etag(self) -> str:
+        return f'W/"prices-{self.update_id}"'
+
+    @property
+    def directions(self) -> Sequence[Direction]:
+        return tuple(self._flights)
+
+    def has_direction(self, city_from: str, city_to: str) -> bool:
+        return (city_from, city_to) in self._flights
+
+    def get_flights(self, city_from: Optional[str] = None, city_to: Optional[str] = None) -> List[Mapping]:
+        """
+        :return: flights of the snapshot, optionally filtered by departure
+                 and/or arrival city
+        """
+        if city_from and city_to:
+            return list(self._flights.get((city_from, city_to), ()))
+        result = []
+        for (city_code_from, city_code_to), flights in self._flights.items():
+            if city_from and city_code_from != city_from:
+                continue
+            if city_to and city_code_to != city_to:
+                continue
+            result.extend(flights)
+        return result
+
+    def get_direction_flights(self, city_from: str, city_to: str,
+                              date_from: Optional[date] = None, date_to: Optional[date] = None) -> Sequence[Mapping]:
+        """
+        :return: flights of a direction departing within a range of dates
+        """
+        direction = (city_from, city_to)
+        if direction not in self._flights:
+            return ()
+        lo, hi = self._get_date_range(direction, date_from, date_to)
+        return self._flights[direction][lo:hi]
+
+    def get_page(self,
+                 city_from: Optional[str] = None,
+                 city_to: Optional[str] = None,
+                 date_from: Optional[date] = None,
+                 date_to: Optional[date] = None,
+                 max_price: Optional[Decimal] = None,
+                 after: Optional[PageKey] = None,
+                 limit: int = 100) -> Tuple[List[Mapping], Optional[PageKey]]:
+        """
+        Keyset pagination of flights ordered by (city_code_from, city_code_to,
+        departure_date), which are unique within a snapshot. Pages start
+        at bisections of the index, so a page costs the same whatever
+        the number of pages before it.
+        :param after: key of the last flight of the previous page
+        :return: flights of the page and the key of its last flight
+                 if there are more flights after it
+        """
+        if city_from and city_to:
+            directions = [(city_from, city_to)] if (city_from, city_to) in self._flights else []
+        else:
+            directions = self._directions
+        start = bisect_left(directions, after[:2]) if after else 0
+        if city_from:
+            start = max(start, bisect_left(directions, (city_from,)))
+
+        page = []
+        for index in range(start, len(directions)):
+            direction = directions[index]
+            if city_from and direction[0] != city_from:
+                if direction[0] > city_from:
+                    break
+                continue
+            if city_to and direction[1] != city_to:
+                continue
+
+            lo, hi = self._get_date_range(direction, date_from, date_to)
+            if after and direction == after[:2]:
+                lo = max(lo, bisect_right(self._departure_dates[direction], after[2]))
+
+            flights = self._flights[direction]
+            for position in range(lo, hi):
+                flight = flights[position]
+                if max_price is not None and flight['price'] > max_price:
+                    continue
+                if len(page) == limit:
+                    last = page[-1]
+                    return page, (last['city_code_from'], last['city_code_to'], last['departure_date'])
+                page.append(flight)
+        return page, None
+
+    def _get_date_range(self, direction: Direction,
+                        date_from: Optional[date], date_to: Optional[date]) -> Tuple[int, int]:
+        """
+        :return: positions of the first flight of a direction departing
+                 on date_from or later and of the one after date_to
+        """
+        dates = self._departure_dates[direction]
+        lo = bisect_left(dates, date_from) if date_from else 0
+        hi = bisect_right(dates, date_to) if date_to else len(dates)
+        return lo, hi
+
+    @property
+    def empty_body(self) -> EncodedJSON:
+        return self._empty_body
+
+    def prepare_bodies(self):
+        """
+        Serialize responses for every direction and for the unfiltered listing.
+        """
+        for city_from, city_to in self._flights:
+            self._bodies[city_from, city_to] = self.encode_body(city_from, city_to)
+        self._bodies[None, None] = self.encode_body()
+
+    def get_body(self, city_from: Optional[str] = None, city_to: Optional[str] = None) -> Optional[EncodedJSON]:
+        """
+        :return: prepared response with flights filtered the same way as
+                 get_flights does, None if the response isn't prepared
+        """
+        key = (city_from or None, city_to or None)
+        if city_from and city_to and key not in self._flights:
+            return self._empty_body
+        return self._bodies.get(key)
+
+    def encode_body(self, city_from: Optional[str] = None, city_to: Optional[str] = None) -> EncodedJSON:
+        """
+        :return: response with flights filtered the same way as get_flights does
+        """
+        flights = self.get_flights(city_from, city_to)
+        if not flights:
+            return self._empty_body
+        return EncodedJSON.from_rows(flights, etag=self.etag)
+
+
+class PricesBodyCache:
+    """
+    Responses which aren't prepared by snapshots (one-sided filters),
+    serialized on first use. Concurrent requests of the same response
+    share one serialization, serialized responses are kept in a LRU
+    bounded by their size until the snapshot is replaced.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._update_id: Optional[int] = None
+        self._bodies: 'OrderedDict[BodyKey, EncodedJSON]' = OrderedDict()
+        self._pending: Dict[BodyKey, asyncio.Future] = {}
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def get_body(self, snapshot: PricesSnapshot,
+                       city_from: Optional[str] = None, city_to: Optional[str] = None) -> EncodedJSON:
+        body = snapshot.get_body(city_from, city_to)
+        if body is not None:
+            return body
+
+        if snapshot.update_id != self._update_id:
+            # Responses of the previous snapshot are never requested again
+            self._bodies.clear()
+            self._size = 0
+            self._update_id = snapshot.update_id
+
+        key = (snapshot.update_id, city_from or None, city_to or None)
+        body = self._bodies.get(key)
+        if body is not None:
+            self._bodies.move_to_end(key)
+            return body
+
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.ensure_future(self._encode_body(snapshot, key))
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        # A disconnected client doesn't cancel serialization awaited by others
+        return await asyncio.shield(future)
+
+    async def _encode_body(self, snapshot: PricesSnapshot, key: 'BodyKey') -> EncodedJSON:
+        _, city_from, city_to = key
+        # Serialization and compression of a large response takes a while,
+        # don't block the event loop with it
+        body = await asyncio.get_event_loop().run_in_executor(None, snapshot.encode_body, city_from, city_to)
+        if body is not snapshot.empty_body and key[0] == self._update_id:
+            self._put(key, body)
+        return body
+
+    def _put(self, key: 'BodyKey', body: EncodedJSON):
+        if body.size > self._max_bytes:
+            return
+        self._bodies[key] = body
+        self._size += body.size
+        while self._size > self._max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self._size -= evicted.size
+
+
+class PricesSnapshotStore:
+    """
+    Keeps the snapshot of the latest completed price update in memory.
+    A newer update is loaded completely before it replaces the current
+    snapshot, so readers always see exactly one update.
+    """
+
+    def __init__(self, pg: PG, refresh_interval: float = 60, incremental: bool = False,
+                 body_cache_size: int = 64 * 1024 * 1024):
+        """
+        :param incremental: load current prices maintained by incremental
+                            price updates instead of flights of the update
+        :param body_cache_size: bytes of responses which aren't prepared
+                                by snapshots kept in memory
+        """
+        self._pg = pg
+        self._refresh_interval = refresh_interval
+        self._incremental = incremental
+        self._snapshot: Optional[PricesSnapshot] = None
+        self._refresh_lock = asyncio.Lock()
+        self._bodies = PricesBodyCache(max_bytes=body_cache_size)
+
+    @property
+    def snapshot(self) -> Optional[PricesSnapshot]:
+        return self._snapshot
+
+    async def get_body(self, city_from: Optional[str] = None, city_to: Optional[str] = None) -> Optional[EncodedJSON]:
+        """
+        :return: serialized response of the current snapshot with flights
+                 filtered the same way as get_flights does, None if
+                 no snapshot was loaded yet
+        """
+        if self._snapshot is None:
+            return None
+        return await self._bodies.get_body(self._snapshot, city_from, city_to)
+
+    async def refresh(self) -> bool:
+        """
+        Load the latest completed price update if it is not the current one.
+        :return: True iff the snapshot was replaced
+        """
+        async with self._refresh_lock:
+            last_update = await self._get_last_update()
+            if last_update is None:
+                return False
+            if self._snapshot is not None and self._snapshot.update_id == last_update['id']:
+                return False
+
+            if self._incremental:
+                query = self._get_current_prices_query(last_update['id'])
+            else:
+                query = self._get_flights_query(last_update['id'])
+            records = await self._pg.fetch(query)
+            # Serialization and compression of all responses takes a while,
+            # don't block the event loop with it
+            self._snapshot = await asyncio.get_event_loop().run_in_executor(
+                None, PricesSnapshot.from_records, last_update['id'], records
+            )
+            log.info(f'Loaded prices snapshot of update {last_update["id"]}: {len(records)} flights')
+            return True
+
+    async def run_periodic_refresh(self):
+        """
+        Picks up updates completed by other processes.
+        """
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                log.exception('Failed to refresh prices snapshot')
+
+    async def _get_last_update(self):
+        last_update_query = price_updates_table.select() \
+            .where(price_updates_table.c.status == Status.completed.value) \
+            .order_by(desc(price_updates_table.c.created_at)) \
+            .limit(1)
+        return await self._pg.fetchrow(last_update_query)
+
+    @classmethod
+    def _get_flights_query(cls, update_id: int):
+        return flights_table.select().where(flights_table.c.update_id == update_id)
+
+    @classmethod
+    def _get_current_prices_query(cls, update_id: int):
+        """
+        Current prices in the same columns as flights of an update, so that
+        responses don't depend on the mode: prices are numbered in the order
+        of directions and dates, and the update id is the one of the snapshot,
+        not of the update which set a price.
+        """
+        prices = current_prices_table.c
+        return select([
+            func.row_number().over(order_by=[prices.city_code_from, prices.city_code_to, prices.departure_date])
+                .label('id'),
+            cast(literal(update_id), Integer).label('update_id'),
+            prices.city_code_from,
+            prices.city_code_to,
+            prices.departure_date,
+            prices.price,
+            prices.booking_token,
+        ])
+
+
+async def setup_prices_snapshot(app: Application, incremental: bool = False):
+    log.info('Loading prices snapshot')
+
+    app['prices_snapshot'] = PricesSnapshotStore(app['pg'], incremental=incremental)
+    await app['prices_snapshot'].refresh()
+    refresh_task = asyncio.create_task(app['prices_snapshot'].run_periodic_refresh())
+
+    try:
+        yield
+    finally:
+        refresh_task.cancel()
+        await asyncio.gather(refresh_task, return_exceptions=True)
+        log.info('Stopped prices snapshot refresh')
@@ -1,17 +1,31 @@
 import logging
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp.abc import Application
 
 
 log = logging.getLogger(__name__)
 
+CONNECTIONS_LIMIT = 100
+CONNECTIONS_PER_HOST_LIMIT = 20
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 60
+
 
 async def setup_client_session(app: Application):
     log.info('Creating aiohttp.ClientSession')
 
+    connector = TCPConnector(
+        limit=CONNECTIONS_LIMIT,
+        limit_per_host=CONNECTIONS_PER_HOST_LIMIT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
     app['client_session'] = ClientSession(
-        headers={'Accept': 'application/json'}
+        connector=connector,
+        headers={'Accept': 'application/json'},
+        timeout=ClientTimeout(total=REQUEST_TIMEOUT)
     )
 
     try:
@@ -0,0 +1,110 @@
+import codecs
+import json
+import re
+from typing import Any, AsyncIterable, AsyncIterator
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStreamReader:
+    """
+    Decodes JSON values one by one from chunks of UTF-8 encoded text.
+    Only the unparsed tail of the text is kept in memory.
+    """
+
+    def __init__(self, chunks: AsyncIterable[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+
+    async def next_char(self) -> str:
+        """
+        Skips whitespace and consumes the next character.
+        """
+        char = await self.peek_char()
+        self._position += 1
+        return char
+
+    async def peek_char(self) -> str:
+        while True:
+            self._position = WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if self._eof:
+                raise json.JSONDecodeError('Unexpected end of data', self._buffer, self._position)
+            await self._read_chunk()
+
+    async def expect_char(self, expected: str):
+        char = await self.next_char()
+        if char != expected:
+            raise json.JSONDecodeError(f'Expecting {expected!r}', self._buffer, self._position - 1)
+
+    async def is_closed(self, closing: str) -> bool:
+        """
+        Consumes a delimiter following a member of an object or an array.
+        :return: True if the object or the array is closed
+        """
+        char = await self.next_char()
+        if char == closing:
+            return True
+        if char != ',':
+            raise json.JSONDecodeError(f"Expecting ',' or {closing!r}", self._buffer, self._position - 1)
+        return False
+
+    async def decode_value(self) -> Any:
+        await self.peek_char()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._position = end
+                    return value
+            await self._read_chunk()
+
+    async def _read_chunk(self):
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            chunk = b''
+            self._eof = True
+        self._buffer = self._buffer[self._position:] + self._text_decoder.decode(chunk, final=self._eof)
+        self._position = 0
+
+
+async def iter_json_array(chunks: AsyncIterable[bytes], key: str) -> AsyncIterator[Any]:
+    """
+    Incrementally parses a JSON object and yields items of the array
+    stored by a given key of it one by one, so that the whole document
+    never has to be kept in memory. Members following the array are not read.
+    :raise KeyError: if the object has no such key
+    :raise json.JSONDecodeError: if the document is malformed
+    """
+    reader = _JSONStreamReader(chunks)
+    await reader.expect_char('{')
+    if await reader.peek_char() == '}':
+        raise KeyError(key)
+
+    while True:
+        name = await reader.decode_value()
+        await reader.expect_char(':')
+        if name == key:
+            break
+        await reader.decode_value()
+        if await reader.is_closed('}'):
+            raise KeyError(key)
+
+    await reader.expect_char('[')
+    if await reader.peek_char() == ']':
+        return
+    while True:
+        yield await reader.decode_value()
+        if await reader.is_closed(']'):
+            return
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import zlib
+from typing import Awaitable, Callable
+
+from asyncpgsa import PG
+
+log = logging.getLogger(__name__)
+
+
+def get_lock_id(name: str) -> int:
+    """
+    :return: key of a Postgres advisory lock for a given name
+    """
+    return zlib.crc32(name.encode())
+
+
+class LeaderElection:
+    """
+    Elects one leader among processes sharing a database with a session
+    level Postgres advisory lock. The leader holds the lock on a dedicated
+    connection, so the lock is released as soon as the leader dies or its
+    connection breaks, and one of the other processes takes it over within
+    `retry_interval` seconds.
+    """
+
+    def __init__(self, pg: PG, name: str, retry_interval: float = 10, check_interval: float = 5):
+        """
+        :param retry_interval: seconds between attempts to become the leader
+        :param check_interval: seconds between checks of the connection
+                               the lock is held on
+        """
+        self._pg = pg
+        self._name = name
+        self._lock_id = get_lock_id(name)
+        self._retry_interval = retry_interval
+        self._check_interval = check_interval
+        self.is_leader = False
+
+    async def run(self, on_elected: Callable[[], Awaitable], on_deposed: Callable[[], None]):
+        """
+        Tries to become the leader until cancelled. `on_elected` is awaited
+        once the leadership is taken, `on_deposed` is called once it's lost.
+        """
+        while True:
+            try:
+                async with self._pg.pool.acquire() as db_conn:
+                    if await db_conn.fetchval('SELECT pg_try_advisory_lock($1)', self._lock_id):
+                        try:
+                            await self._lead(db_conn, on_elected)
+                        finally:
+                            if self.is_leader:
+                                self.is_leader = False
+                                on_deposed()
+                                log.warning(f'Lost {self._name} leadership')
+                            await asyncio.shield(self._unlock(db_conn))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f'Failed to take {self._name} leadership')
+            await asyncio.sleep(self._retry_interval)
+
+    async def _lead(self, db_conn, on_elected: Callable[[], Awaitable]):
+        """
+        Keeps the leadership while the connection is alive.
+        """
+        self.is_leader = True
+        log.info(f'Became {self._name} leader')
+        await on_elected()
+        while True:
+            await asyncio.sleep(self._check_interval)
+            await db_conn.fetchval('SELECT 1')
+
+    async def _unlock(self, db_conn):
+        try:
+            await db_conn.fetchval('SELECT pg_advisory_unlock($1)', self._lock_id)
+        except Exception:
+            # The lock is released together with a broken connection
+            log.warning(f'Failed to release {self._name} lock')
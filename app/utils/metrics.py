@@ -0,0 +1,41 @@
+from bisect import bisect_left
+from typing import Sequence, Dict
+
+
+class Histogram:
+    """
+    Counts observed values in buckets with given upper bounds,
+    the last implicit bucket is unbounded.
+    """
+
+    def __init__(self, name: str, buckets: Sequence[float]):
+        self.name = name
+        self.buckets = tuple(sorted(buckets))
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all observed values.
+        """
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> Dict[str, float]:
+        result = {f'le_{bound:g}': count for bound, count in zip(self.buckets, self.bucket_counts)}
+        result['inf'] = self.bucket_counts[-1]
+        result['count'] = self.count
+        result['sum'] = self.sum
+        return result
+
+    def __str__(self):
+        mean = self.sum / self.count if self.count else 0
+        buckets = ', '.join(
+            f'≤{bound:g}: {count}' for bound, count in zip(self.buckets, self.bucket_counts)
+        )
+        return f'{self.name}: {self.count} observations, mean {mean:.2f} ({buckets}, more: {self.bucket_counts[-1]})'
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Mapping, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Rate limiter which allows bursts of up to `capacity` requests
+    and `rate` requests per second on average.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at: Optional[float] = None
+        # Waiters acquire tokens one by one in the order they came
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
+
+    def _refill(self):
+        now = asyncio.get_event_loop().time()
+        if self._updated_at is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+
+class EndpointStats:
+    __slots__ = ('queued', 'in_flight', 'completed', 'max_queued', 'total_wait')
+
+    def __init__(self):
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class RequestScheduler:
+    """
+    Shared gate for outgoing requests: limits number of concurrent requests
+    to each endpoint and the overall request rate, and tracks how many
+    requests wait for their turn.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: int,
+                 concurrency_limits: Mapping[str, int],
+                 default_concurrency_limit: int = 10):
+        self._bucket = TokenBucket(rate=rate, capacity=burst)
+        self._concurrency_limits = concurrency_limits
+        self._default_concurrency_limit = default_concurrency_limit
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str):
+        """
+        Waits until a request to the endpoint is allowed and holds
+        a concurrency slot of the endpoint until the context is exited.
+        """
+        stats = self._stats[endpoint]
+        loop = asyncio.get_event_loop()
+        queued_at = loop.time()
+        waiting = True
+        stats.queued += 1
+        stats.max_queued = max(stats.max_queued, stats.queued)
+        try:
+            async with self._get_semaphore(endpoint):
+                await self._bucket.acquire()
+                waiting = False
+                stats.queued -= 1
+                stats.total_wait += loop.time() - queued_at
+                stats.in_flight += 1
+                try:
+                    yield
+                finally:
+                    stats.in_flight -= 1
+                    stats.completed += 1
+        finally:
+            if waiting:
+                stats.queued -= 1
+            if stats.queued == 0 and stats.in_flight == 0:
+                self._log_stats(endpoint)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {endpoint: stats.as_dict() for endpoint, stats in self._stats.items()}
+
+    def _get_semaphore(self, endpoint: str) -> asyncio.Semaphore:
+        if endpoint not in self._semaphores:
+            limit = self._concurrency_limits.get(endpoint, self._default_concurrency_limit)
+            self._semaphores[endpoint] = asyncio.Semaphore(limit)
+        return self._semaphores[endpoint]
+
+    def _log_stats(self, endpoint: str):
+        stats = self._stats[endpoint]
+        mean_wait = stats.total_wait / stats.completed if stats.completed else 0
+        log.debug(f'{endpoint}: {stats.completed} requests completed, '
+                  f'max queue depth {stats.max_queued}, mean wait {mean_wait:.2f}s')
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import random
+from functools import wraps
+from typing import Optional
+
+from aiohttp import ClientConnectionError, ClientPayloadError, ClientResponseError
+
+log = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while the circuit breaker is open.
+    """
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Whether a failed call might succeed if made again: network errors,
+    timeouts, throttling and server side errors are retryable, client
+    errors (e.g. 400 or 404) are not.
+    """
+    if isinstance(exc, ClientResponseError):
+        return exc.status in RETRYABLE_STATUSES
+    return isinstance(exc, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError))
+
+
+def async_retry(tries: int = 3, base_delay: float = 1, max_delay: float = 30):
+    """
+    Retries a coroutine function when it raises a retryable exception,
+    sleeping a random time up to exponentially growing delay in between
+    ("full jitter" backoff).
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(tries):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == tries - 1 or not is_retryable(e):
+                        raise
+                    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+                    log.warning(f'{func.__qualname__} failed with {e!r}, retry in {delay:.1f}s')
+                    await asyncio.sleep(delay)
+        return wrapper
+    return decorator
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service: after `failure_threshold` consecutive
+    retryable failures the circuit opens and calls fail with CircuitOpenError
+    right away. After `reset_timeout` seconds one trial call is let through,
+    it closes the circuit on success or opens it again on failure.
+
+    Usage:
+        async with circuit_breaker:
+            await make_call()
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    async def __aenter__(self):
+        if self._opened_at is None:
+            return self
+        if self._trial_in_progress or self._time() - self._opened_at < self._reset_timeout:
+            raise CircuitOpenError(f'Circuit {self.name} is open')
+        # half-open: let one call through
+        self._trial_in_progress = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._trial_in_progress = False
+        if isinstance(exc, asyncio.CancelledError):
+            return
+        if exc is None or not is_retryable(exc):
+            self._failures = 0
+            if self._opened_at is not None:
+                log.info(f'Circuit {self.name} closed')
+            self._opened_at = None
+            return
+
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self._failure_threshold:
+            if self._opened_at is None:
+                log.warning(f'Circuit {self.name} opened after {self._failures} failures')
+            self._opened_at = self._time()
+
+    @classmethod
+    def _time(cls) -> float:
+        return asyncio.get_event_loop().time()
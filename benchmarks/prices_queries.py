@@ -0,0 +1,115 @@
+"""
+Query plans and latency of /prices lookups at one year of daily snapshots.
+
+Seeds price updates and flights inside a transaction which is rolled back
+at the end, so it can be pointed at a migrated development database, ids
+of seeded updates follow the existing ones:
+
+    python -m benchmarks.prices_queries --pg-url postgresql://...
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import asyncpg
+from asyncpgsa.connection import compile_query
+from sqlalchemy import desc
+
+from app.db.schema import price_updates_table, flights_table, Status
+from app.utils.pg import DEFAULT_PG_URL
+
+SEED_SQL = '''
+INSERT INTO price_updates (id, status, created_at)
+SELECT $3 + day, 'completed', now() - make_interval(days => $1 - day)
+FROM generate_series(1, $1) AS day;
+
+DO $$
+BEGIN
+    FOR update_id IN $3 + 1..$3 + $1 LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS flights_%s PARTITION OF flights FOR VALUES IN (%s)',
+                       update_id, update_id);
+    END LOOP;
+END
+$$;
+
+INSERT INTO flights (update_id, city_code_from, city_code_to, departure_date, price, booking_token)
+SELECT update_id, direction.city_from, direction.city_to,
+       current_date + day_offset, 10 + random() * 500, md5(random()::text)
+FROM generate_series($3 + 1, $3 + $1) AS update_id,
+     (VALUES ('ALA', 'TSE'), ('TSE', 'ALA'), ('ALA', 'MOW'), ('MOW', 'ALA'),
+             ('ALA', 'CIT'), ('CIT', 'ALA'), ('TSE', 'MOW'), ('MOW', 'TSE'),
+             ('TSE', 'LED'), ('LED', 'TSE')) AS direction (city_from, city_to),
+     generate_series(0, $2 - 1) AS day_offset;
+
+ANALYZE price_updates;
+ANALYZE flights;
+'''
+
+
+def get_queries(update_id: int):
+    last_update = price_updates_table.select() \
+        .where(price_updates_table.c.status == Status.completed.value) \
+        .order_by(desc(price_updates_table.c.created_at)) \
+        .limit(1)
+    update_flights = flights_table.select() \
+        .where(flights_table.c.update_id == update_id)
+    direction_flights = update_flights \
+        .where(flights_table.c.city_code_from == 'ALA') \
+        .where(flights_table.c.city_code_to == 'TSE')
+    return {
+        'last completed update': last_update,
+        'flights of an update': update_flights,
+        'flights of a direction': direction_flights,
+    }
+
+
+async def seed(conn, days: int, number_of_days: int) -> int:
+    """
+    :return: id of the latest seeded update
+    """
+    last_id = await conn.fetchval('SELECT coalesce(max(id), 0) FROM price_updates')
+    # Multiple statements can't have arguments, substitute them as literals
+    script = SEED_SQL.replace('$1', str(int(days))).replace('$2', str(int(number_of_days))) \
+        .replace('$3', str(int(last_id)))
+    await conn.execute(script)
+    return last_id + days
+
+
+async def benchmark(conn, name, query, repeat: int):
+    sql, params = compile_query(query)
+    plan = await conn.fetch(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', *params)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await conn.fetch(sql, *params)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+
+    print(f'== {name}: {elapsed_ms:.3f} ms avg over {repeat} runs')
+    for row in plan:
+        print(f'   {row[0]}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pg-url', default=os.getenv('FLIGHTS_PG_URL', DEFAULT_PG_URL))
+    parser.add_argument('--days', type=int, default=365, help='Number of daily snapshots')
+    parser.add_argument('--number-of-days', type=int, default=30, help='Horizon of a snapshot')
+    parser.add_argument('--repeat', type=int, default=100)
+    options = parser.parse_args()
+
+    conn = await asyncpg.connect(options.pg_url)
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        update_id = await seed(conn, options.days, options.number_of_days)
+        for name, query in get_queries(update_id=update_id).items():
+            await benchmark(conn, name, query, options.repeat)
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,22 @@
+import asyncio
+import os
+import uuid
 from datetime import datetime, date
 from decimal import Decimal
+from types import SimpleNamespace
+from typing import List
 
+import psycopg2
 import pytest
+from alembic.command import upgrade
+from asyncpgsa import PG
+from yarl import URL
 
 from app.price_updater import Flight
+from app.utils.pg import make_alembic_config
+
+# Server database tests run against, they are skipped if it isn't set
+TEST_PG_URL = os.getenv('FLIGHTS_TEST_PG_URL')
 
 
 @pytest.fixture
@@ -133,6 +146,20 @@ def confirm_flight_three_trials_flight_invalid():
     ]
 
 
+@pytest.fixture
+def put_cheapest_flights():
+    """
+    Makes a stub of PriceMonitor.put_cheapest_flights
+    which puts given batches of flights to the queue.
+    """
+    def make_stub(*batches: List[Flight]):
+        async def put_cheapest_flights(queue: asyncio.Queue):
+            for flights in batches:
+                await queue.put(flights)
+        return put_cheapest_flights
+    return make_stub
+
+
 @pytest.fixture
 def default_directions():
     return (
@@ -147,3 +174,46 @@ def default_directions():
         ('TSE', 'LED'),
         ('LED', 'TSE'),
     )
+
+
+def execute_autocommit(pg_url: str, sql: str):
+    conn = psycopg2.connect(pg_url)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def postgres():
+    """
+    Temporary database created for a test and dropped after it.
+    """
+    if not TEST_PG_URL:
+        pytest.skip('FLIGHTS_TEST_PG_URL is not set')
+    name = f'flights_test_{uuid.uuid4().hex}'
+    execute_autocommit(TEST_PG_URL, f'CREATE DATABASE {name}')
+    try:
+        yield str(URL(TEST_PG_URL).with_path(f'/{name}'))
+    finally:
+        execute_autocommit(TEST_PG_URL, f'DROP DATABASE {name}')
+
+
+@pytest.fixture
+def migrated_postgres(postgres):
+    config = make_alembic_config(SimpleNamespace(config='alembic.ini', name='alembic', pg_url=postgres,
+                                                 raiseerr=False, x=None))
+    upgrade(config, 'head')
+    return postgres
+
+
+@pytest.fixture
+async def pg(migrated_postgres):
+    pg = PG()
+    await pg.init(migrated_postgres)
+    try:
+        yield pg
+    finally:
+        await pg.pool.close()
@@ -1,9 +1,27 @@
+import json
 import random
+from contextlib import asynccontextmanager
+from functools import partial
 from datetime import date
 from decimal import Decimal
 from typing import List
 
-from app.price_updater import AsyncAirlineTicketProvider, Flight
+import asynctest
+import numpy as np
+from aiohttp import ClientResponseError
+from sqlalchemy.dialects import postgresql
+
+from app.price_updater import AsyncAirlineTicketProvider, Flight, SkypickerProvider
+from app.price_updater.flight_batch import timestamps_to_days
+
+
+class MockStreamReader:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def iter_chunked(self, n):
+        for start in range(0, len(self._body), n):
+            yield self._body[start:start + n]
 
 
 class MockResponse:
@@ -11,9 +29,17 @@ class MockResponse:
         self._json = json
         self.status = status
 
+    @property
+    def content(self):
+        return MockStreamReader(json.dumps(self._json).encode())
+
     async def json(self, *args, **kwargs):
         return self._json
 
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ClientResponseError(None, (), status=self.status)
+
     async def __aexit__(self, exc_type, exc, tb):
         pass
 
@@ -21,6 +47,24 @@ class MockResponse:
         return self
 
 
+def departure_date(timestamp: int) -> date:
+    """
+    Departure date of a raw Skypicker flight, converted the same way
+    the provider does, whatever the local time zone is.
+    """
+    return date.fromordinal(int(timestamps_to_days(np.array([timestamp], dtype=np.int64))[0]))
+
+
+def mock_skypicker_provider():
+    """
+    SkypickerProvider mock which selects the cheapest flights
+    out of whatever its mocked get_flights returns.
+    """
+    provider = asynctest.MagicMock(SkypickerProvider(None))
+    provider.get_cheapest_flights = partial(AsyncAirlineTicketProvider.get_cheapest_flights, provider)
+    return provider
+
+
 class FileBasedAirlineTicketProvider(AsyncAirlineTicketProvider):
     def __init__(self, raw_flights_data):
         self._raw_flights_data = raw_flights_data
@@ -29,7 +73,7 @@ class FileBasedAirlineTicketProvider(AsyncAirlineTicketProvider):
                           date_from: date, date_to: date) -> List[Flight]:
         flights = []
         for flight in self._raw_flights_data['data']:
-            flight_date = date.fromtimestamp(flight['dTime'])
+            flight_date = departure_date(flight['dTime'])
             if date_from <= flight_date <= date_to:
                 flights.append(
                     Flight(city_code_from=flight['cityCodeFrom'],
@@ -53,3 +97,51 @@ class UnstableFileBasedAirlineTicketProvider(FileBasedAirlineTicketProvider):
     async def confirm_flight(self, flight: Flight) -> (Flight, bool):
         self.confirm_calls += 1
         return flight, bool(random.randint(0, 1))
+
+
+class MockPG:
+    """
+    Imitates asyncpgsa.PG and connections it gives out for queries
+    made by the price update scheduler.
+    """
+    def __init__(self):
+        self.open_transactions = 0
+        self.statuses = []
+        self.executed_sql = []
+        self.copied_records = 0
+        self._last_id = 0
+
+    async def fetchval(self, query, *args, **kwargs):
+        self._record_status(query)
+        self._last_id += 1
+        return self._last_id
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return None
+
+    async def fetch(self, query, *args, **kwargs):
+        return []
+
+    async def execute(self, query, *args, **kwargs):
+        self._record_status(query)
+        return 'UPDATE 1'
+
+    async def copy_records_to_table(self, table_name, records, columns):
+        self.copied_records += len(records)
+        return f'COPY {len(records)}'
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.open_transactions += 1
+        try:
+            yield self
+        finally:
+            self.open_transactions -= 1
+
+    def _record_status(self, query):
+        if isinstance(query, str):
+            self.executed_sql.append(query)
+            return
+        params = query.compile(dialect=postgresql.dialect()).params
+        if 'status' in params:
+            self.statuses.append(params['status'])
@@ -0,0 +1,61 @@
+import json
+from datetime import date
+
+import pytest
+
+from app.handlers.prices import BatchRoute, iter_route_prices, parse_batch_routes
+from app.payloads import AsyncGenJSONListPayload
+from app.snapshot import PricesSnapshot
+
+
+class MockWriter:
+    def __init__(self):
+        self.body = b''
+
+    async def write(self, chunk: bytes):
+        self.body += chunk
+
+
+@pytest.fixture
+def snapshot():
+    return PricesSnapshot.from_records(7, [
+        {'id': 1, 'city_code_from': 'TSE', 'city_code_to': 'ALA', 'departure_date': date(2020, 8, 5), 'price': 123},
+        {'id': 2, 'city_code_from': 'TSE', 'city_code_to': 'ALA', 'departure_date': date(2020, 8, 6), 'price': 412},
+        {'id': 3, 'city_code_from': 'ALA', 'city_code_to': 'TSE', 'departure_date': date(2020, 8, 6), 'price': 132},
+    ])
+
+
+def test_parse_batch_routes():
+    routes = parse_batch_routes({'routes': [
+        {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2020-08-06'},
+        {'city_from': 'ALA', 'city_to': 'TSE'},
+    ]})
+
+    assert routes == [BatchRoute('TSE', 'ALA', date(2020, 8, 6)), BatchRoute('ALA', 'TSE')]
+
+
+@pytest.mark.parametrize('document', [
+    [],
+    {'routes': []},
+    {'routes': [{'city_from': 'TSE'}]},
+    {'routes': [{'city_from': 'TSE', 'city_to': 'ALA', 'date_to': '06.08.2020'}]},
+    {'routes': [{'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2020-08-07', 'date_to': '2020-08-06'}]},
+    {'routes': [{'city_from': 'TSE', 'city_to': 'ALA'}] * 101},
+])
+def test_parse_batch_routes_malformed(document):
+    with pytest.raises(ValueError):
+        parse_batch_routes(document)
+
+
+@pytest.mark.asyncio
+async def test_route_prices_are_streamed_grouped_by_route(snapshot):
+    routes = [BatchRoute('TSE', 'ALA', date(2020, 8, 6)), BatchRoute('ALA', 'TSE'), BatchRoute('LED', 'TSE')]
+    writer = MockWriter()
+
+    await AsyncGenJSONListPayload(iter_route_prices(snapshot, routes)).write(writer)
+
+    groups = json.loads(writer.body)['data']
+    assert [(group['city_from'], group['city_to'], group['date_from']) for group in groups] == [
+        ('TSE', 'ALA', '2020-08-06'), ('ALA', 'TSE', None), ('LED', 'TSE', None)
+    ]
+    assert [[flight['id'] for flight in group['data']] for group in groups] == [[2], [3], []]
@@ -0,0 +1,83 @@
+import calendar
+from datetime import date, datetime
+from decimal import Decimal
+
+import asynctest
+import numpy as np
+import pytest
+
+from app.price_updater import Flight, FlightBatch
+from app.price_updater.flight import bulk_insert_flights, FLIGHT_RECORD_COLUMNS
+from app.price_updater.flight_batch import timestamps_to_days, prices_to_cents
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_flights_copies_in_chunks(simple_tse_ala_flight):
+    db_conn = asynctest.MagicMock()
+    db_conn.copy_records_to_table = asynctest.CoroutineMock(
+        side_effect=lambda table, records, columns: f'COPY {len(records)}'
+    )
+    flights = (simple_tse_ala_flight for _ in range(5))
+
+    inserted = await bulk_insert_flights(flights, 42, db_conn, chunk_size=2)
+
+    assert inserted == 5
+    assert [len(c.kwargs['records']) for c in db_conn.copy_records_to_table.await_args_list] == [2, 2, 1]
+    table, = db_conn.copy_records_to_table.await_args.args
+    assert table == 'flights'
+    record = db_conn.copy_records_to_table.await_args.kwargs['records'][0]
+    assert dict(zip(FLIGHT_RECORD_COLUMNS, record)) == {
+        'update_id': 42,
+        'city_code_from': 'TSE',
+        'city_code_to': 'ALA',
+        'departure_date': simple_tse_ala_flight.departure_date,
+        'price': simple_tse_ala_flight.price,
+        'booking_token': 'simple_tse_ala_flight_token',
+    }
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_no_flights():
+    db_conn = asynctest.MagicMock()
+    db_conn.copy_records_to_table = asynctest.CoroutineMock()
+
+    assert await bulk_insert_flights([], 42, db_conn) == 0
+    db_conn.copy_records_to_table.assert_not_awaited()
+
+
+def test_flight_batch_get_cheapest_for_each_date():
+    rows = [
+        ('2020-08-03T00:00:00', 123, 'some_long_token_1'),
+        ('2020-08-03T22:04:12', 234, 'some_long_token_2'),
+        ('2020-08-04T00:01:56', 132.5, 'some_long_token_3'),
+        ('2020-08-05T23:59:59', 412, 'some_long_token_4'),
+    ]
+    departure_times, prices, booking_tokens = zip(*rows)
+    batch = FlightBatch.from_columns(
+        cities_from=['TSE'] * len(rows),
+        cities_to=['ALA'] * len(rows),
+        days=timestamps_to_days(np.array([
+            calendar.timegm(datetime.fromisoformat(departure_time).timetuple())
+            for departure_time in departure_times
+        ])),
+        cents=prices_to_cents(np.array(prices)),
+        booking_tokens=list(booking_tokens)
+    )
+
+    candidates = batch.get_cheapest_for_each_date(date(2020, 8, 3), date(2020, 8, 4), number=1)
+
+    assert len(batch) == 4
+    assert batch[2] == Flight('TSE', 'ALA', date(2020, 8, 4), Decimal('132.5'), 'some_long_token_3')
+    assert {
+        departure_date: [flight.booking_token for _, _, flight in heap]
+        for departure_date, heap in candidates.items()
+    } == {
+        date(2020, 8, 3): ['some_long_token_1'],
+        date(2020, 8, 4): ['some_long_token_3'],
+    }
+
+
+def test_flight_batch_from_flights(simple_tse_ala_flight):
+    batch = FlightBatch.from_flights([simple_tse_ala_flight])
+
+    assert list(batch) == [simple_tse_ala_flight]
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from app.utils.json_stream import iter_json_array
+
+
+async def iter_chunks(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def parse(document, key='data', chunk_size=3):
+    body = document if isinstance(document, bytes) else json.dumps(document, ensure_ascii=False).encode()
+    return [item async for item in iter_json_array(iter_chunks(body, chunk_size), key)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1024])
+async def test_iter_json_array(chunk_size):
+    document = {
+        'search_id': 'Алматы',
+        'time': 12345,
+        'nested': {'data': [0]},
+        'data': [{'price': 123.5, 'route': [{'cityFrom': 'Нур-Султан'}]}, 42, 'x', None],
+        'currency': 'EUR',
+    }
+
+    assert await parse(document, chunk_size=chunk_size) == document['data']
+
+
+@pytest.mark.asyncio
+async def test_iter_json_array_empty():
+    assert await parse({'data': []}) == []
+    assert await parse(b' { "data" : [ ] } ') == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('document', [{}, {'time': 1}])
+async def test_iter_json_array_missing_key(document):
+    with pytest.raises(KeyError):
+        await parse(document)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('body', [b'', b'[1]', b'{"data": [1 2]}', b'{"data": [1, '])
+async def test_iter_json_array_malformed(body):
+    with pytest.raises(json.JSONDecodeError):
+        await parse(body)
@@ -0,0 +1,74 @@
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import chain, repeat
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import asynctest
+import pytest
+
+from app.utils.leader import LeaderElection
+
+
+class MockLockConnection:
+    def __init__(self, locked: bool, alive_checks: int = 0):
+        self.locked = locked
+        self.alive_checks = alive_checks
+        self.queries = []
+
+    async def fetchval(self, query, *args):
+        self.queries.append(query)
+        if query == 'SELECT 1':
+            if self.alive_checks == 0:
+                raise ConnectionError
+            self.alive_checks -= 1
+            return 1
+        if 'pg_try_advisory_lock' in query:
+            return self.locked
+        return True
+
+
+def mock_pg(*connections):
+    # The last connection is given out again and again
+    connections = chain(connections, repeat(connections[-1]))
+
+    @asynccontextmanager
+    async def acquire():
+        yield next(connections)
+
+    return SimpleNamespace(pool=SimpleNamespace(acquire=acquire))
+
+
+@pytest.mark.asyncio
+async def test_leader_election_deposes_leader_with_broken_connection():
+    leader_connection = MockLockConnection(locked=True, alive_checks=2)
+    follower_connection = MockLockConnection(locked=False)
+    election = LeaderElection(mock_pg(leader_connection, follower_connection), name='test',
+                              retry_interval=0.01, check_interval=0.01)
+    on_elected = asynctest.CoroutineMock()
+    on_deposed = Mock()
+
+    task = asyncio.ensure_future(election.run(on_elected, on_deposed))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    on_elected.assert_awaited_once()
+    on_deposed.assert_called_once()
+    assert not election.is_leader
+    assert leader_connection.queries[-1] == 'SELECT pg_advisory_unlock($1)'
+    assert set(follower_connection.queries) == {'SELECT pg_try_advisory_lock($1)'}
+
+
+@pytest.mark.asyncio
+async def test_leader_election_follower_is_not_elected():
+    election = LeaderElection(mock_pg(MockLockConnection(locked=False)), name='test', retry_interval=10)
+    on_elected = asynctest.CoroutineMock()
+
+    task = asyncio.ensure_future(election.run(on_elected, Mock()))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    on_elected.assert_not_awaited()
+    assert not election.is_leader
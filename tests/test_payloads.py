@@ -0,0 +1,64 @@
+import gzip
+import json
+from datetime import date
+from decimal import Decimal
+
+import brotli
+import pytest
+
+from app.payloads import EncodedJSON
+
+
+@pytest.fixture
+def encoded_flights():
+    rows = [
+        {'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 5), 'price': Decimal('123.50')},
+        {'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 6), 'price': Decimal(99)},
+    ]
+    return EncodedJSON.from_rows(rows, etag='W/"prices-7"')
+
+
+def test_encoded_json_codings(encoded_flights):
+    identity = encoded_flights.codings['identity']
+
+    assert identity.startswith(b'{"data":[{')
+    assert json.loads(identity)['data'][0] == {
+        'city_code_from': 'TSE', 'city_code_to': 'ALA',
+        'departure_date': '2020-08-05', 'price': 123.5
+    }
+    assert gzip.decompress(encoded_flights.codings['gzip']) == identity
+    assert brotli.decompress(encoded_flights.codings['br']) == identity
+
+
+@pytest.mark.parametrize(
+    'accept_encoding, expected',
+    [
+        (None, 'identity'),
+        ('gzip, deflate', 'gzip'),
+        ('gzip, deflate, br', 'br'),
+        ('br;q=0, gzip;q=0.5', 'gzip'),
+        ('*', 'br'),
+        ('br;q=0, *', 'gzip'),
+        ('br;q=0, gzip;q=0, *', 'identity'),
+        ('deflate', 'identity'),
+    ]
+)
+def test_encoded_json_negotiate(encoded_flights, accept_encoding, expected):
+    assert encoded_flights.negotiate(accept_encoding) == expected
+
+
+@pytest.mark.parametrize(
+    'if_none_match, expected',
+    [
+        (None, False),
+        ('W/"prices-7"', True),
+        ('"prices-7"', True),
+        ('"prices-6", W/"prices-7"', True),
+        ('*', True),
+        ('W/"prices-6"', False),
+    ]
+)
+def test_encoded_json_matches(encoded_flights, if_none_match, expected):
+    assert encoded_flights.matches(if_none_match) == expected
@@ -0,0 +1,245 @@
+from datetime import datetime
+
+import asynctest
+import pytest
+
+from app.db.schema import Status
+from app.price_updater.periodical_price_update import PeriodicalPriceUpdateScheduler
+from app.price_updater.routes import Route
+from tests.helpers import MockPG, FileBasedAirlineTicketProvider
+
+
+@pytest.fixture
+def scheduler(mocker, get_flights_simple_response):
+    provider = FileBasedAirlineTicketProvider(get_flights_simple_response)
+    scheduler = PeriodicalPriceUpdateScheduler(
+        pg=MockPG(),
+        provider=provider,
+        directions=(('TSE', 'ALA'),),
+        number_of_days=30,
+    )
+    mocker.patch.object(scheduler, '_schedule_next_update')
+    mocker.patch('app.price_updater.periodical_price_update.get_jobs_progress',
+                 new=asynctest.CoroutineMock(return_value=(0, 1)))
+    mocker.patch('app.price_updater.periodical_price_update.count_missing_jobs',
+                 new=asynctest.CoroutineMock(return_value=0))
+    return scheduler
+
+
+@pytest.mark.asyncio
+async def test_update_prices_saves_flights_of_each_direction_separately(scheduler, simple_tse_ala_flight,
+                                                                        put_cheapest_flights):
+    pg = scheduler._pg
+
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights(*[[simple_tse_ala_flight]] * 3)
+
+    await scheduler._update_prices()
+
+    assert pg.statuses == ['in_process', 'completed']
+    assert pg.executed_sql[0] == 'CREATE TABLE IF NOT EXISTS flights_1 PARTITION OF flights FOR VALUES IN (1)'
+    # Directions are checkpointed along with their flights
+    assert all(sql.startswith('UPDATE price_update_jobs') for sql in pg.executed_sql[1:])
+    # Jobs and flights
+    assert pg.copied_records == 1 + 3
+    scheduler._schedule_next_update.assert_called_once_with(soon=False)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_marks_update_failed_on_error(scheduler):
+    scheduler._updater.put_cheapest_flights = asynctest.CoroutineMock(side_effect=RuntimeError)
+
+    await scheduler._update_prices()
+
+    assert scheduler._pg.statuses == ['in_process', 'failed']
+    scheduler._schedule_next_update.assert_called_once_with(soon=True)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_schedules_next_update_if_database_fails(scheduler):
+    scheduler._updater.put_cheapest_flights = asynctest.CoroutineMock(side_effect=RuntimeError)
+    execute = scheduler._pg.execute
+
+    async def execute_until_status_update(query, *args):
+        # Raw SQL (the partition) goes through, the status update fails
+        if not isinstance(query, str):
+            raise ConnectionError
+        return await execute(query, *args)
+
+    scheduler._pg.execute = execute_until_status_update
+
+    await scheduler._update_prices()
+
+    assert scheduler._pg.statuses == ['in_process']
+    scheduler._schedule_next_update.assert_called_once_with(soon=True)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_schedules_next_update_if_completion_handler_fails(scheduler, simple_tse_ala_flight,
+                                                                               put_cheapest_flights):
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights([simple_tse_ala_flight])
+    scheduler._on_update_completed = asynctest.CoroutineMock(side_effect=RuntimeError)
+
+    await scheduler._update_prices()
+
+    scheduler._on_update_completed.assert_awaited_once()
+    assert scheduler._pg.statuses == ['in_process', 'completed']
+    scheduler._schedule_next_update.assert_called_once_with(soon=False)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_drops_outdated_snapshots(scheduler, simple_tse_ala_flight, mocker, put_cheapest_flights):
+    pg = scheduler._pg
+    scheduler._keep_snapshots = 2
+    pg.fetchrow = asynctest.CoroutineMock(return_value={'id': 3})
+    pg.fetch = asynctest.CoroutineMock(return_value=[
+        {'relname': 'flights_1'}, {'relname': 'flights_2'}, {'relname': 'flights_3'}, {'relname': 'flights_4'},
+    ])
+
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights([simple_tse_ala_flight])
+    mocker.patch('app.price_updater.periodical_price_update.get_saved_directions',
+                 new=asynctest.CoroutineMock(return_value={('TSE', 'ALA')}))
+
+    await scheduler._update_prices()
+
+    assert pg.executed_sql[-2:] == ['DROP TABLE IF EXISTS flights_1', 'DROP TABLE IF EXISTS flights_2']
+
+
+@pytest.mark.asyncio
+async def test_incremental_update_saves_price_changes(scheduler, simple_tse_ala_flight, put_cheapest_flights):
+    pg = scheduler._pg
+    scheduler._incremental = True
+
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights([simple_tse_ala_flight])
+
+    await scheduler._update_prices()
+
+    assert pg.statuses == ['in_process', 'completed']
+    assert not any(sql.startswith('CREATE TABLE') for sql in pg.executed_sql)
+    # The job and the price change
+    assert pg.copied_records == 2
+    assert pg.open_transactions == 0
+
+
+@pytest.mark.asyncio
+async def test_distributed_update_waits_for_jobs(scheduler, mocker):
+    pg = scheduler._pg
+    scheduler._distributed = True
+    scheduler.JOBS_POLL_INTERVAL = 0
+    scheduler._updater.put_cheapest_flights = asynctest.CoroutineMock()
+    enqueue_jobs = mocker.patch('app.price_updater.periodical_price_update.enqueue_jobs',
+                                new=asynctest.CoroutineMock())
+    get_jobs_progress = mocker.patch('app.price_updater.periodical_price_update.get_jobs_progress',
+                                     new=asynctest.CoroutineMock(side_effect=[(1, 10), (0, 30), (0, 30)]))
+    drop_outdated_jobs = mocker.patch('app.price_updater.periodical_price_update.drop_outdated_jobs',
+                                      new=asynctest.CoroutineMock())
+
+    await scheduler._update_prices()
+
+    enqueue_jobs.assert_called_once_with(1, [Route('TSE', 'ALA', 30)], pg, date_spans={}, status=Status.pending)
+    assert get_jobs_progress.call_count == 3
+    drop_outdated_jobs.assert_awaited_once_with(scheduler.JOBS_RETENTION, pg)
+    scheduler._updater.put_cheapest_flights.assert_not_called()
+    assert pg.statuses == ['in_process', 'completed']
+    scheduler._schedule_next_update.assert_called_once_with(soon=False)
+
+
+@pytest.mark.asyncio
+async def test_update_prices_loads_routes(scheduler, simple_tse_ala_flight, mocker, put_cheapest_flights):
+    pg = scheduler._pg
+    scheduler._directions = None
+    scheduler._incremental = True
+    load_routes = mocker.patch('app.price_updater.periodical_price_update.load_routes',
+                               new=asynctest.CoroutineMock(return_value=[Route('TSE', 'ALA', 90)]))
+
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights([simple_tse_ala_flight])
+
+    await scheduler._update_prices()
+
+    load_routes.assert_called_once_with(pg, due_only=True)
+    assert scheduler._updater.directions == [('TSE', 'ALA')]
+    assert scheduler._updater.horizons == {('TSE', 'ALA'): 90}
+    assert pg.statuses == ['in_process', 'completed']
+    assert pg.executed_sql[-1].startswith('UPDATE routes SET refreshed_at')
+
+
+@pytest.mark.asyncio
+async def test_update_prices_skips_update_without_due_routes(scheduler, mocker):
+    pg = scheduler._pg
+    scheduler._directions = None
+    mocker.patch('app.price_updater.periodical_price_update.load_routes', new=asynctest.CoroutineMock(return_value=[]))
+
+    await scheduler._update_prices()
+
+    assert pg.statuses == []
+    scheduler._schedule_next_update.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test_update_with_directions_without_flights_is_resumed(scheduler, simple_tse_ala_flight, mocker,
+                                                                 put_cheapest_flights):
+    pg = scheduler._pg
+    scheduler._directions = (('TSE', 'ALA'), ('ALA', 'TSE'))
+    scheduler._incremental = True
+    get_jobs_progress = mocker.patch('app.price_updater.periodical_price_update.get_jobs_progress',
+                                     new=asynctest.CoroutineMock(side_effect=[(0, 1), (0, 2)]))
+    mocker.patch('app.price_updater.periodical_price_update.count_missing_jobs',
+                 new=asynctest.CoroutineMock(side_effect=[1, 0]))
+    get_unfinished_routes = mocker.patch('app.price_updater.periodical_price_update.get_unfinished_routes',
+                                         new=asynctest.CoroutineMock(return_value=([Route('ALA', 'TSE', 30)], {})))
+
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights([simple_tse_ala_flight])
+
+    await scheduler._update_prices()
+
+    assert pg.statuses == ['in_process']
+    scheduler._schedule_next_update.assert_called_once_with(soon=True)
+
+    await scheduler._update_prices()
+
+    get_unfinished_routes.assert_called_once_with(1, pg)
+    assert scheduler._updater.directions == [('ALA', 'TSE')]
+    assert get_jobs_progress.call_count == 2
+    # The update is completed without creating a new one
+    assert pg.statuses == ['in_process', 'completed']
+    scheduler._schedule_next_update.assert_called_with(soon=False)
+
+
+@pytest.mark.asyncio
+async def test_distributed_update_requeues_jobs_without_flights(scheduler, mocker):
+    pg = scheduler._pg
+    scheduler._distributed = True
+    scheduler.JOBS_POLL_INTERVAL = 0
+    mocker.patch('app.price_updater.periodical_price_update.enqueue_jobs', new=asynctest.CoroutineMock())
+    # Workers finish all jobs each time, one of them without flights the first time
+    mocker.patch('app.price_updater.periodical_price_update.get_jobs_progress',
+                 new=asynctest.CoroutineMock(side_effect=[(0, 10), (0, 10), (0, 20), (0, 20)]))
+    mocker.patch('app.price_updater.periodical_price_update.count_missing_jobs',
+                 new=asynctest.CoroutineMock(side_effect=[1, 0]))
+    mocker.patch('app.price_updater.periodical_price_update.get_unfinished_routes',
+                 new=asynctest.CoroutineMock(return_value=([Route('TSE', 'ALA', 30)], {})))
+    requeue_unfinished_jobs = mocker.patch('app.price_updater.periodical_price_update.requeue_unfinished_jobs',
+                                           new=asynctest.CoroutineMock())
+
+    await scheduler._update_prices()
+
+    assert pg.statuses == ['in_process']
+    requeue_unfinished_jobs.assert_not_called()
+    scheduler._schedule_next_update.assert_called_once_with(soon=True)
+
+    await scheduler._update_prices()
+
+    requeue_unfinished_jobs.assert_called_once_with(1, pg)
+    assert pg.statuses == ['in_process', 'completed']
+    scheduler._schedule_next_update.assert_called_with(soon=False)
+
+
+@pytest.mark.asyncio
+async def test_run_resumes_interrupted_update(scheduler, mocker):
+    pg = scheduler._pg
+    pg.fetchrow = asynctest.CoroutineMock(return_value={'id': 5, 'created_at': datetime.utcnow()})
+    mocker.patch.object(scheduler, '_start_update')
+
+    await scheduler.run()
+
+    assert scheduler._interrupted_update_id == 5
+    scheduler._start_update.assert_called_once_with()
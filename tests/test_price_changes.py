@@ -0,0 +1,121 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import asynctest
+import pytest
+from freezegun import freeze_time
+
+from app.price_updater import Flight
+from app.db.schema import Status, current_prices_table, price_changes_table, price_updates_table
+from app.price_updater.price_changes import (
+    apply_price_changes, drop_outdated_price_changes, get_price_changes, save_price_changes,
+    PRICE_CHANGE_RECORD_COLUMNS
+)
+from tests.helpers import MockPG
+
+
+def test_get_price_changes():
+    current_prices = [
+        {'city_code_from': 'TSE', 'city_code_to': 'ALA', 'departure_date': date(2020, 8, day),
+         'price': Decimal(price), 'booking_token': f'old_token_{day}'}
+        for day, price in ((1, 100), (2, 200), (3, 300), (5, 500))
+    ]
+    flights = [
+        Flight('TSE', 'ALA', date(2020, 8, 2), Decimal(200), 'new_token_2'),
+        Flight('TSE', 'ALA', date(2020, 8, 3), Decimal('299.5'), 'new_token_3'),
+        Flight('TSE', 'ALA', date(2020, 8, 4), Decimal(400), 'new_token_4'),
+        Flight('TSE', 'ALA', date(2020, 8, 5), Decimal(500), 'old_token_5'),
+    ]
+
+    changes = get_price_changes(current_prices, flights, price_update_id=42)
+
+    # The booking token of the same price is replaced by the latest one
+    assert [dict(zip(PRICE_CHANGE_RECORD_COLUMNS, change)) for change in changes] == [
+        {'update_id': 42, 'change_type': 'changed', 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 2), 'price': Decimal(200), 'booking_token': 'new_token_2'},
+        {'update_id': 42, 'change_type': 'changed', 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 3), 'price': Decimal('299.5'), 'booking_token': 'new_token_3'},
+        {'update_id': 42, 'change_type': 'inserted', 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 4), 'price': Decimal(400), 'booking_token': 'new_token_4'},
+        {'update_id': 42, 'change_type': 'removed', 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 1), 'price': None, 'booking_token': None},
+    ]
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-08-02')
+async def test_save_price_changes_keeps_prices_outside_of_date_span():
+    pg = MockPG()
+    pg.fetch = asynctest.CoroutineMock(return_value=[
+        {'city_code_from': 'TSE', 'city_code_to': 'ALA', 'departure_date': date(2020, 8, day),
+         'price': Decimal(100), 'booking_token': f'old_token_{day}'}
+        for day in (1, 3, 5)
+    ])
+    flights = [Flight('TSE', 'ALA', date(2020, 8, 4), Decimal(100), 'new_token_4')]
+
+    changes = await save_price_changes(flights, 42, pg,
+                                       date_spans={('TSE', 'ALA'): (date(2020, 8, 4), date(2020, 8, 5))})
+
+    # 4th is inserted, departed 1st and 5th within the span are removed,
+    # 3rd is outside of the span
+    assert changes == 3
+    assert pg.copied_records == 3
+
+
+async def create_price_update(pg, status: Status, created_at: datetime) -> int:
+    query = price_updates_table.insert() \
+        .values(status=status.value, created_at=created_at) \
+        .returning(price_updates_table.c.id)
+    return await pg.fetchval(query)
+
+
+@pytest.mark.asyncio
+async def test_apply_price_changes(pg):
+    now = datetime.utcnow()
+    first_update_id = await create_price_update(pg, Status.completed, now)
+    for day, price in ((1, 100), (2, 200), (4, 400)):
+        await pg.execute(current_prices_table.insert().values(
+            city_code_from='TSE', city_code_to='ALA', departure_date=date(2030, 8, day), price=Decimal(price),
+            booking_token=f'old_token_{day}', update_id=first_update_id,
+        ))
+    update_id = await create_price_update(pg, Status.in_process, now)
+    flights = [
+        Flight('TSE', 'ALA', date(2030, 8, 2), Decimal(250), 'new_token_2'),
+        Flight('TSE', 'ALA', date(2030, 8, 3), Decimal(300), 'new_token_3'),
+        Flight('TSE', 'ALA', date(2030, 8, 4), Decimal(400), 'old_token_4'),
+    ]
+
+    async with pg.transaction() as db_conn:
+        assert await save_price_changes(flights, update_id, db_conn) == 3
+    async with pg.transaction() as db_conn:
+        await apply_price_changes(update_id, db_conn)
+
+    query = current_prices_table.select().order_by(current_prices_table.c.departure_date)
+    assert [(row['departure_date'].day, row['price'], row['booking_token'], row['update_id'])
+            for row in await pg.fetch(query)] == [
+        (2, Decimal(250), 'new_token_2', update_id),
+        (3, Decimal(300), 'new_token_3', update_id),
+        # Unchanged prices aren't rewritten
+        (4, Decimal(400), 'old_token_4', first_update_id),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_drop_outdated_price_changes(pg):
+    now = datetime.utcnow()
+    update_ids = {
+        'outdated': await create_price_update(pg, Status.completed, now - timedelta(days=2)),
+        'failed': await create_price_update(pg, Status.failed, now),
+        'recent': await create_price_update(pg, Status.completed, now),
+        'in_process': await create_price_update(pg, Status.in_process, now),
+    }
+    for update_id in update_ids.values():
+        await pg.execute(price_changes_table.insert().values(
+            update_id=update_id, change_type='removed', city_code_from='TSE', city_code_to='ALA',
+            departure_date=date(2030, 8, 1),
+        ))
+
+    await drop_outdated_price_changes(timedelta(days=1), pg)
+
+    kept = {row['update_id'] for row in await pg.fetch(price_changes_table.select())}
+    assert kept == {update_ids['recent'], update_ids['in_process']}
@@ -0,0 +1,184 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp.web_app import Application
+
+from app.db.schema import (
+    Status, current_prices_table, price_history_rollups_table, price_history_table, price_updates_table
+)
+from app.handlers.price_history import PriceHistoryView, aggregate_rollups
+from app.price_updater import Flight
+from app.price_updater.flight import bulk_insert_flights, create_flights_partition
+from app.price_updater.price_history import save_price_history
+from tests.helpers import MockPG
+
+
+def test_aggregate_rollups():
+    rollups = [
+        {'min_price_cents': 10050, 'max_price_cents': 30000, 'sum_price_cents': 60050, 'prices_count': 3},
+        {'min_price_cents': 12000, 'max_price_cents': 45000, 'sum_price_cents': 57000, 'prices_count': 2},
+    ]
+
+    assert aggregate_rollups(rollups) == {
+        'min_price': 100.5,
+        'avg_price': 234.1,
+        'max_price': 450.0,
+        'prices_count': 5,
+    }
+
+
+def test_aggregate_no_rollups():
+    assert aggregate_rollups([]) == {
+        'min_price': None,
+        'avg_price': None,
+        'max_price': None,
+        'prices_count': 0,
+    }
+
+
+async def create_price_update(pg) -> int:
+    query = price_updates_table.insert() \
+        .values(status=Status.completed.value, created_at=datetime.utcnow()) \
+        .returning(price_updates_table.c.id)
+    return await pg.fetchval(query)
+
+
+async def get_history(pg):
+    history = await pg.fetch(price_history_table.select().order_by(*price_history_table.primary_key.columns))
+    rollups = await pg.fetch(
+        price_history_rollups_table.select().order_by(*price_history_rollups_table.primary_key.columns)
+    )
+    return (
+        [(row['city_code_from'], row['departure_date'].day, row['observed_on'].day, row['price_cents'])
+         for row in history],
+        [(row['city_code_from'], row['observed_on'].day, row['min_price_cents'], row['max_price_cents'],
+          row['sum_price_cents'], row['prices_count']) for row in rollups],
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_price_history(pg):
+    update_id = await create_price_update(pg)
+    async with pg.transaction() as db_conn:
+        await create_flights_partition(update_id, db_conn)
+        await bulk_insert_flights([
+            Flight('TSE', 'ALA', date(2030, 8, 1), Decimal('100.5'), 'token_1'),
+            Flight('TSE', 'ALA', date(2030, 8, 2), Decimal(200), 'token_2'),
+            Flight('ALA', 'TSE', date(2030, 8, 1), Decimal(300), 'token_3'),
+        ], update_id, db_conn)
+        await save_price_history(update_id, date(2030, 7, 1), db_conn)
+
+    assert await get_history(pg) == (
+        [('ALA', 1, 1, 30000), ('TSE', 1, 1, 10050), ('TSE', 2, 1, 20000)],
+        [('ALA', 1, 30000, 30000, 30000, 1), ('TSE', 1, 10050, 20000, 30050, 2)],
+    )
+
+    # An incremental update later on the same day overwrites prices of its directions
+    update_id = await create_price_update(pg)
+    await pg.execute(current_prices_table.insert().values(
+        city_code_from='TSE', city_code_to='ALA', departure_date=date(2030, 8, 1), price=Decimal(150),
+        booking_token='token_4', update_id=update_id,
+    ))
+    async with pg.transaction() as db_conn:
+        await save_price_history(update_id, date(2030, 7, 1), db_conn, incremental=True, directions=[('TSE', 'ALA')])
+        await save_price_history(update_id, date(2030, 7, 2), db_conn, incremental=True)
+
+    assert await get_history(pg) == (
+        [('ALA', 1, 1, 30000), ('TSE', 1, 1, 15000), ('TSE', 1, 2, 15000), ('TSE', 2, 1, 20000)],
+        [('ALA', 1, 30000, 30000, 30000, 1), ('TSE', 1, 15000, 15000, 15000, 1), ('TSE', 2, 15000, 15000, 15000, 1)],
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_price_history_of_date_spans(pg):
+    update_id = await create_price_update(pg)
+    await pg.execute(current_prices_table.insert().values([
+        dict(city_code_from='TSE', city_code_to='ALA', departure_date=date(2030, 8, day), price=Decimal(100 * day),
+             booking_token=f'token_{day}', update_id=update_id)
+        for day in (1, 2, 3)
+    ] + [
+        dict(city_code_from='ALA', city_code_to='TSE', departure_date=date(2030, 8, 1), price=Decimal(400),
+             booking_token='token_4', update_id=update_id)
+    ]))
+
+    # Only the refreshed window of a route is observed
+    async with pg.transaction() as db_conn:
+        await save_price_history(update_id, date(2030, 7, 1), db_conn, incremental=True,
+                                 directions=[('TSE', 'ALA'), ('ALA', 'TSE')],
+                                 date_spans={('TSE', 'ALA'): (date(2030, 8, 2), date(2030, 8, 3))})
+
+    assert await get_history(pg) == (
+        [('ALA', 1, 1, 40000), ('TSE', 2, 1, 20000), ('TSE', 3, 1, 30000)],
+        [('ALA', 1, 40000, 40000, 40000, 1), ('TSE', 1, 20000, 30000, 50000, 2)],
+    )
+
+
+async def make_client(pg) -> TestClient:
+    app = Application()
+    app['pg'] = pg
+    app.router.add_route('*', '/prices/history', PriceHistoryView)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('params', [
+    {'city_from': 'TSE', 'date_from': '2030-07-01', 'date_to': '2030-07-31'},
+    {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2030-07-01'},
+    {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '01.07.2030', 'date_to': '2030-07-31'},
+    {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2030-07-31', 'date_to': '2030-07-01'},
+    {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2029-06-30', 'date_to': '2030-07-01'},
+    {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2030-07-01', 'date_to': '2030-07-31', 'departure_date': 'x'},
+])
+async def test_price_history_validates_params(params):
+    client = await make_client(MockPG())
+    try:
+        response = await client.get('/prices/history', params=params)
+        assert response.status == 400
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_price_history_view(pg):
+    rollups = ((1, 10000, 30000, 60000, 3), (2, 12000, 12000, 12000, 1))
+    for observed_on, min_cents, max_cents, sum_cents, count in rollups:
+        await pg.execute(price_history_rollups_table.insert().values(
+            city_code_from='TSE', city_code_to='ALA', observed_on=date(2030, 7, observed_on),
+            min_price_cents=min_cents, max_price_cents=max_cents, sum_price_cents=sum_cents, prices_count=count,
+        ))
+    for observed_on, price_cents in ((1, 10000), (2, 12050), (3, 9000)):
+        await pg.execute(price_history_table.insert().values(
+            city_code_from='TSE', city_code_to='ALA', departure_date=date(2030, 8, 1),
+            observed_on=date(2030, 7, observed_on), price_cents=price_cents,
+        ))
+    params = {'city_from': 'TSE', 'city_to': 'ALA', 'date_from': '2030-07-01', 'date_to': '2030-07-02'}
+
+    client = await make_client(pg)
+    try:
+        response = await client.get('/prices/history', params=params)
+        assert response.status == 200
+        assert await response.json() == {
+            'data': [
+                {'observed_on': '2030-07-01', 'min_price': 100.0, 'avg_price': 200.0, 'max_price': 300.0,
+                 'prices_count': 3},
+                {'observed_on': '2030-07-02', 'min_price': 120.0, 'avg_price': 120.0, 'max_price': 120.0,
+                 'prices_count': 1},
+            ],
+            'aggregates': {'min_price': 100.0, 'avg_price': 180.0, 'max_price': 300.0, 'prices_count': 4},
+        }
+
+        response = await client.get('/prices/history', params={**params, 'departure_date': '2030-08-01'})
+        assert response.status == 200
+        assert await response.json() == {
+            'data': [
+                {'observed_on': '2030-07-01', 'price': 100.0},
+                {'observed_on': '2030-07-02', 'price': 120.5},
+            ],
+            'aggregates': {'min_price': 100.0, 'avg_price': 110.25, 'max_price': 120.5, 'prices_count': 2},
+        }
+    finally:
+        await client.close()
@@ -1,6 +1,6 @@
 import asyncio
 import json
-from datetime import date, datetime
+from datetime import date, timedelta
 from decimal import Decimal
 from pathlib import Path
 from unittest.mock import call
@@ -9,8 +9,11 @@ import asynctest
 import pytest
 from freezegun import freeze_time
 
-from app.price_updater import PriceMonitor, SkypickerProvider
-from tests.helpers import FileBasedAirlineTicketProvider, UnstableFileBasedAirlineTicketProvider
+from app.price_updater import Flight, PriceMonitor
+from app.price_updater.confirmation_cache import ConfirmationCache
+from tests.helpers import (
+    FileBasedAirlineTicketProvider, UnstableFileBasedAirlineTicketProvider, departure_date, mock_skypicker_provider
+)
 
 
 @pytest.mark.asyncio
@@ -28,7 +31,7 @@ async def test_price_monitor_cheapest():
 
     for cheapest_flight in cheapest_flights:
         for flight in raw_flights_data['data']:
-            flight_departure_date = date.fromtimestamp(flight['dTime'])
+            flight_departure_date = departure_date(flight['dTime'])
             if (cheapest_flight.departure_date == flight_departure_date and
                     cheapest_flight.price > Decimal(flight['price'])):
                 assert f'There is a flight at {flight_departure_date} that is cheaper than monitor found'
@@ -39,7 +42,7 @@ async def test_price_monitor_cheapest():
 async def test_price_monitor_calls_get_flights_with_proper_args(simple_tse_ala_flight,
                                                                 default_directions):
 
-    skypicker_patched = asynctest.MagicMock(SkypickerProvider(None))
+    skypicker_patched = mock_skypicker_provider()
     skypicker_patched.get_flights = asynctest.CoroutineMock(return_value=[simple_tse_ala_flight])
     skypicker_patched.confirm_flight = asynctest.CoroutineMock(return_value=(simple_tse_ala_flight, True))
 
@@ -94,3 +97,151 @@ async def test_price_monitor_retries_unconfirmed_flights(mock_sleep):
     await price_monitor.get_cheapest_flights()
 
     assert provider.confirm_flight.await_count == provider.confirm_calls
+
+
+@pytest.mark.asyncio
+async def test_price_monitor_drops_flights_not_confirmed_within_budget(simple_tse_ala_flight):
+    async def confirm_flight(flight):
+        await asyncio.sleep(10)
+        return flight, True
+
+    provider = mock_skypicker_provider()
+    provider.get_flights = asynctest.CoroutineMock(return_value=[simple_tse_ala_flight])
+    provider.confirm_flight = asynctest.CoroutineMock(side_effect=confirm_flight)
+
+    price_monitor = PriceMonitor(provider=provider,
+                                 number_of_days=30,
+                                 directions=(('TSE', 'ALA'),),
+                                 confirmation_budget=0.01)
+    with freeze_time('2020-08-01'):
+        cheapest_flights = await price_monitor.get_cheapest_flights()
+
+    assert cheapest_flights == []
+    provider.confirm_flight.assert_awaited_once_with(simple_tse_ala_flight)
+
+
+@pytest.mark.asyncio
+async def test_price_monitor_cancels_confirmations_when_cancelled(simple_tse_ala_flight):
+    confirmation_started = asyncio.Event()
+    confirmation_cancelled = asyncio.Event()
+
+    async def confirm_flight(flight):
+        confirmation_started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            confirmation_cancelled.set()
+            raise
+        return flight, True
+
+    provider = mock_skypicker_provider()
+    provider.get_flights = asynctest.CoroutineMock(return_value=[simple_tse_ala_flight])
+    provider.confirm_flight = confirm_flight
+
+    price_monitor = PriceMonitor(provider=provider,
+                                 number_of_days=30,
+                                 directions=(('TSE', 'ALA'),))
+    with freeze_time('2020-08-01'):
+        update = asyncio.ensure_future(price_monitor.get_cheapest_flights())
+        await asyncio.wait_for(confirmation_started.wait(), timeout=1)
+        update.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await update
+
+    await asyncio.wait_for(confirmation_cancelled.wait(), timeout=1)
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-08-01')
+async def test_price_monitor_tries_next_cheapest_candidate_without_requesting_provider():
+    departure_date = date.fromisoformat('2020-08-05')
+    flights = [
+        Flight('TSE', 'ALA', departure_date, Decimal(price), f'token_{price}')
+        for price in (300, 100, 200, 400)
+    ]
+    rejected_tokens = {'token_100', 'token_200'}
+
+    async def confirm_flight(flight):
+        return flight, flight.booking_token not in rejected_tokens
+
+    provider = mock_skypicker_provider()
+    provider.get_flights = asynctest.CoroutineMock(return_value=flights)
+    provider.confirm_flight = asynctest.CoroutineMock(side_effect=confirm_flight)
+
+    price_monitor = PriceMonitor(provider=provider,
+                                 number_of_days=30,
+                                 directions=(('TSE', 'ALA'),))
+    cheapest_flights = await price_monitor.get_cheapest_flights()
+
+    assert [flight.booking_token for flight in cheapest_flights] == ['token_300']
+    provider.get_flights.assert_awaited_once()
+    assert [c.args[0].booking_token for c in provider.confirm_flight.await_args_list] == \
+        ['token_100', 'token_200', 'token_300']
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-08-01')
+async def test_price_monitor_skips_flights_with_cached_confirmation(simple_tse_ala_flight):
+    provider = mock_skypicker_provider()
+    provider.get_flights = asynctest.CoroutineMock(return_value=[simple_tse_ala_flight])
+    provider.confirm_flight = asynctest.CoroutineMock(return_value=(simple_tse_ala_flight, True))
+    confirmation_cache = ConfirmationCache(ttl=timedelta(hours=1))
+
+    price_monitor = PriceMonitor(provider=provider,
+                                 number_of_days=30,
+                                 directions=(('TSE', 'ALA'),),
+                                 confirmation_cache=confirmation_cache)
+    first_run_flights = await price_monitor.get_cheapest_flights()
+    second_run_flights = await price_monitor.get_cheapest_flights()
+
+    assert first_run_flights == second_run_flights == [simple_tse_ala_flight]
+    provider.confirm_flight.assert_awaited_once_with(simple_tse_ala_flight)
+    assert (confirmation_cache.hits, confirmation_cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-08-01')
+async def test_price_monitor_requests_date_windows(get_flights_simple_response):
+    provider = FileBasedAirlineTicketProvider(get_flights_simple_response)
+    provider.get_flights = asynctest.CoroutineMock(side_effect=provider.get_flights)
+
+    windowed_monitor = PriceMonitor(provider=provider,
+                                    number_of_days=30,
+                                    directions=(('TSE', 'ALA'),),
+                                    window_days=10)
+    windowed_flights = await windowed_monitor.get_cheapest_flights()
+
+    assert [(c.kwargs['date_from'], c.kwargs['date_to']) for c in provider.get_flights.await_args_list] == [
+        (date(2020, 8, 1), date(2020, 8, 10)),
+        (date(2020, 8, 11), date(2020, 8, 20)),
+        (date(2020, 8, 21), date(2020, 8, 30)),
+        (date(2020, 8, 31), date(2020, 8, 31)),
+    ]
+    whole_span_flights = await PriceMonitor(provider=provider,
+                                            number_of_days=30,
+                                            directions=(('TSE', 'ALA'),)).get_cheapest_flights()
+    assert windowed_flights
+    assert sorted(windowed_flights, key=lambda f: f.departure_date) == \
+        sorted(whole_span_flights, key=lambda f: f.departure_date)
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-01-01')
+async def test_price_monitor_uses_horizon_of_each_direction(simple_tse_ala_flight):
+    skypicker_patched = mock_skypicker_provider()
+    skypicker_patched.get_flights = asynctest.CoroutineMock(return_value=[simple_tse_ala_flight])
+    skypicker_patched.confirm_flight = asynctest.CoroutineMock(return_value=(simple_tse_ala_flight, True))
+
+    price_monitor = PriceMonitor(provider=skypicker_patched,
+                                 number_of_days=30,
+                                 directions=(('TSE', 'ALA'), ('ALA', 'TSE')),
+                                 horizons={('ALA', 'TSE'): 90},
+                                 max_concurrent_directions=1)
+
+    await price_monitor.get_cheapest_flights()
+
+    date_from = date.fromisoformat('2020-01-01')
+    skypicker_patched.get_flights.assert_has_awaits([
+        call(city_code_from='TSE', city_code_to='ALA', date_from=date_from, date_to=date.fromisoformat('2020-01-31')),
+        call(city_code_from='ALA', city_code_to='TSE', date_from=date_from, date_to=date.fromisoformat('2020-03-31')),
+    ])
@@ -0,0 +1,119 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.db.schema import price_update_jobs_table, price_updates_table, Status
+from app.price_updater.jobs import (
+    claim_job, complete_job, count_missing_jobs, drop_outdated_jobs, enqueue_jobs, get_jobs_progress,
+    get_refreshed_spans, get_unfinished_routes, release_job, requeue_unfinished_jobs
+)
+from app.price_updater.routes import Route
+
+
+async def create_price_update(pg, routes, date_spans=None) -> int:
+    query = price_updates_table.insert() \
+        .values(status=Status.in_process.value) \
+        .returning(price_updates_table.c.id)
+    async with pg.transaction() as db_conn:
+        update_id = await db_conn.fetchval(query)
+        await enqueue_jobs(update_id, routes, db_conn, date_spans=date_spans)
+    return update_id
+
+
+@pytest.mark.asyncio
+async def test_jobs_queue(pg):
+    update_id = await create_price_update(pg, [Route('TSE', 'ALA', 30), Route('ALA', 'TSE', 60)])
+
+    first = await claim_job(pg)
+    second = await claim_job(pg)
+    assert (first['city_code_from'], first['city_code_to'], first['number_of_days']) == ('TSE', 'ALA', 30)
+    assert (second['city_code_from'], second['city_code_to'], second['number_of_days']) == ('ALA', 'TSE', 60)
+    assert first['attempts'] == second['attempts'] == 1
+    assert await claim_job(pg) is None
+    assert await get_jobs_progress(update_id, pg) == (2, 0)
+
+    async with pg.transaction() as db_conn:
+        assert await complete_job(db_conn, first, 5)
+    await release_job(pg, second)
+    assert await get_jobs_progress(update_id, pg) == (1, 5)
+
+    retried = await claim_job(pg)
+    assert retried['id'] == second['id'] and retried['attempts'] == 2
+
+
+@pytest.mark.asyncio
+async def test_abandoned_jobs_are_taken_over_and_failed(pg):
+    update_id = await create_price_update(pg, [Route('TSE', 'ALA', 30)])
+    abandoned = await claim_job(pg)
+
+    # Claims within the lease are respected
+    assert await claim_job(pg) is None
+    taken_over = await claim_job(pg, lease=timedelta(0))
+    assert taken_over['id'] == abandoned['id'] and taken_over['claim_token'] != abandoned['claim_token']
+    assert not await complete_job(pg, abandoned, 1)
+
+    assert await get_jobs_progress(update_id, pg, lease=timedelta(0), max_attempts=3) == (1, 0)
+    assert await get_jobs_progress(update_id, pg, lease=timedelta(0), max_attempts=2) == (0, 0)
+    assert await claim_job(pg, lease=timedelta(0), max_attempts=2) is None
+
+
+@pytest.mark.asyncio
+async def test_jobs_without_flights_are_requeued(pg):
+    routes = [Route('TSE', 'ALA', 30), Route('ALA', 'TSE', 30), Route('TSE', 'MOW', 30)]
+    update_id = await create_price_update(pg, routes)
+    saved, empty, failed = [await claim_job(pg) for _ in routes]
+    await complete_job(pg, saved, 5)
+    await complete_job(pg, empty, 0)
+    await release_job(pg, failed, max_attempts=1)
+
+    assert await get_jobs_progress(update_id, pg) == (0, 5)
+    assert await count_missing_jobs(update_id, pg) == 2
+    assert await get_unfinished_routes(update_id, pg) == ([Route('ALA', 'TSE', 30), Route('TSE', 'MOW', 30)], {})
+
+    await requeue_unfinished_jobs(update_id, pg)
+
+    assert await get_jobs_progress(update_id, pg) == (2, 5)
+    requeued = [await claim_job(pg) for _ in range(2)]
+    assert [job['id'] for job in requeued] == [empty['id'], failed['id']]
+    assert [job['attempts'] for job in requeued] == [1, 1]
+    assert await claim_job(pg) is None
+
+
+@pytest.mark.asyncio
+async def test_refreshed_spans(pg):
+    routes = [Route('TSE', 'ALA', 30), Route('ALA', 'TSE', 30), Route('TSE', 'MOW', 30)]
+    span = (date(2030, 8, 1), date(2030, 8, 30))
+    started_at = datetime.utcnow()
+    completed_update_id = await create_price_update(pg, routes, date_spans={('TSE', 'ALA'): span})
+    saved, empty, _ = [await claim_job(pg) for _ in routes]
+    await complete_job(pg, saved, 5)
+    await complete_job(pg, empty, 0)
+    await pg.execute(price_updates_table.update()
+                     .where(price_updates_table.c.id == completed_update_id)
+                     .values(status=Status.completed.value))
+    # Flights of an unfinished update aren't visible yet
+    await create_price_update(pg, [Route('TSE', 'MOW', 30)])
+    await complete_job(pg, await claim_job(pg), 5)
+
+    spans = await get_refreshed_spans(started_at - timedelta(minutes=1), pg)
+
+    assert list(spans) == [('TSE', 'ALA')]
+    (date_from, date_to, refreshed_at), = spans['TSE', 'ALA']
+    assert (date_from, date_to) == span
+    assert refreshed_at >= started_at - timedelta(seconds=1)
+    assert await get_refreshed_spans(datetime.utcnow() + timedelta(minutes=1), pg) == {}
+
+
+@pytest.mark.asyncio
+async def test_outdated_jobs_are_dropped(pg):
+    routes = [Route('TSE', 'ALA', 30), Route('ALA', 'TSE', 30)]
+    outdated_update_id = await create_price_update(pg, routes)
+    await pg.execute(price_updates_table.update()
+                     .where(price_updates_table.c.id == outdated_update_id)
+                     .values(created_at=datetime.utcnow() - timedelta(days=8)))
+    recent_update_id = await create_price_update(pg, routes)
+
+    await drop_outdated_jobs(timedelta(days=7), pg)
+
+    rows = await pg.fetch(price_update_jobs_table.select())
+    assert [row['update_id'] for row in rows] == [recent_update_id] * len(routes)
@@ -0,0 +1,80 @@
+import asynctest
+import pytest
+
+from app.price_updater.worker import PriceUpdateWorker
+from tests.helpers import MockPG, FileBasedAirlineTicketProvider
+
+
+@pytest.fixture
+def job():
+    return {
+        'id': 7,
+        'update_id': 1,
+        'city_code_from': 'TSE',
+        'city_code_to': 'ALA',
+        'attempts': 1,
+        'claim_token': 'token',
+        'number_of_days': None,
+        'date_from': None,
+        'date_to': None,
+    }
+
+
+@pytest.fixture
+def worker(mocker, get_flights_simple_response):
+    worker = PriceUpdateWorker(
+        pg=MockPG(),
+        provider=FileBasedAirlineTicketProvider(get_flights_simple_response),
+        number_of_days=30,
+    )
+    mocker.patch.object(worker, '_get_monitor')
+    return worker
+
+
+@pytest.mark.asyncio
+async def test_worker_saves_flights_and_completes_job(worker, job, simple_tse_ala_flight):
+    pg = worker._pg
+    worker._get_monitor.return_value.get_cheapest_flights = asynctest.CoroutineMock(
+        return_value=[simple_tse_ala_flight]
+    )
+
+    await worker._process_job(job)
+
+    worker._get_monitor.assert_called_once_with(job)
+    assert pg.copied_records == 1
+    assert pg.statuses == ['completed']
+    assert pg.open_transactions == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_releases_failed_job(worker, job):
+    pg = worker._pg
+    worker._get_monitor.return_value.get_cheapest_flights = asynctest.CoroutineMock(side_effect=RuntimeError)
+
+    await worker._process_job(job)
+
+    assert pg.copied_records == 0
+    assert pg.statuses == ['pending']
+
+
+@pytest.mark.asyncio
+async def test_worker_fails_job_without_attempts_left(worker, job):
+    job['attempts'] = 3
+    worker._get_monitor.return_value.get_cheapest_flights = asynctest.CoroutineMock(side_effect=RuntimeError)
+
+    await worker._process_job(job)
+
+    assert worker._pg.statuses == ['failed']
+
+
+@pytest.mark.asyncio
+async def test_worker_does_not_release_job_claimed_by_another_worker(worker, job, simple_tse_ala_flight):
+    pg = worker._pg
+    pg.fetchval = asynctest.CoroutineMock(return_value=None)
+    worker._get_monitor.return_value.get_cheapest_flights = asynctest.CoroutineMock(
+        return_value=[simple_tse_ala_flight]
+    )
+
+    await worker._process_job(job)
+
+    assert pg.statuses == []
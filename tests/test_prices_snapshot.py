@@ -0,0 +1,144 @@
+import asyncio
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from app.db.schema import Status, current_prices_table, price_updates_table
+from app.handlers.prices import decode_cursor, encode_cursor
+from app.price_updater import Flight
+from app.price_updater.flight import bulk_insert_flights, create_flights_partition
+from app.snapshot import PricesSnapshot, PricesBodyCache, PricesSnapshotStore
+
+
+@pytest.fixture
+def snapshot_records():
+    return [
+        {'id': 1, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 5), 'price': 123, 'booking_token': 'token_1'},
+        {'id': 2, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'MOW',
+         'departure_date': date(2020, 8, 5), 'price': 234, 'booking_token': 'token_2'},
+        {'id': 3, 'update_id': 7, 'city_code_from': 'ALA', 'city_code_to': 'TSE',
+         'departure_date': date(2020, 8, 6), 'price': 132, 'booking_token': 'token_3'},
+        {'id': 4, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 6), 'price': 412, 'booking_token': 'token_4'},
+    ]
+
+
+@pytest.mark.parametrize(
+    'city_from, city_to, expected_ids',
+    [
+        (None, None, {1, 2, 3, 4}),
+        ('TSE', 'ALA', {1, 4}),
+        ('TSE', None, {1, 2, 4}),
+        (None, 'TSE', {3}),
+        ('LED', 'TSE', set()),
+    ]
+)
+def test_snapshot_get_flights(snapshot_records, city_from, city_to, expected_ids):
+    snapshot = PricesSnapshot.from_records(7, snapshot_records)
+
+    flights = snapshot.get_flights(city_from, city_to)
+
+    assert {flight['id'] for flight in flights} == expected_ids
+    assert snapshot.update_id == 7
+
+
+@pytest.mark.asyncio
+async def test_body_cache_serializes_concurrent_requests_once(mocker, snapshot_records):
+    snapshot = PricesSnapshot.from_records(7, snapshot_records)
+    encode_body = mocker.spy(PricesSnapshot, 'encode_body')
+    cache = PricesBodyCache()
+
+    bodies = await asyncio.gather(*(cache.get_body(snapshot, 'TSE') for _ in range(3)))
+
+    assert encode_body.call_count == 1
+    assert bodies[0] is bodies[1] is bodies[2]
+    assert await cache.get_body(snapshot, 'TSE') is bodies[0]
+    # Prepared responses aren't cached again
+    assert await cache.get_body(snapshot, 'TSE', 'ALA') is snapshot.get_body('TSE', 'ALA')
+    assert await cache.get_body(snapshot, 'LED', 'TSE') is snapshot.empty_body
+    assert cache.size == bodies[0].size
+
+
+@pytest.mark.asyncio
+async def test_body_cache_evicts_least_recently_used_bodies(snapshot_records):
+    snapshot = PricesSnapshot.from_records(7, snapshot_records)
+    from_tse = snapshot.encode_body('TSE')
+    to_tse = snapshot.encode_body(None, 'TSE')
+    cache = PricesBodyCache(max_bytes=from_tse.size + to_tse.size)
+
+    await cache.get_body(snapshot, 'TSE')
+    await cache.get_body(snapshot, None, 'TSE')
+    await cache.get_body(snapshot, 'TSE')
+    await cache.get_body(snapshot, 'ALA')
+
+    assert list(cache._bodies) == [(7, 'TSE', None), (7, 'ALA', None)]
+    assert cache.size <= from_tse.size + to_tse.size
+
+    # Responses of the previous snapshot are dropped
+    await cache.get_body(PricesSnapshot.from_records(8, snapshot_records), 'TSE')
+    assert list(cache._bodies) == [(8, 'TSE', None)]
+
+
+@pytest.mark.parametrize(
+    'kwargs, expected_pages',
+    [
+        ({}, [[3, 1], [4, 2]]),
+        ({'city_from': 'TSE'}, [[1, 4], [2]]),
+        ({'date_from': date(2020, 8, 6), 'date_to': date(2020, 8, 6)}, [[3, 4]]),
+        ({'max_price': Decimal(300)}, [[3, 1], [2]]),
+        ({'city_from': 'TSE', 'city_to': 'ALA', 'max_price': Decimal(100)}, [[]]),
+    ]
+)
+def test_snapshot_get_page(snapshot_records, kwargs, expected_pages):
+    snapshot = PricesSnapshot.from_records(7, snapshot_records)
+
+    pages = []
+    after = None
+    while True:
+        flights, after = snapshot.get_page(after=after, limit=2, **kwargs)
+        pages.append([flight['id'] for flight in flights])
+        if after is None:
+            break
+
+    assert pages == expected_pages
+
+
+def test_cursor_round_trip():
+    key = ('TSE', 'ALA', date(2020, 8, 5))
+
+    assert decode_cursor(encode_cursor(key)) == key
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor')
+
+
+@pytest.mark.asyncio
+async def test_snapshot_of_current_prices_has_columns_of_flights(pg):
+    previous_update_id, update_id = [
+        await pg.fetchval(price_updates_table.insert()
+                          .values(status=Status.completed.value, created_at=datetime(2020, 8, 1, hour))
+                          .returning(price_updates_table.c.id))
+        for hour in (1, 2)
+    ]
+    async with pg.transaction() as db_conn:
+        await create_flights_partition(update_id, db_conn)
+        await bulk_insert_flights([Flight('TSE', 'ALA', date(2020, 8, 5), Decimal(123), 'token_1')], update_id, db_conn)
+    # The price was set by the previous update and is unchanged since
+    await pg.execute(current_prices_table.insert().values(
+        city_code_from='TSE', city_code_to='ALA', departure_date=date(2020, 8, 5), price=Decimal(123),
+        booking_token='token_1', update_id=previous_update_id,
+    ))
+
+    rows = {}
+    for incremental in (False, True):
+        store = PricesSnapshotStore(pg, incremental=incremental)
+        await store.refresh()
+        body = await store.get_body('TSE', 'ALA')
+        rows[incremental] = json.loads(body.codings['identity'])['data']
+
+    assert rows[True] == rows[False] == [{
+        'id': 1, 'update_id': update_id, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+        'departure_date': '2020-08-05', 'price': 123, 'booking_token': 'token_1',
+    }]
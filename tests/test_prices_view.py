@@ -0,0 +1,139 @@
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp.web_app import Application
+
+from app.handlers.prices import PricesView
+from app.route_demand import RouteDemandCounter
+from app.snapshot import PricesSnapshot, PricesSnapshotStore
+from tests.helpers import MockPG
+
+
+@pytest.fixture
+def snapshot():
+    return PricesSnapshot.from_records(7, [
+        {'id': 1, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 5), 'price': Decimal(123), 'booking_token': 'token_1'},
+        {'id': 2, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 6), 'price': Decimal(412), 'booking_token': 'token_2'},
+        {'id': 3, 'update_id': 7, 'city_code_from': 'TSE', 'city_code_to': 'ALA',
+         'departure_date': date(2020, 8, 7), 'price': Decimal(321), 'booking_token': 'token_3'},
+    ])
+
+
+async def make_client(snapshot: Optional[PricesSnapshot]) -> TestClient:
+    pg = MockPG()
+    store = PricesSnapshotStore(pg)
+    store._snapshot = snapshot
+    app = Application()
+    app['prices_snapshot'] = store
+    app['route_demand'] = RouteDemandCounter(pg)
+    app.router.add_route('*', '/prices', PricesView)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('params', [
+    {'limit': 'x'},
+    {'limit': '0'},
+    {'limit': '1001'},
+    {'cursor': 'x'},
+    {'max_price': 'x'},
+    {'max_price': 'NaN'},
+    {'date_from': '06.08.2020'},
+    {'date_from': '2020-08-07', 'date_to': '2020-08-06'},
+])
+async def test_prices_page_validates_params(snapshot, params):
+    client = await make_client(snapshot)
+    try:
+        response = await client.get('/prices', params=params)
+        assert response.status == 400
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_prices_pages_are_linked_by_cursor(snapshot):
+    client = await make_client(snapshot)
+    try:
+        params = {'city_from': 'TSE', 'city_to': 'ALA', 'limit': '2'}
+        response = await client.get('/prices', params=params)
+        assert response.status == 200
+        first_page = await response.json()
+        assert [flight['id'] for flight in first_page['data']] == [1, 2]
+        assert first_page['next_cursor'] is not None
+
+        response = await client.get('/prices', params={**params, 'cursor': first_page['next_cursor']})
+        assert response.status == 200
+        last_page = await response.json()
+        assert [flight['id'] for flight in last_page['data']] == [3]
+        assert last_page['next_cursor'] is None
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_prices_page_filters_by_price_and_dates(snapshot):
+    client = await make_client(snapshot)
+    try:
+        response = await client.get('/prices', params={'date_from': '2020-08-06', 'max_price': '400'})
+        assert response.status == 200
+        page = await response.json()
+        assert [flight['id'] for flight in page['data']] == [3]
+        assert page['next_cursor'] is None
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('params', [{}, {'limit': '2'}])
+async def test_prices_are_accepted_before_first_snapshot(params):
+    client = await make_client(None)
+    try:
+        response = await client.get('/prices', params=params)
+        assert response.status == 202
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_prices_are_not_modified_for_matching_etag(snapshot):
+    client = await make_client(snapshot)
+    try:
+        response = await client.get('/prices', params={'city_from': 'TSE', 'city_to': 'ALA'})
+        assert response.status == 200
+        etag = response.headers['ETag']
+
+        response = await client.get('/prices', params={'city_from': 'TSE', 'city_to': 'ALA'},
+                                    headers={'If-None-Match': etag})
+        assert response.status == 304
+        assert response.headers['ETag'] == etag
+
+        response = await client.get('/prices', params={'city_from': 'TSE', 'city_to': 'ALA'},
+                                    headers={'If-None-Match': '"outdated"'})
+        assert response.status == 200
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('accept_encoding, content_encoding', [
+    ('gzip', 'gzip'),
+    ('gzip;q=0', None),
+    ('identity', None),
+])
+async def test_prices_content_encoding_is_negotiated(snapshot, accept_encoding, content_encoding):
+    client = await make_client(snapshot)
+    try:
+        response = await client.get('/prices', headers={'Accept-Encoding': accept_encoding})
+        assert response.status == 200
+        assert response.headers.get('Content-Encoding') == content_encoding
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert [flight['id'] for flight in (await response.json())['data']] == [1, 2, 3]
+    finally:
+        await client.close()
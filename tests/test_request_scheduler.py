@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from app.utils.request_scheduler import RequestScheduler, TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_request_scheduler_limits_concurrency_per_endpoint():
+    scheduler = RequestScheduler(rate=1000, burst=1000, concurrency_limits={'confirm_flight': 2})
+    in_flight = 0
+    max_in_flight = 0
+
+    async def request():
+        nonlocal in_flight, max_in_flight
+        async with scheduler.slot('confirm_flight'):
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*(request() for _ in range(6)))
+
+    stats = scheduler.stats()['confirm_flight']
+    assert max_in_flight == 2
+    assert stats['completed'] == 6
+    # the first two requests didn't have to wait
+    assert stats['max_queued'] == 4
+    assert stats['queued'] == stats['in_flight'] == 0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=2)
+    loop = asyncio.get_event_loop()
+
+    started = loop.time()
+    for _ in range(6):
+        await bucket.acquire()
+
+    # 2 tokens are available at once, the rest are refilled at 100 per second
+    assert loop.time() - started >= 0.035
@@ -0,0 +1,61 @@
+from datetime import date
+from types import SimpleNamespace
+
+import asynctest
+import pytest
+
+from app.handlers.prices import count_route_demand
+from app.route_demand import RouteDemandCounter
+from app.snapshot import PricesSnapshot
+
+
+@pytest.mark.asyncio
+async def test_counter_is_capped(mocker):
+    add_route_demand = mocker.patch('app.route_demand.add_route_demand', new=asynctest.CoroutineMock())
+    counter = RouteDemandCounter(pg=None, max_routes=2)
+
+    for city_to in ('ALA', 'NQZ', 'LED', 'ALA'):
+        counter.count('TSE', city_to)
+    await counter.flush()
+
+    add_route_demand.assert_awaited_once_with({('TSE', 'ALA'): 2, ('TSE', 'NQZ'): 1}, None)
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_counts_within_cap(mocker):
+    add_route_demand = mocker.patch('app.route_demand.add_route_demand',
+                                    new=asynctest.CoroutineMock(side_effect=[OSError, None]))
+    counter = RouteDemandCounter(pg=None, max_routes=2)
+    counter.count('TSE', 'ALA')
+    counter.count('TSE', 'NQZ')
+
+    with pytest.raises(OSError):
+        await counter.flush()
+    counter.count('TSE', 'LED')
+    counter.count('TSE', 'ALA')
+    await counter.flush()
+
+    add_route_demand.assert_awaited_with({('TSE', 'ALA'): 2, ('TSE', 'NQZ'): 1}, None)
+
+
+def test_only_snapshot_directions_are_counted():
+    snapshot = PricesSnapshot.from_records(7, [
+        {'id': 1, 'city_code_from': 'TSE', 'city_code_to': 'ALA', 'departure_date': date(2020, 8, 5), 'price': 123},
+    ])
+    counter = RouteDemandCounter(pg=None)
+    app = {'prices_snapshot': SimpleNamespace(snapshot=snapshot), 'route_demand': counter}
+
+    count_route_demand(app, 'TSE', 'ALA')
+    count_route_demand(app, 'ALA', 'TSE')
+    count_route_demand(app, 'XXX', 'YYY')
+
+    assert counter._counts == {('TSE', 'ALA'): 1}
+
+
+def test_nothing_is_counted_before_first_snapshot():
+    counter = RouteDemandCounter(pg=None)
+    app = {'prices_snapshot': SimpleNamespace(snapshot=None), 'route_demand': counter}
+
+    count_route_demand(app, 'TSE', 'ALA')
+
+    assert not counter._counts
@@ -0,0 +1,39 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app.db.schema import price_history_table
+from app.price_updater.routes import Route, add_route_demand, decay_route_demand, get_route_volatility, load_routes
+
+DAY = timedelta(days=1)
+
+
+@pytest.mark.asyncio
+async def test_route_volatility(pg):
+    today = date.today()
+    for departure_date, observed_on, price_cents in [
+        # Window 0: the price changed
+        (today + DAY, today - DAY, 10000),
+        (today + DAY, today, 12000),
+        # Window 1: the price didn't change within the last 14 days
+        (today + 35 * DAY, today - 20 * DAY, 30000),
+        (today + 35 * DAY, today - DAY, 10000),
+        (today + 35 * DAY, today, 10000),
+    ]:
+        await pg.execute(price_history_table.insert().values(
+            city_code_from='TSE', city_code_to='ALA', departure_date=departure_date,
+            observed_on=observed_on, price_cents=price_cents,
+        ))
+
+    assert await get_route_volatility(30, 14, pg) == {('TSE', 'ALA', 0): 1.0, ('TSE', 'ALA', 1): 0.0}
+
+
+@pytest.mark.asyncio
+async def test_route_demand(pg):
+    await add_route_demand({('TSE', 'ALA'): 10, ('ALA', 'TSE'): 4}, pg)
+    await decay_route_demand(0.5, pg)
+
+    routes = {(route.city_code_from, route.city_code_to): route for route in await load_routes(pg, due_only=True)}
+    assert routes['TSE', 'ALA'].demand == 5
+    assert routes['ALA', 'TSE'].demand == 2
+    assert routes['ALA', 'TSE'] == Route('ALA', 'TSE', 180, DAY, None, 2)
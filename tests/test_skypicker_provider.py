@@ -1,10 +1,11 @@
 from datetime import date
 
 import pytest
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientResponseError
 
 from app.price_updater import SkypickerProvider
-from tests.helpers import MockResponse
+from app.utils.resilience import CircuitOpenError
+from tests.helpers import MockResponse, departure_date
 
 
 @pytest.mark.asyncio
@@ -31,7 +32,7 @@ async def test_get_flights(mocker, get_flights_simple_response):
                     data['cityCodeTo'] == flight.city_code_to and
                     data['price'] == flight.price and
                     data['booking_token'] == flight.booking_token and
-                    date.fromtimestamp(data['dTime']) == flight.departure_date):
+                    departure_date(data['dTime']) == flight.departure_date):
                 break
         else:
             assert 'SkypickerProvider returned Flight which was not presented in original data'
@@ -114,3 +115,93 @@ async def test_confirm_flight_retries_not_confirmed(mocker, mock_sleep,
     assert mock_get.call_count == len(confirm_flight_responses)
     assert flight == simple_tse_ala_flight
     assert not confirmed
+
+
+@pytest.mark.asyncio
+async def test_get_flights_retries_server_errors(mocker, mock_sleep, get_flights_simple_response):
+    responses = [MockResponse({}, 503), MockResponse({}, 502), MockResponse(get_flights_simple_response, 200)]
+    mock_get = mocker.patch('aiohttp.ClientSession.get', side_effect=responses)
+
+    async with ClientSession() as client_session:
+        skypicker = SkypickerProvider(client_session)
+        flights = await skypicker.get_flights(
+            'TSE',
+            'ALA',
+            date.fromisoformat('2020-08-03'),
+            date.fromisoformat('2020-09-03')
+        )
+
+    assert mock_get.call_count == 3
+    assert len(flights) == len(get_flights_simple_response['data'])
+
+
+@pytest.mark.asyncio
+async def test_get_flights_does_not_retry_client_errors(mocker, mock_sleep):
+    mock_get = mocker.patch('aiohttp.ClientSession.get', return_value=MockResponse({}, 400))
+
+    async with ClientSession() as client_session:
+        skypicker = SkypickerProvider(client_session)
+        with pytest.raises(ClientResponseError):
+            await skypicker.get_flights(
+                'TSE',
+                'ALA',
+                date.fromisoformat('2020-08-03'),
+                date.fromisoformat('2020-09-03')
+            )
+
+    mock_get.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_get_flights_fails_fast_when_circuit_is_open(mocker, mock_sleep):
+    mock_get = mocker.patch('aiohttp.ClientSession.get', return_value=MockResponse({}, 503))
+
+    async with ClientSession() as client_session:
+        skypicker = SkypickerProvider(client_session)
+        # 3 tries, then 2 more tries open the circuit, then no requests at all
+        for expected_error in (ClientResponseError, CircuitOpenError, CircuitOpenError):
+            with pytest.raises(expected_error):
+                await skypicker.get_flights(
+                    'TSE',
+                    'ALA',
+                    date.fromisoformat('2020-08-03'),
+                    date.fromisoformat('2020-09-03')
+                )
+
+    assert mock_get.call_count == SkypickerProvider.CIRCUIT_FAILURE_THRESHOLD
+
+
+@pytest.mark.asyncio
+async def test_confirm_flight_gives_up_after_deadline(mocker, mock_sleep, simple_tse_ala_flight):
+    not_checked = {'flights_checked': False, 'flights_invalid': False, 'price_change': False}
+    mock_get = mocker.patch('aiohttp.ClientSession.get', return_value=MockResponse(not_checked, 200))
+
+    async with ClientSession() as client_session:
+        skypicker = SkypickerProvider(client_session)
+        skypicker.CONFIRM_DEADLINE = 0.5
+        flight, confirmed = await skypicker.confirm_flight(simple_tse_ala_flight)
+
+    mock_get.assert_called_once()
+    assert not confirmed
+    assert skypicker.confirm_polls.count == 1
+    assert skypicker.confirm_polls.bucket_counts[0] == 1
+
+    skypicker.report_metrics()
+    assert skypicker.confirm_polls.count == skypicker.confirm_latency.count == 0
+    assert skypicker.confirm_polls.bucket_counts[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_get_cheapest_flights_streaming(mocker, get_flights_simple_response):
+    mocker.patch('aiohttp.ClientSession.get', return_value=MockResponse(get_flights_simple_response, 200))
+    mocker.patch.object(SkypickerProvider, 'STREAM_CHUNK_SIZE', 100)
+    dates = date.fromisoformat('2020-08-03'), date.fromisoformat('2020-09-03')
+
+    async with ClientSession() as client_session:
+        loaded = await SkypickerProvider(client_session).get_cheapest_flights('TSE', 'ALA', *dates, number=2)
+        streamed = await SkypickerProvider(client_session, stream_responses=True).get_cheapest_flights(
+            'TSE', 'ALA', *dates, number=2
+        )
+
+    assert streamed
+    assert streamed == loaded
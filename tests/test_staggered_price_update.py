@@ -0,0 +1,100 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import asynctest
+import pytest
+from freezegun import freeze_time
+
+from app.price_updater import Flight
+from app.price_updater.routes import Route
+from app.price_updater.staggered_price_update import StaggeredPriceUpdateScheduler
+from tests.helpers import MockPG, FileBasedAirlineTicketProvider
+
+DAY = timedelta(days=1)
+
+
+@pytest.fixture
+def routes():
+    return [
+        Route('TSE', 'ALA', 59, DAY, refreshed_at=datetime(2020, 1, 2), demand=30),
+        Route('ALA', 'TSE', 29, DAY, refreshed_at=None, demand=0),
+    ]
+
+
+@pytest.fixture
+def scheduler(mocker, routes, get_flights_simple_response):
+    scheduler = StaggeredPriceUpdateScheduler(
+        pg=MockPG(),
+        provider=FileBasedAirlineTicketProvider(get_flights_simple_response),
+        number_of_days=30,
+        window_days=30,
+        tasks_per_hour=24,
+        tick_interval=600,
+    )
+    mocker.patch.object(scheduler, '_schedule_next_update')
+    mocker.patch('app.price_updater.staggered_price_update.load_routes',
+                 new=asynctest.CoroutineMock(return_value=routes))
+    mocker.patch('app.price_updater.staggered_price_update.get_route_volatility',
+                 new=asynctest.CoroutineMock(return_value={('TSE', 'ALA', 1): 0.5}))
+    mocker.patch('app.price_updater.staggered_price_update.decay_route_demand', new=asynctest.CoroutineMock())
+    # The first window of TSE → ALA was refreshed just now, the second one a day ago
+    mocker.patch('app.price_updater.staggered_price_update.get_refreshed_spans',
+                 new=asynctest.CoroutineMock(return_value={('TSE', 'ALA'): [
+                     (date(2020, 1, 2), date(2020, 1, 31), datetime(2020, 1, 2)),
+                     (None, None, datetime(2020, 1, 1)),
+                 ]}))
+    mocker.patch('app.price_updater.periodical_price_update.get_jobs_progress',
+                 new=asynctest.CoroutineMock(return_value=(1, 1)))
+    return scheduler
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-01-02')
+async def test_windows_are_boosted_by_demand_and_volatility(scheduler):
+    await scheduler._reload_tasks()
+
+    boosts = {key: task.boost for key, task in scheduler._tasks.items()}
+    # Mean demand is 15
+    assert boosts == {
+        ('TSE', 'ALA', 0): 3,
+        ('TSE', 'ALA', 1): 5,
+        ('ALA', 'TSE', 0): 1,
+    }
+    assert scheduler._tasks['TSE', 'ALA', 0].due_at == datetime(2020, 1, 2) + DAY / 3
+    assert scheduler._tasks['TSE', 'ALA', 1].due_at == datetime(2020, 1, 1) + DAY / 5
+    assert scheduler._tasks['ALA', 'TSE', 0].due_at == datetime.min
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-01-02')
+async def test_due_windows_are_refreshed_within_budget_one_per_route(scheduler):
+    await scheduler._load_routes()
+
+    # 24 windows per hour make 4 windows per 10 minutes tick, but there are only two routes
+    assert [task.key for task in scheduler._current_tasks] == [('ALA', 'TSE', 0), ('TSE', 'ALA', 1)]
+    assert scheduler._updater.directions == [('ALA', 'TSE'), ('TSE', 'ALA')]
+    assert scheduler._updater.date_spans == {
+        ('ALA', 'TSE'): (date(2020, 1, 2), date(2020, 1, 31)),
+        ('TSE', 'ALA'): (date(2020, 2, 1), date(2020, 3, 1)),
+    }
+    assert len(scheduler._queue) == 1
+
+
+@pytest.mark.asyncio
+@freeze_time('2020-01-02')
+async def test_failed_windows_are_retried_on_their_own(scheduler, put_cheapest_flights):
+    scheduler._updater.put_cheapest_flights = put_cheapest_flights(
+        [Flight('TSE', 'ALA', date(2020, 2, 5), Decimal(100), 'token')]
+    )
+
+    await scheduler._update_prices()
+
+    assert scheduler._pg.statuses == ['in_process', 'completed']
+    refreshed = scheduler._tasks['TSE', 'ALA', 1]
+    assert refreshed.attempts == 0
+    assert refreshed.due_at == datetime(2020, 1, 2) + DAY / 5
+    failed = scheduler._tasks['ALA', 'TSE', 0]
+    assert failed.attempts == 1
+    assert failed.due_at == datetime(2020, 1, 2) + scheduler.RETRY_DELAY
+    assert len(scheduler._queue) == 3
+    scheduler._schedule_next_update.assert_called_once()